@@ -0,0 +1,385 @@
+'''
+A local stand-in for the block explorers used by validate_certificates. A
+single server answers both:
+  GET  /v1/btc/{network}/addrs/{address}/full   blockcypher format, paginated
+                                                with limit/before/hasMore
+  GET  /v1/btc/{network}/txs/{txid}             blockcypher format
+  POST /                                        btcd JSON-RPC
+                                                searchrawtransactions and
+                                                getrawtransaction
+  POST /, /wallet/{name}                        Bitcoin Core JSON-RPC with
+                                                watch-only descriptor wallets
+                                                (listtransactions,
+                                                gettransaction and
+                                                getrawtransaction by block)
+JSON-RPC requests can be batched. start_fake_electrum serves the same
+histories over the electrum protocol (newline-delimited JSON-RPC over TCP).
+Address histories are registered with add_history; their transactions are
+sent by the address, i.e. spend an output of a funding transaction that pays
+to it. Every request can be
+delayed by a fixed latency and fail with a configurable probability.
+'''
+import os
+import re
+import sys
+import json
+import time
+import random
+import hashlib
+import threading
+import socketserver
+from collections import Counter
+from urllib.parse import urlparse, parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir)))
+
+from blockchain_certificates import utils
+
+BLOCKCYPHER_PATH = re.compile(r'^/v1/btc/(main|test3)/addrs/([^/]+)/full$')
+BLOCKCYPHER_TX_PATH = re.compile(r'^/v1/btc/(main|test3)/txs/([0-9a-f]+)$')
+WALLET_PATH = re.compile(r'^/wallet/([^/]+)$')
+# methods that are called on a wallet; they get its name as first argument
+WALLET_METHODS = ('getaddressinfo', 'importdescriptors', 'listtransactions',
+                  'gettransaction')
+
+
+'''
+A transaction of an address history; outputs are script hex strings and
+inputs (previous txid, vout) tuples of outputs of sender
+'''
+class FakeTx(object):
+    __slots__ = ('txid', 'block_height', 'confirmations', 'scripts', 'sender',
+                 'inputs')
+
+    def __init__(self, txid, block_height, confirmations, scripts, sender=None,
+                 inputs=()):
+        self.txid = txid
+        self.block_height = block_height
+        self.confirmations = confirmations
+        self.scripts = scripts
+        self.sender = sender
+        self.inputs = inputs
+
+    def to_blockcypher(self):
+        return { "hash": self.txid, "block_height": self.block_height,
+                 "confirmations": self.confirmations,
+                 "inputs": [ { "prev_hash": t, "output_index": n,
+                               "addresses": [ self.sender ] } for t, n in self.inputs ],
+                 "outputs": [ { "script": s, "value": 0 } for s in self.scripts ] }
+
+    def to_btcd(self):
+        return { "txid": self.txid, "confirmations": self.confirmations,
+                 "blockheight": self.block_height,
+                 "vin": [ { "txid": t, "vout": n } for t, n in self.inputs ],
+                 "vout": [ { "n": i, "value": 0, "scriptPubKey": { "hex": s } }
+                           for i, s in enumerate(self.scripts) ] }
+
+    def block_hash(self):
+        return '{:064x}'.format(self.block_height)
+
+    # a serialized transaction with one input; segwit in odd blocks
+    def to_raw(self):
+        segwit = self.block_height % 2 == 1
+        raw = '02000000' + ('0001' if segwit else '') + _varint(len(self.inputs))
+        for t, n in self.inputs:
+            # txids are serialized in reverse byte order
+            raw += bytes.fromhex(t)[::-1].hex() + n.to_bytes(4, 'little').hex() + '00' + 'ffffffff'
+        raw += _varint(len(self.scripts))
+        for script in self.scripts:
+            raw += '0000000000000000' + _varint(len(script) // 2) + script
+        if segwit:
+            raw += ('02' + '47' + '30' * 71 + '21' + '02' * 33) * len(self.inputs)
+        return raw + '00000000'
+
+
+def _varint(n):
+    if n < 0xfd:
+        return '{:02x}'.format(n)
+    return 'fd' + n.to_bytes(2, 'little').hex()
+
+
+class FakeExplorer(object):
+    def __init__(self, latency=0.0, failure_rate=0.0, seed=None):
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.histories = {}
+        # txid -> (tx, index in its block)
+        self.txs = {}
+        # wallet name -> watched addresses
+        self.wallets = {}
+        # electrum script hash -> address
+        self.scripthashes = {}
+        self.tip_height = 0
+        self.requests = Counter()
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    '''
+    Registers the history of an address; txs must be newest first
+    '''
+    def add_history(self, address, txs):
+        self.histories[address] = txs
+        try:
+            self.scripthashes[utils.address_to_scripthash(address)] = address
+            script = utils.address_to_script_pub_key(address)
+        except ValueError:
+            script = None
+        if script and txs:
+            funding = FakeTx(hashlib.sha256(('funding' + address).encode()).hexdigest(),
+                             txs[-1].block_height, txs[-1].confirmations, [ script ])
+            self.txs[funding.txid] = (funding, 0)
+            for tx in txs:
+                tx.sender = address
+                tx.inputs = [ (funding.txid, 0) ]
+        # newest first, so the first tx of a block has the highest index
+        in_block = Counter()
+        for tx in reversed(txs):
+            self.tip_height = max(self.tip_height, tx.block_height + tx.confirmations - 1)
+            self.txs[tx.txid] = (tx, in_block[tx.block_height])
+            in_block[tx.block_height] += 1
+
+    '''
+    Mines blocks: adds txs (newest first, in blocks after the tip) to the
+    newest end of the address' history and updates all the confirmations
+    '''
+    def extend_history(self, address, txs, tip_height):
+        for tx, index in self.txs.values():
+            tx.confirmations += tip_height - self.tip_height
+        history = self.histories[address]
+        self.add_history(address, txs + history)
+        self.tip_height = tip_height
+
+    def getblockcount(self):
+        return self.tip_height
+
+    def should_fail(self):
+        with self._lock:
+            return self._random.random() < self.failure_rate
+
+    def count(self, kind):
+        with self._lock:
+            self.requests[kind] += 1
+
+    def blockcypher_page(self, address, limit, before, after=None):
+        txs = self.histories.get(address)
+        if txs is None:
+            return { "error": "Address not found" }
+        if before is not None:
+            txs = [ tx for tx in txs if tx.block_height < before ]
+        if after is not None:
+            txs = [ tx for tx in txs if tx.block_height > after ]
+        page = txs[:limit]
+        return { "address": address, "txs": [ tx.to_blockcypher() for tx in page ],
+                 "hasMore": len(txs) > limit }
+
+    def searchrawtransactions(self, address, verbose=1, skip=0, count=100,
+                              vinextra=0, reverse=False, *args):
+        txs = self.histories.get(address)
+        if txs is None:
+            raise ValueError("No information available about address")
+        # histories are kept newest first
+        ordered = txs if reverse else list(reversed(txs))
+        page = ordered[skip:skip + count]
+        if not page:
+            # like btcd, an empty page is an error
+            raise ValueError("No information available about address")
+        return [ tx.to_btcd() for tx in page ]
+
+    def listwallets(self):
+        return [ name for name, addresses in self.wallets.items()
+                 if addresses is not None ]
+
+    def loadwallet(self, name):
+        if name not in self.wallets:
+            raise ValueError("Wallet file not found")
+        self.wallets[name] = self.wallets[name] or set()
+        return { "name": name }
+
+    def createwallet(self, name, *args):
+        if name in self.wallets:
+            raise ValueError("Wallet already exists")
+        self.wallets[name] = set()
+        return { "name": name }
+
+    def getdescriptorinfo(self, descriptor):
+        return { "descriptor": descriptor + '#fakechks' }
+
+    def getaddressinfo(self, wallet, address):
+        return { "address": address, "ismine": address in self.wallets[wallet] }
+
+    def importdescriptors(self, wallet, requests):
+        for request in requests:
+            self.wallets[wallet].add(re.match(r'^addr\((.+)\)', request['desc']).group(1))
+        return [ { "success": True } for request in requests ]
+
+    # as Core: the count most recent entries after skip, oldest first
+    def listtransactions(self, wallet, label='*', count=10, skip=0,
+                         include_watchonly=False):
+        txs = [ tx for address in sorted(self.wallets[wallet])
+                for tx in self.histories.get(address, []) ]
+        txs.sort(key=lambda tx: (tx.block_height, self.txs[tx.txid][1]), reverse=True)
+        return [ { "address": "", "category": "receive", "amount": 0,
+                   "txid": tx.txid, "confirmations": tx.confirmations,
+                   "blockhash": tx.block_hash(), "blockheight": tx.block_height,
+                   "blockindex": self.txs[tx.txid][1] }
+                 for tx in reversed(txs[skip:skip + count]) ]
+
+    def gettransaction(self, wallet, txid, include_watchonly=True, verbose=False):
+        tx = self.txs.get(txid, (None, 0))[0]
+        if tx is None or not (tx.sender in self.wallets[wallet] or
+                              any(a in self.wallets[wallet] for a in self.histories
+                                  if tx in self.histories[a])):
+            raise ValueError("Invalid or non-wallet transaction id")
+        result = { "txid": txid, "confirmations": tx.confirmations,
+                   "blockhash": tx.block_hash(), "blockheight": tx.block_height,
+                   "amount": 0, "details": [], "hex": tx.to_raw() }
+        if tx.sender in self.wallets[wallet]:
+            result['fee'] = -0.0001
+        return result
+
+    def getrawtransaction(self, txid, verbose=False, blockhash=None):
+        if txid not in self.txs or (blockhash and blockhash != self.txs[txid][0].block_hash()):
+            raise ValueError("No such transaction found in the provided block")
+        return self.txs[txid][0].to_btcd()
+
+    def electrum_call(self, method, params):
+        if method == 'server.version':
+            return [ 'FakeElectrum 1.0', params[1] if len(params) > 1 else '1.4' ]
+        if method == 'blockchain.headers.subscribe':
+            return { "height": self.tip_height, "hex": '00' * 80 }
+        if method == 'blockchain.scripthash.get_history':
+            address = self.scripthashes.get(params[0])
+            # oldest first and in block order
+            return [ { "tx_hash": tx.txid, "height": tx.block_height }
+                     for tx in reversed(self.histories.get(address, [])) ]
+        if method == 'blockchain.transaction.get':
+            if params[0] not in self.txs:
+                raise ValueError("daemon error: No such mempool or blockchain transaction")
+            tx = self.txs[params[0]][0]
+            if len(params) > 1 and params[1]:
+                return dict(tx.to_btcd(), hex=tx.to_raw())
+            return tx.to_raw()
+        raise ValueError("unknown method {}".format(method))
+
+    def call(self, method, params, wallet=None):
+        if method in WALLET_METHODS:
+            if self.wallets.get(wallet) is None:
+                raise ValueError("Requested wallet does not exist or is not loaded")
+            return getattr(self, method)(wallet, *params)
+        return getattr(self, method)(*params)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        explorer = self.server.explorer
+        explorer.count('blockcypher')
+        if explorer.latency:
+            time.sleep(explorer.latency)
+        if explorer.should_fail():
+            self._send(429, { "error": "Limits reached." })
+            return
+        url = urlparse(self.path)
+        match = BLOCKCYPHER_TX_PATH.match(url.path)
+        if match:
+            tx = explorer.txs.get(match.group(2), (None, 0))[0]
+            if tx is None:
+                self._send(404, { "error": "Transaction {} not found.".format(match.group(2)) })
+            else:
+                self._send(200, tx.to_blockcypher())
+            return
+        match = BLOCKCYPHER_PATH.match(url.path)
+        if not match:
+            self._send(404, { "error": "not found" })
+            return
+        query = parse_qs(url.query)
+        limit = int(query.get('limit', ['10'])[0])
+        before = int(query['before'][0]) if 'before' in query else None
+        after = int(query['after'][0]) if 'after' in query else None
+        self._send(200, explorer.blockcypher_page(match.group(2), limit, before, after))
+
+    def do_POST(self):
+        explorer = self.server.explorer
+        explorer.count('btcd')
+        body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        match = WALLET_PATH.match(urlparse(self.path).path)
+        wallet = match.group(1) if match else None
+        if explorer.latency:
+            time.sleep(explorer.latency)
+        if isinstance(body, list):
+            self._send(200, [ self._rpc(explorer, call, wallet) for call in body ])
+        else:
+            self._send(200, self._rpc(explorer, body, wallet))
+
+    def _rpc(self, explorer, body, wallet):
+        if explorer.should_fail():
+            return { "result": None, "id": body.get('id'),
+                     "error": { "code": -32603, "message": "internal error" } }
+        try:
+            result = explorer.call(body['method'], body.get('params', []), wallet)
+            return { "result": result, "error": None, "id": body.get('id') }
+        except Exception as e:
+            return { "result": None, "id": body.get('id'),
+                     "error": { "code": -5, "message": str(e) } }
+
+    def _send(self, status, obj):
+        data = json.dumps(obj).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class _ElectrumHandler(socketserver.StreamRequestHandler):
+    disable_nagle_algorithm = True
+
+    def handle(self):
+        explorer = self.server.explorer
+        for line in self.rfile:
+            call = json.loads(line)
+            explorer.count('electrum')
+            if explorer.latency:
+                time.sleep(explorer.latency)
+            if explorer.should_fail():
+                response = { "id": call['id'],
+                             "error": { "code": -32603, "message": "internal error" } }
+            else:
+                try:
+                    response = { "id": call['id'],
+                                 "result": explorer.electrum_call(call['method'],
+                                                                  call.get('params', [])) }
+                except Exception as e:
+                    response = { "id": call['id'], "error": { "code": 1, "message": str(e) } }
+            response['jsonrpc'] = '2.0'
+            self.wfile.write(json.dumps(response).encode() + b'\n')
+
+
+'''
+Starts the fake explorer in a background thread and returns (server, explorer)
+'''
+def start_fake_explorer(port=0, **kwargs):
+    explorer = FakeExplorer(**kwargs)
+    server = ThreadingHTTPServer(('127.0.0.1', port), _Handler)
+    server.daemon_threads = True
+    server.explorer = explorer
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, explorer
+
+
+'''
+Starts an electrum server (plain TCP) for the histories of explorer in a
+background thread and returns it
+'''
+def start_fake_electrum(explorer, port=0):
+    server = socketserver.ThreadingTCPServer(('127.0.0.1', port), _ElectrumHandler)
+    server.daemon_threads = True
+    server.explorer = explorer
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
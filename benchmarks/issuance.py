@@ -0,0 +1,196 @@
+'''
+End-to-end issuance benchmark. For each batch size it generates synthetic
+certificates and a CSV in a temporary working directory and runs the full
+issue_certificates (and, if java and the itext jars are available,
+create_certificates) flow against a local fake node (see fake_node.py).
+It reports the per-stage timings and counters collected by the
+instrumentation module, certificates per second and node RPC calls.
+
+Usage:
+    python benchmarks/issuance.py [--sizes 10,100,1000] [--owners [--local-keys]]
+                                  [--latency 0.02] [--flow issue|create|both]
+                                  [--streaming]
+                                  [--json issuance.json]
+'''
+import os
+import sys
+import csv
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import warnings
+
+REPO_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
+sys.path.insert(0, REPO_DIR)
+warnings.filterwarnings('ignore', message='sha3 is not working!')
+
+from fake_node import start_fake_node
+from blockchain_certificates import pdf_utils
+from blockchain_certificates import instrumentation
+from blockchain_certificates import issue_certificates
+from blockchain_certificates import create_certificates
+
+ISSUE_TEMPLATE = os.path.join(REPO_DIR, 'sample_issue_certs_dir', 'certificates',
+                              's01-Kostas_Karasavvas.pdf')
+CREATE_TEMPLATE = os.path.join(REPO_DIR, 'sample_create_certs_dir',
+                               'MOOC7_Cert_Template.pdf')
+METADATA_COLUMNS = { "columns": [
+    { "name": { "label": "Student Name", "order": 1, "hide": False } },
+    { "grade": { "label": "Grade", "order": 2, "hide": False } } ] }
+
+
+'''
+Returns (private key, public key hex, legacy address) of a new testnet key
+'''
+def _new_key():
+    from bitcoinutils.setup import setup
+    from bitcoinutils.keys import PrivateKey
+    setup('testnet')
+    priv = PrivateKey()
+    pub = priv.get_public_key()
+    return priv, pub.to_hex(), pub.get_address().to_string()
+
+
+'''
+Writes the CSV and, for the issue flow, n certificates created from the
+template into working_directory/certificates. With owner_keys_file the owner's
+private key is written there so that owner proofs can be signed locally.
+'''
+def make_batch(working_directory, n, owners=False, with_certificates=True,
+               template=ISSUE_TEMPLATE, owner_keys_file=None):
+    certs_dir = os.path.join(working_directory, 'certificates')
+    os.makedirs(certs_dir, exist_ok=True)
+    headers = ['student_id', 'name', 'grade']
+    owner_row = []
+    if owners:
+        headers += ['__OWNER_NAME__', '__OWNER_PK__', '__OWNER_ADDRESS__']
+        owner_key, owner_pk, owner_address = _new_key()
+        owner_row = ['Owner', owner_pk, owner_address]
+        if owner_keys_file:
+            with open(os.path.join(working_directory, owner_keys_file), 'w') as f:
+                f.write(owner_key.to_wif() + '\n')
+
+    with open(os.path.join(working_directory, 'graduates.csv'), 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(headers)
+        for i in range(n):
+            student_id = 'c{:07d}'.format(i)
+            writer.writerow([student_id, 'Student {}'.format(i), '{}/100'.format(i % 100)]
+                            + owner_row)
+            if with_certificates:
+                shutil.copyfile(template, os.path.join(certs_dir,
+                                                       student_id + '-cert.pdf'))
+
+
+'''
+Returns a configuration equivalent to the one load_config() would return
+'''
+def make_conf(working_directory, node_port, issuing_address, **overrides):
+    conf = argparse.Namespace(
+        working_directory=working_directory,
+        pdf_cert_template_file=CREATE_TEMPLATE,
+        issuer='Benchmark University',
+        issuing_address=issuing_address,
+        expiry_date=None,
+        csv_file='graduates.csv',
+        certificates_directory='certificates',
+        certificates_global_fields='',
+        cert_names_csv_column='student_id',
+        cert_metadata_columns=json.dumps(METADATA_COLUMNS),
+        full_node_url='127.0.0.1:{}'.format(node_port),
+        full_node_rpc_user='user',
+        full_node_rpc_password='pass',
+        blockchain='bitcoin',
+        testnet=True,
+        tx_fee_per_byte=1,
+        issuer_identifier='BENCH',
+        verify_issuer='{ "methods": [] }')
+    for k, v in overrides.items():
+        setattr(conf, k, v)
+    return conf
+
+
+'''
+Runs one batch through the issue or create flow and returns its report
+'''
+def run_batch(flow, n, node_server, node, issuing_address, owners=False,
+              local_keys=False, streaming=False):
+    working_directory = tempfile.mkdtemp(prefix='bench-issue-')
+    owner_keys_file = 'owner_keys.txt' if local_keys else None
+    try:
+        make_batch(working_directory, n, owners, with_certificates=(flow == 'issue'),
+                   owner_keys_file=owner_keys_file)
+        conf = make_conf(working_directory, node_server.server_port, issuing_address,
+                         owner_keys_file=owner_keys_file, streaming=streaming)
+        node.reset_counters()
+
+        instrumentation.enable()
+        try:
+            start = time.perf_counter()
+            if flow == 'issue':
+                txid = issue_certificates.issue_certificates(conf)
+            else:
+                txid = create_certificates.create_certificates(conf)
+            total = time.perf_counter() - start
+            report = instrumentation.report()
+        finally:
+            instrumentation.disable()
+
+        return { "flow": flow, "certificates": n, "txid": txid,
+                 "total_s": round(total, 4),
+                 "certs_per_s": round(n / total, 2),
+                 "stages_s": { k: round(v['total_s'], 4) for k, v in report['spans'].items() },
+                 "counters": report['counters'],
+                 "rpc_calls": dict(node.calls),
+                 "rpc_http_requests": node.http_requests }
+    finally:
+        shutil.rmtree(working_directory, ignore_errors=True)
+
+
+def _can_create():
+    java_dir = os.path.join(os.path.dirname(pdf_utils.__file__), 'java')
+    return (shutil.which('java') is not None and
+            os.path.isfile(os.path.join(java_dir, 'itextpdf-5.5.10.jar')) and
+            os.path.isfile(os.path.join(java_dir, 'json-simple-1.1.1.jar')))
+
+
+def main():
+    p = argparse.ArgumentParser(description='End-to-end issuance benchmark')
+    p.add_argument('--sizes', type=str, default='10,100,1000', help='comma separated batch sizes')
+    p.add_argument('--flow', choices=['issue', 'create', 'both'], default='issue')
+    p.add_argument('--owners', action='store_true', help='add owner columns so that every certificate is signed')
+    p.add_argument('--local-keys', action='store_true', help='sign owner proofs locally from an owner keys file instead of with the node')
+    p.add_argument('--streaming', action='store_true', help='use the streaming issuance (issue flow only)')
+    p.add_argument('--latency', type=float, default=0.0, help='seconds added to every node RPC request')
+    p.add_argument('--json', type=str, help='also write the report to this file')
+    args = p.parse_args()
+
+    flows = ['issue', 'create'] if args.flow == 'both' else [args.flow]
+    if 'create' in flows and not _can_create():
+        print('Skipping create flow: java and the itext/json-simple jars are required')
+        flows.remove('create')
+
+    node_server, node = start_fake_node(latency=args.latency)
+    _, _, issuing_address = _new_key()
+
+    reports = []
+    for flow in flows:
+        for n in [ int(s) for s in args.sizes.split(',') ]:
+            r = run_batch(flow, n, node_server, node, issuing_address, args.owners,
+                          args.local_keys, args.streaming)
+            reports.append(r)
+            stages = ' '.join('{}={:.3f}s'.format(k, v) for k, v in r['stages_s'].items())
+            print('{:<7} n={:<7} total={:.3f}s {:>9.1f} certs/s rpc={:<5} {}'.format(
+                flow, n, r['total_s'], r['certs_per_s'],
+                sum(r['rpc_calls'].values()), stages))
+
+    node_server.shutdown()
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(reports, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
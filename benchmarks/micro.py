@@ -0,0 +1,211 @@
+'''
+Micro-benchmarks for the hot primitives of issuance and validation,
+parameterised over batch sizes. Results are stored as JSON and compared
+against a stored baseline; the run fails if any primitive is slower than the
+baseline by more than its threshold.
+
+    # record a baseline on the reference machine
+    python benchmarks/micro.py --save-baseline micro_baseline.json
+    # later, e.g. after upgrading a dependency
+    python benchmarks/micro.py --baseline micro_baseline.json [--threshold 0.25]
+
+Timings are the best of --repeat runs and are compared per item so that
+baselines recorded with different sizes are still comparable.
+'''
+import os
+import sys
+import json
+import time
+import shutil
+import hashlib
+import argparse
+import platform
+import tempfile
+import warnings
+
+REPO_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
+sys.path.insert(0, REPO_DIR)
+warnings.filterwarnings('ignore', message='sha3 is not working!')
+
+from blockchain_certificates import __version__
+from blockchain_certificates import pdf_utils
+from blockchain_certificates import cred_protocol
+from blockchain_certificates import network_utils
+from blockchain_certificates import utils
+from blockchain_certificates.chainpoint import ChainPointV2
+
+PDF_TEMPLATE = os.path.join(REPO_DIR, 'sample_issue_certs_dir', 'certificates',
+                            's01-Kostas_Karasavvas.pdf')
+
+# allowed slowdown per primitive over the baseline (fraction); primitives not
+# listed use --threshold
+THRESHOLDS = {
+    'hash_certificates': 0.5,     # dominated by disk I/O
+    '_fill_pdf_metadata': 0.5,
+}
+
+
+def _best_of(repeat, func, setup=None):
+    best = None
+    for _ in range(repeat):
+        state = setup() if setup else None
+        start = time.perf_counter()
+        func(state)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def _leaves(n):
+    return [ hashlib.sha256(str(i).encode()).hexdigest() for i in range(n) ]
+
+
+def _tree(n):
+    cp = ChainPointV2()
+    cp.add_leaf(_leaves(n))
+    cp.make_tree()
+    return cp
+
+
+def bench_chainpoint(n, repeat, results):
+    leaves = _leaves(n)
+
+    def make_tree(_):
+        cp = ChainPointV2()
+        cp.add_leaf(leaves)
+        cp.make_tree()
+    results['make_tree[{}]'.format(n)] = (_best_of(repeat, make_tree), n)
+
+    cp = _tree(n)
+    results['get_proof[{}]'.format(n)] = (
+        _best_of(repeat, lambda _: [ cp.get_proof(i) for i in range(n) ]), n)
+    results['get_receipt[{}]'.format(n)] = (
+        _best_of(repeat, lambda _: [ cp.get_receipt(i, '00' * 32, 'bitcoin', True)
+                                     for i in range(n) ]), n)
+
+    receipts = [ cp.get_receipt(i, '00' * 32, 'bitcoin', True) for i in range(n) ]
+    op_return_hex = utils.bytes_to_hex(cred_protocol.issue_cmd('BENCH', cp.get_merkle_root()))
+    results['validate_receipt[{}]'.format(n)] = (
+        _best_of(repeat, lambda _: [ cp.validate_receipt(r, op_return_hex, r['targetHash'])
+                                     for r in receipts ]), n)
+
+
+def bench_op_return(n, repeat, results):
+    txid = '11' * 32
+    hexes = []
+    for i in range(n):
+        kind = i % 3
+        if kind == 0:
+            data = cred_protocol.issue_cmd('BENCH', '%064x' % i)
+        elif kind == 1:
+            data = cred_protocol.revoke_batch_cmd(txid)
+        else:
+            data = cred_protocol.revoke_creds_cmd(txid, b'a', b'b')
+        hexes.append(utils.bytes_to_hex(data))
+    results['parse_op_return_hex[{}]'.format(n)] = (
+        _best_of(repeat, lambda _: [ cred_protocol.parse_op_return_hex(h) for h in hexes ]), n)
+
+    scripts = [ ('6a4c' if len(h) > 150 else '6a') + format(len(h) // 2, '02x') + h
+                for h in hexes ]
+    results['get_op_return_data_from_script[{}]'.format(n)] = (
+        _best_of(repeat, lambda _: [ network_utils.get_op_return_data_from_script(s)
+                                     for s in scripts ]), n)
+
+
+def bench_pdf(n, repeat, results, directory):
+    files = []
+    for i in range(n):
+        path = os.path.join(directory, 'c{:07d}.pdf'.format(i))
+        shutil.copyfile(PDF_TEMPLATE, path)
+        files.append(path)
+
+    results['hash_certificates[{}]'.format(n)] = (
+        _best_of(repeat, lambda _: pdf_utils.hash_certificates(files)), n)
+
+    columns = json.dumps({ "columns": [ { "name": { "label": "Name", "order": 1,
+                                                     "hide": False } } ] })
+    data = { "name": "Student" }
+
+    def fill(_):
+        for f in files:
+            pdf_utils._fill_pdf_metadata(f, 'Issuer', 'mr5TnhzymxLLpftDXNHUK7kNNmUnaZY6of',
+                                         columns, data, '', '{ "methods": [] }', None)
+    results['_fill_pdf_metadata[{}]'.format(n)] = (_best_of(repeat, fill), n)
+
+
+def run(sizes, pdf_sizes, repeat):
+    raw = {}
+    for n in sizes:
+        bench_chainpoint(n, repeat, raw)
+        bench_op_return(n, repeat, raw)
+    directory = tempfile.mkdtemp(prefix='bench-micro-')
+    try:
+        for n in pdf_sizes:
+            bench_pdf(n, repeat, raw, directory)
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+    return { "version": __version__,
+             "python": platform.python_version(),
+             "machine": platform.machine(),
+             "results": { name: { "seconds": round(seconds, 6), "items": items,
+                                  "per_item_us": round(seconds / items * 1e6, 3) }
+                          for name, (seconds, items) in raw.items() } }
+
+
+'''
+Returns a list of (name, baseline per item, current per item, slowdown,
+threshold) for every primitive that regressed beyond its threshold
+'''
+def compare(report, baseline, default_threshold):
+    regressions = []
+    for name, current in report['results'].items():
+        if name not in baseline['results']:
+            continue
+        primitive = name.split('[')[0]
+        threshold = THRESHOLDS.get(primitive, default_threshold)
+        base = baseline['results'][name]['per_item_us']
+        if base <= 0:
+            continue
+        slowdown = current['per_item_us'] / base - 1
+        if slowdown > threshold:
+            regressions.append((name, base, current['per_item_us'], slowdown, threshold))
+    return regressions
+
+
+def main():
+    p = argparse.ArgumentParser(description='Micro-benchmarks with regression thresholds')
+    p.add_argument('--sizes', type=str, default='100,1000,10000', help='batch sizes for in-memory primitives')
+    p.add_argument('--pdf-sizes', type=str, default='10,50', help='batch sizes for pdf primitives')
+    p.add_argument('--repeat', type=int, default=5, help='runs per benchmark; the best is kept')
+    p.add_argument('--json', type=str, help='write the results to this file')
+    p.add_argument('--baseline', type=str, help='compare against this stored baseline')
+    p.add_argument('--save-baseline', type=str, help='store the results as the baseline')
+    p.add_argument('--threshold', type=float, default=0.25, help='allowed slowdown (fraction) per primitive')
+    args = p.parse_args()
+
+    report = run([ int(s) for s in args.sizes.split(',') ],
+                 [ int(s) for s in args.pdf_sizes.split(',') if s ],
+                 args.repeat)
+    for name, r in report['results'].items():
+        print('{:<45} {:>12.3f} us/item {:>10.4f} s'.format(name, r['per_item_us'], r['seconds']))
+
+    for path in (args.json, args.save_baseline):
+        if path:
+            with open(path, 'w') as f:
+                json.dump(report, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(report, baseline, args.threshold)
+        for name, base, current, slowdown, threshold in regressions:
+            print('REGRESSION {}: {:.3f} -> {:.3f} us/item (+{:.0%}, allowed +{:.0%})'.format(
+                name, base, current, slowdown, threshold))
+        if regressions:
+            sys.exit(1)
+        print('No regressions against {}'.format(args.baseline))
+
+
+if __name__ == "__main__":
+    main()
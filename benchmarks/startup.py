@@ -0,0 +1,95 @@
+'''
+Measures the startup cost of every console script and fails if any of them
+exceeds its budget. For each script it runs `python -m <module> --help`
+several times and compares the median wall time, minus the time of a bare
+interpreter, against the budget. It also reports any heavy dependency that
+was imported just to print the help message.
+
+Usage:
+    python benchmarks/startup.py [--runs 7] [--json startup.json]
+'''
+import os
+import sys
+import json
+import time
+import argparse
+import statistics
+import subprocess
+
+# startup budgets in milliseconds on top of the bare interpreter startup
+BUDGETS_MS = {
+    'blockchain_certificates.create_certificates': 80,
+    'blockchain_certificates.issue_certificates': 80,
+    'blockchain_certificates.validate_certificates': 80,
+    'blockchain_certificates.revoke_certificates': 80,
+    'blockchain_certificates.validation_server': 100,
+}
+
+# modules that should only be imported once they are actually needed
+DEFERRED_MODULES = ['pdfrw', 'requests', 'bitcoinrpc', 'merkletools',
+                    'bitcoinutils', 'litecoinutils']
+
+REPO_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
+
+
+def _run(args):
+    env = dict(os.environ, PYTHONPATH=REPO_DIR)
+    start = time.perf_counter()
+    proc = subprocess.run([sys.executable] + args, env=env, cwd=REPO_DIR,
+                          stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    return (time.perf_counter() - start) * 1000, proc.stderr.decode()
+
+
+def _median_ms(args, runs):
+    return statistics.median(_run(args)[0] for _ in range(runs))
+
+
+def _eagerly_imported(module):
+    _, stderr = _run(['-X', 'importtime', '-m', module, '--help'])
+    imported = set()
+    for line in stderr.splitlines():
+        if line.startswith('import time:'):
+            name = line.split('|')[-1].strip()
+            imported.add(name.split('.')[0])
+    return sorted(imported.intersection(DEFERRED_MODULES))
+
+
+def measure(runs):
+    baseline = _median_ms(['-c', 'pass'], runs)
+    report = { "interpreter_ms": round(baseline, 1), "scripts": {} }
+    for module, budget in BUDGETS_MS.items():
+        elapsed = _median_ms(['-m', module, '--help'], runs) - baseline
+        report['scripts'][module] = {
+            "startup_ms": round(elapsed, 1),
+            "budget_ms": budget,
+            "within_budget": elapsed <= budget,
+            "eager_imports": _eagerly_imported(module),
+        }
+    return report
+
+
+def main():
+    p = argparse.ArgumentParser(description='Console script startup budgets')
+    p.add_argument('--runs', type=int, default=7, help='runs per script')
+    p.add_argument('--json', type=str, help='also write the report to this file')
+    args = p.parse_args()
+
+    report = measure(args.runs)
+    failed = False
+    print('interpreter startup: {} ms'.format(report['interpreter_ms']))
+    for module, r in report['scripts'].items():
+        status = 'ok' if r['within_budget'] and not r['eager_imports'] else 'FAIL'
+        failed = failed or status == 'FAIL'
+        print('{:<50} {:>7.1f} ms (budget {} ms) {}{}'.format(
+            module, r['startup_ms'], r['budget_ms'], status,
+            ' eager: ' + ', '.join(r['eager_imports']) if r['eager_imports'] else ''))
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,20 @@
 __version__ = '2.1.9'
 
 import logging
-import logging.handlers
 
 logger = logging.getLogger( 'CRED Corelib' )
 logger.setLevel(logging.INFO)
-handler = logging.handlers.SysLogHandler(address = '/dev/log')
-logger.addHandler(handler)
+
+
+'''
+Attaches the syslog handler to the library's logger. It is called by the
+console scripts instead of at import time so that importing the package stays
+cheap and applications using it as a library can configure logging
+themselves.
+'''
+def configure_logging():
+    if logger.handlers:
+        return
+    import logging.handlers
+    handler = logging.handlers.SysLogHandler(address = '/dev/log')
+    logger.addHandler(handler)
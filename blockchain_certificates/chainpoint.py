@@ -1,9 +1,8 @@
-import requests
-import binascii
+import json
 import time
-from merkletools import MerkleTools
+import base64
+import hashlib
 from blockchain_certificates import cred_protocol
-from blockchain_certificates import network_utils
 from blockchain_certificates import utils
 
 CHAINPOINT_CONTEXT = 'https://w3id.org/chainpoint/v2'
@@ -19,13 +18,110 @@ CHAINPOINT_ANCHOR_TYPES = {'bitcoin': 'BTCOpReturn', 'litecoin': 'LTCOpReturn',
                            'bitcoin_testnet': 'BTCTestnetOpReturn',
                            'litecoin_testnet': 'LTCTestnetOpReturn'} #, 'eth': 'ETHData'}
 
+# compact receipts are COMPACT_RECEIPT_PREFIX followed by the base64 of:
+# version (1 byte), hash type and anchor type (indexes in the tuples below,
+# 1 byte each), number of proof steps (1 byte), a bitmask of the steps whose
+# sibling is on the left, target hash, merkle root, anchor source id (32 byte
+# txid) and the sibling hashes, all raw bytes
+COMPACT_RECEIPT_PREFIX = 'cp2b:'
+COMPACT_RECEIPT_VERSION = 1
+COMPACT_HASH_TYPES = ('sha224', 'sha256', 'sha384', 'sha512',
+                      'sha3_224', 'sha3_256', 'sha3_384', 'sha3_512')
+COMPACT_ANCHOR_TYPES = ('bitcoin', 'litecoin', 'bitcoin_testnet', 'litecoin_testnet')
+
+
+'''
+Encodes a chainpoint v2 receipt (dict) in the compact form; about half the
+size of the JSON form for deep trees
+'''
+def encode_compact_receipt(receipt):
+    hash_type = next(h for h, t in CHAINPOINT_HASH_TYPES.items() if t == receipt['type'])
+    anchor = receipt['anchors'][0]
+    chain_type = next(c for c, t in CHAINPOINT_ANCHOR_TYPES.items() if t == anchor['type'])
+    proof = receipt['proof']
+    if len(proof) > 255:
+        raise ValueError('proof is too long for a compact receipt')
+    mask = bytearray((len(proof) + 7) // 8)
+    siblings = []
+    for i, step in enumerate(proof):
+        if 'left' in step:
+            mask[i // 8] |= 1 << (i % 8)
+            siblings.append(bytes.fromhex(step['left']))
+        else:
+            siblings.append(bytes.fromhex(step['right']))
+    data = bytes([ COMPACT_RECEIPT_VERSION, COMPACT_HASH_TYPES.index(hash_type),
+                   COMPACT_ANCHOR_TYPES.index(chain_type), len(proof) ]) + \
+           bytes(mask) + bytes.fromhex(receipt['targetHash']) + \
+           bytes.fromhex(receipt['merkleRoot']) + \
+           bytes.fromhex(anchor['sourceId']) + b''.join(siblings)
+    return COMPACT_RECEIPT_PREFIX + base64.b64encode(data).decode('ascii')
+
+
+'''
+Decodes a chainpoint_proof as stored in the pdf metadata, either the JSON form
+or the compact form, and returns the receipt (dict). Raises ValueError if it
+is neither.
+'''
+def decode_receipt(value):
+    if isinstance(value, dict):
+        return value
+    if isinstance(value, (bytes, bytearray)):
+        value = value.decode('utf-8')
+    if not value.startswith(COMPACT_RECEIPT_PREFIX):
+        return json.loads(value)
+
+    try:
+        data = base64.b64decode(value[len(COMPACT_RECEIPT_PREFIX):], validate=True)
+        version, hash_index, anchor_index, steps = data[0], data[1], data[2], data[3]
+        hash_type = COMPACT_HASH_TYPES[hash_index]
+        chain_type = COMPACT_ANCHOR_TYPES[anchor_index]
+    except (IndexError, ValueError):
+        raise ValueError('invalid compact receipt')
+    if version != COMPACT_RECEIPT_VERSION:
+        raise ValueError('unsupported compact receipt version {}'.format(version))
+    size = hashlib.new(hash_type).digest_size
+    offset = 4 + (steps + 7) // 8
+    if len(data) != offset + 2 * size + 32 + steps * size:
+        raise ValueError('invalid compact receipt')
+
+    mask = int.from_bytes(data[4:offset], 'little')
+    # hex once and slice the hex string (2 chars per byte)
+    hex_data = data[offset:].hex()
+    step = 2 * size
+    target_hash = hex_data[:step]
+    merkle_root = hex_data[step:2 * step]
+    source_id = hex_data[2 * step:2 * step + 64]
+    offset = 2 * step + 64
+    proof = [ { 'left' if mask >> i & 1 else 'right':
+                hex_data[offset + i * step:offset + (i + 1) * step] }
+              for i in range(steps) ]
+    return {
+        "@context": CHAINPOINT_CONTEXT,
+        "type": CHAINPOINT_HASH_TYPES[hash_type],
+        "targetHash": target_hash,
+        "merkleRoot": merkle_root,
+        "proof": proof,
+        "anchors": [
+            {
+                "type": CHAINPOINT_ANCHOR_TYPES[chain_type],
+                "sourceId": source_id
+            }
+        ]
+    }
+
+
 '''
 Implements chainpoint v2 proof of existence approach
+The merkle tree is a merkletools MerkleTools unless another tree with the
+same interface is given, e.g. a merkle_tree.BinaryMerkleTree (sha256 only).
 '''
 class ChainPointV2(object):
-    def __init__(self, hash_type="sha256"):
+    def __init__(self, hash_type="sha256", tree=None):
         self.hash_type = hash_type.lower()
-        self.mk = MerkleTools(hash_type)
+        if tree is None:
+            from merkletools import MerkleTools
+            tree = MerkleTools(hash_type)
+        self.mk = tree
 
     '''Wraps merkletools method'''
     def reset_tree(self):
@@ -91,10 +187,21 @@ class ChainPointV2(object):
         else:
             return None
 
+    '''
+    Returns the chainpoint v2 blockchain receipt for specific leaf in the
+    compact form (see encode_compact_receipt)
+    '''
+    def get_compact_receipt(self, index, source_id, chain, testnet):
+        receipt = self.get_receipt(index, source_id, chain, testnet)
+        if receipt is None:
+            return None
+        return encode_compact_receipt(receipt)
+
 
     '''
     Validates a chainpoint receipt. Currently for BTC and LTC anchors
-        receipt is the chainpoint_proof metadata from the pdf file.
+        receipt is the chainpoint_proof metadata from the pdf file, either
+            decoded or as stored (JSON or compact form).
         certificate_hash is the hash of the certificate after we removed the
             chainpoint_proof metadata
         issuer_identifier is a fixed 8 bytes issuer code that displays on the
@@ -103,6 +210,7 @@ class ChainPointV2(object):
     # TODO consider using exceptions instead of (bool, text) tuples; this is
     # really only needed for valid but soon to expire
     def validate_receipt(self, receipt, op_return_hex, certificate_hash, issuer_identifier=''):
+        receipt = decode_receipt(receipt)
         # check context and hash type
         if(receipt['@context'].lower() != CHAINPOINT_CONTEXT):
             return False, "wrong chainpoint context"
@@ -5,8 +5,8 @@ import os
 import sys
 import glob
 import json
-import configargparse
-from pdfrw import PdfReader, PdfWriter, PdfDict
+from blockchain_certificates import configure_logging
+from blockchain_certificates import instrumentation
 from blockchain_certificates.chainpoint import ChainPointV2
 from blockchain_certificates import pdf_utils
 from blockchain_certificates import publish_hash
@@ -19,15 +19,21 @@ key is "chainpoint_proof"
 TODO: duplicate with issue_certificates
 '''
 def insert_proof_to_certificates(conf, cp, txid, cert_files, interactive=False):
+    from pdfrw import PdfReader, PdfWriter, PdfDict
     if interactive:
         print('')
     for ind, val in enumerate(cert_files):
-        proof = json.dumps( cp.get_receipt(ind, txid, conf.blockchain,
-                                           conf.testnet) )
-        metadata = PdfDict(chainpoint_proof=proof)
-        pdf = PdfReader(val)
-        pdf.Info.update(metadata)
-        PdfWriter().write(val, pdf)
+        with instrumentation.span('proof_insertion'):
+            if getattr(conf, 'compact_receipts', False):
+                proof = cp.get_compact_receipt(ind, txid, conf.blockchain,
+                                               conf.testnet)
+            else:
+                proof = json.dumps( cp.get_receipt(ind, txid, conf.blockchain,
+                                                   conf.testnet) )
+            metadata = PdfDict(chainpoint_proof=proof)
+            pdf = PdfReader(val)
+            pdf.Info.update(metadata)
+            PdfWriter().write(val, pdf)
         if interactive:
             # print progress
             print('.', end="", flush=True)
@@ -39,9 +45,10 @@ creates the corresponding merkle tree
 TODO: duplicate with issue_certificates
 '''
 def prepare_chainpoint_tree(hashes):
-    cp = ChainPointV2()
-    cp.add_leaf(hashes)
-    cp.make_tree()
+    with instrumentation.span('tree_build'):
+        cp = ChainPointV2()
+        cp.add_leaf(hashes)
+        cp.make_tree()
     return cp
 
 
@@ -50,6 +57,7 @@ Loads and returns the configuration options (either from --config or from
 specifying the specific options.
 '''
 def load_config():
+    import configargparse
     base_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
     default_config = os.path.join(base_dir, 'config.ini')
     p = configargparse.getArgumentParser(default_config_files=[default_config])
@@ -67,12 +75,17 @@ def load_config():
     p.add_argument('-n', '--full_node_url', type=str, default='127.0.0.1:18332', help='the url of the full node to use')
     p.add_argument('-u', '--full_node_rpc_user', type=str, help='the rpc user as specified in the node\'s configuration')
     p.add_argument('-w', '--full_node_rpc_password', type=str, help='the rpc password as specified in the node\'s configuration')
+    p.add_argument('-k', '--owner_keys_file', type=str, help='a file with the owners\' private keys (WIF, one per line) to sign owner proofs locally instead of with the node')
     p.add_argument('-l', '--blockchain', type=str, default='bitcoin', help='choose blockchain; currently bitcoin or litecoin')
     p.add_argument('-t', '--testnet', action='store_true', help='specify if testnet or mainnet will be used')
     p.add_argument('-f', '--tx_fee_per_byte', type=int, default=100, help='the fee per transaction byte in satoshis')
     p.add_argument('-p', '--issuer_identifier', type=str, default='        ', help='optional 8 bytes identifier that represents the issuer intented to go on the blockchain')
     p.add_argument('-r', '--verify_issuer', type=str, default='{ "methods": [] }',
                    help='Which verification methods to use to validate the issuer')
+    p.add_argument('--utxo_pool_size', type=int, default=0, help='fan out the issuing address\' funds into this many UTXOs and lease them to transactions so that they do not wait for confirmations; 0 disables the pool')
+    p.add_argument('--compact_receipts', action='store_true', help='store the chainpoint receipts in the compact binary (base64) form instead of JSON')
+    p.add_argument('--metrics_file', type=str, help='write per-stage timings and counters to this file (Prometheus text format if it ends in .prom, JSON otherwise)')
+    p.add_argument('--profile', action='store_true', help='profile the run with cProfile and tracemalloc and write the stats and a per-stage peak memory summary to the working directory')
     args, _ = p.parse_known_args()
     return args
 
@@ -112,8 +125,14 @@ def main():
         sys.stderr.write('Python 3 is required!')
         sys.exit(1)
 
+    configure_logging()
     conf = load_config()
-    txid = create_certificates(conf, True)
+    with instrumentation.reporting(conf.metrics_file), \
+         instrumentation.profiling(conf.working_directory if conf.profile else None,
+                                   'create-certificates') as profile_files:
+        txid = create_certificates(conf, True)
+    for f in profile_files:
+        print('Profile written to {}'.format(f))
     print('\nTx hash: {}'.format(txid))
 
 
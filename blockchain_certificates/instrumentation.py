@@ -0,0 +1,282 @@
+'''
+Lightweight run instrumentation: named spans that accumulate wall time and
+counters (files, bytes, RPC calls, HTTP requests, ...). Everything is a no-op
+until enable() is called so that the overhead when disabled is a function
+call. The collected data can be exported as a JSON run report or in the
+Prometheus text exposition format. While profiling() is active every span
+also records the peak memory traced by tracemalloc.
+
+    with instrumentation.span('hash'):
+        ...
+    instrumentation.count('files', len(cert_files))
+'''
+import os
+import re
+import time
+import json
+import threading
+from contextlib import contextmanager
+
+from blockchain_certificates import __version__
+
+_enabled = False
+_lock = threading.Lock()
+_started = None
+_spans = {}
+_counters = {}
+_tracing = False
+_open_spans = []
+
+
+class _NullSpan(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def start(self):
+        return self
+
+    def stop(self):
+        pass
+
+_NULL_SPAN = _NullSpan()
+
+
+class _Span(object):
+    __slots__ = ('name', '_start', '_peak')
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+        return False
+
+    def start(self):
+        if _tracing:
+            self._start_tracing()
+        self._start = time.perf_counter()
+        return self
+
+    def stop(self):
+        elapsed = time.perf_counter() - self._start
+        peak = self._stop_tracing() if _tracing else None
+        with _lock:
+            s = _spans.get(self.name)
+            if s is None:
+                s = _spans[self.name] = { "count": 0, "total_s": 0.0, "max_s": 0.0 }
+            s['count'] += 1
+            s['total_s'] += elapsed
+            if elapsed > s['max_s']:
+                s['max_s'] = elapsed
+            if peak is not None and peak > s.get('peak_bytes', 0):
+                s['peak_bytes'] = peak
+
+    # tracemalloc has a single, process wide, peak; before resetting it for
+    # this span the peak so far is handed to the spans that are still open
+    def _start_tracing(self):
+        import tracemalloc
+        with _lock:
+            current, peak = tracemalloc.get_traced_memory()
+            for other in _open_spans:
+                other._peak = max(other._peak, peak)
+            tracemalloc.reset_peak()
+            self._peak = current
+            _open_spans.append(self)
+
+    def _stop_tracing(self):
+        import tracemalloc
+        with _lock:
+            if self not in _open_spans:
+                return None
+            _open_spans.remove(self)
+            return max(self._peak, tracemalloc.get_traced_memory()[1])
+
+
+def enable():
+    global _enabled, _started
+    reset()
+    _started = time.time()
+    _enabled = True
+
+
+def disable():
+    global _enabled
+    _enabled = False
+
+
+def is_enabled():
+    return _enabled
+
+
+def reset():
+    with _lock:
+        _spans.clear()
+        _counters.clear()
+        del _open_spans[:]
+
+
+'''
+Returns a context manager that times the enclosed block under name; for
+blocks that do not nest well use span(name).start() and .stop()
+'''
+def span(name):
+    if not _enabled:
+        return _NULL_SPAN
+    return _Span(name)
+
+
+'''
+Adds value to the counter name
+'''
+def count(name, value=1):
+    if not _enabled:
+        return
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + value
+
+
+'''
+Wraps a JSON-RPC proxy so that every call increments the 'rpc_calls' counter;
+returns the proxy itself when instrumentation is disabled
+'''
+def count_calls(proxy, counter='rpc_calls'):
+    if not _enabled:
+        return proxy
+    return _CountingProxy(proxy, counter)
+
+
+class _CountingProxy(object):
+    def __init__(self, proxy, counter):
+        self._proxy = proxy
+        self._counter = counter
+
+    def __getattr__(self, name):
+        attr = getattr(self._proxy, name)
+        if not callable(attr):
+            return attr
+
+        def counted(*args, **kwargs):
+            count(self._counter)
+            return attr(*args, **kwargs)
+        return counted
+
+
+'''
+Returns the run report as a dictionary
+'''
+def report():
+    with _lock:
+        spans = { k: dict(v, total_s=round(v['total_s'], 6), max_s=round(v['max_s'], 6))
+                  for k, v in _spans.items() }
+        counters = dict(_counters)
+    return { "version": __version__,
+             "started": _started,
+             "duration_s": round(time.time() - _started, 6) if _started else None,
+             "spans": spans,
+             "counters": counters }
+
+
+def _metric_name(name):
+    return re.sub(r'[^a-zA-Z0-9_]', '_', name)
+
+
+'''
+Returns the collected data in the Prometheus text exposition format
+'''
+def to_prometheus():
+    r = report()
+    lines = [ '# HELP cred_span_seconds_total Total time spent in each stage.',
+              '# TYPE cred_span_seconds_total counter' ]
+    for name, s in sorted(r['spans'].items()):
+        lines.append('cred_span_seconds_total{{span="{}"}} {}'.format(name, s['total_s']))
+    lines += [ '# HELP cred_span_count_total Number of times each stage ran.',
+               '# TYPE cred_span_count_total counter' ]
+    for name, s in sorted(r['spans'].items()):
+        lines.append('cred_span_count_total{{span="{}"}} {}'.format(name, s['count']))
+    for name, value in sorted(r['counters'].items()):
+        metric = 'cred_{}_total'.format(_metric_name(name))
+        lines.append('# TYPE {} counter'.format(metric))
+        lines.append('{} {}'.format(metric, value))
+    return '\n'.join(lines) + '\n'
+
+
+'''
+Writes the run report to path; Prometheus text format if path ends in .prom,
+JSON otherwise
+'''
+def write_report(path):
+    with open(path, 'w') as f:
+        if path.endswith('.prom'):
+            f.write(to_prometheus())
+        else:
+            json.dump(report(), f, indent=2)
+
+
+'''
+Enables instrumentation for the enclosed block if path is set and writes the
+report to path when the block exits (even on errors)
+'''
+@contextmanager
+def reporting(path):
+    if not path:
+        yield
+        return
+    enable()
+    try:
+        yield
+    finally:
+        write_report(path)
+        disable()
+
+
+'''
+If directory is set, runs the enclosed block under cProfile and tracemalloc
+(and enables instrumentation if needed). When the block exits it writes, into directory,
+<name>-<files>-<version>.pstats with the profile and
+<name>-<files>-<version>-memory.json with the run report, where every span
+also has the peak traced memory in bytes. files is the 'files' counter, i.e.
+the batch size. The yielded list holds the two paths once the block exits.
+'''
+@contextmanager
+def profiling(directory, name):
+    global _tracing
+    if not directory:
+        yield []
+        return
+    import cProfile
+    import tracemalloc
+
+    was_enabled = _enabled
+    if not was_enabled:
+        enable()
+    tracemalloc.start()
+    _tracing = True
+    profiler = cProfile.Profile()
+    written = []
+    profiler.enable()
+    try:
+        yield written
+    finally:
+        profiler.disable()
+        peak = tracemalloc.get_traced_memory()[1]
+        _tracing = False
+        tracemalloc.stop()
+
+        r = report()
+        # spans reset the tracemalloc peak so take the largest of theirs too
+        r['peak_bytes'] = max([ peak ] + [ sp.get('peak_bytes', 0)
+                                           for sp in r['spans'].values() ])
+        prefix = os.path.join(directory, '{}-{}-{}'.format(
+            name, r['counters'].get('files', 0), __version__))
+        profiler.dump_stats(prefix + '.pstats')
+        with open(prefix + '-memory.json', 'w') as f:
+            json.dump(r, f, indent=2)
+        written += [ prefix + '.pstats', prefix + '-memory.json' ]
+        if not was_enabled:
+            disable()
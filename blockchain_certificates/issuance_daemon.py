@@ -0,0 +1,446 @@
+'''
+Long-running HTTP service that aggregates many small issuance jobs into one
+anchoring transaction. Every job is prepared as soon as it is submitted
+(metadata added, certificates hashed into the job's merkle tree). Prepared
+jobs are accumulated until batch_size certificates are pending or the oldest
+job has waited batch_interval seconds; then a merkle tree of the job roots is
+built, its root is issued with a single CRED op_issue and every job's
+certificates get their receipts: the certificate's proof in the job tree
+followed by the job root's proof in the combined tree (as in
+sharded_issuance).
+
+Endpoints:
+  POST /jobs         with a JSON body that is either a directory job:
+                       { "working_directory": "dept/2024-spring",
+                         "csv_file": "graduates.csv",
+                         "certificates_directory": "certificates",
+                         "cert_names_csv_column": "student_id",
+                         "cert_metadata_columns": "...",
+                         "certificates_global_fields": "..." }
+                     where working_directory is relative to jobs_root, or an
+                     in-memory job:
+                       { "certificates": [ { "filename": "c1.pdf",
+                                             "pdf": "<base64>",
+                                             "data": { "name": "..." } } ],
+                         "cert_metadata_columns": "...",
+                         "certificates_global_fields": "..." }
+                     Returns { "job_id": ... } (202).
+  GET  /jobs/<id>    { "job_id", "status": "preparing" | "pending" |
+                       "issued" | "failed", "txid", "error", "certificates" }
+                     For issued in-memory jobs certificates includes the pdfs
+                     (base64) with their chainpoint_proof.
+                     Finished jobs are removed after job_ttl seconds.
+  GET  /health
+  GET  /metrics      Prometheus text format; only if started with --metrics
+
+The issuer, issuing address and node options are the ones of the daemon.
+'''
+import os
+import sys
+import csv
+import json
+import glob
+import time
+import uuid
+import base64
+import shutil
+import argparse
+import tempfile
+import threading
+from urllib.parse import urlparse
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from blockchain_certificates import configure_logging
+from blockchain_certificates import instrumentation
+from blockchain_certificates import issue_certificates
+from blockchain_certificates import pdf_utils
+from blockchain_certificates.chainpoint import ChainPointV2
+from blockchain_certificates.merkle_tree import BinaryMerkleTree
+from blockchain_certificates.sharded_issuance import ShardTree
+
+import logging
+log = logging.getLogger( 'CRED Corelib' )
+
+# the options that a job can set; all other options are the daemon's
+JOB_OPTIONS = ('csv_file', 'certificates_directory', 'cert_names_csv_column',
+               'cert_metadata_columns', 'certificates_global_fields')
+# the job options that are paths relative to the job's working directory
+JOB_PATH_OPTIONS = ('csv_file', 'certificates_directory')
+IN_MEMORY_ID_COLUMN = '__FILE__'
+
+
+'''
+An issuance job; once prepared it holds the certificate files and their
+merkle tree
+'''
+class IssuanceJob(object):
+    def __init__(self, job_id, conf, in_memory=False):
+        self.job_id = job_id
+        self.conf = conf
+        self.in_memory = in_memory
+        self.status = 'preparing'
+        self.txid = None
+        self.error = None
+        self.cert_files = None
+        self.tree = None
+        self.submitted = time.time()
+        self.finished = None
+
+    def to_dict(self):
+        job = { "job_id": self.job_id, "status": self.status,
+                "txid": self.txid, "error": self.error,
+                "certificates": None }
+        if self.cert_files is not None:
+            job['certificates'] = [ { "filename": os.path.basename(f) }
+                                    for f in self.cert_files ]
+            if self.in_memory and self.status == 'issued':
+                for cert, f in zip(job['certificates'], self.cert_files):
+                    with open(f, 'rb') as pdf:
+                        cert['pdf'] = base64.b64encode(pdf.read()).decode('utf-8')
+        return job
+
+
+'''
+Handles the job requests; the server object holds the jobs and the batcher
+'''
+class IssuanceRequestHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        path = urlparse(self.path).path
+        if path == '/health':
+            self._send_json(200, { "status": "ok" })
+        elif path == '/metrics' and instrumentation.is_enabled():
+            data = instrumentation.to_prometheus().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+        elif path.startswith('/jobs/'):
+            job = self.server.jobs.get(path[len('/jobs/'):])
+            if job is None:
+                self._send_json(404, { "error": "job not found" })
+            else:
+                self._send_json(200, job.to_dict())
+        else:
+            self._send_json(404, { "error": "not found" })
+
+    def do_POST(self):
+        if urlparse(self.path).path != '/jobs':
+            self._send_json(404, { "error": "not found" })
+            return
+
+        length = int(self.headers.get('Content-Length', 0))
+        if length > self.server.max_upload_size:
+            self._send_json(413, { "error": "request body too large" })
+            return
+        try:
+            job = self.server.submit(json.loads(self.rfile.read(length).decode('utf-8')))
+        except ValueError as e:
+            self._send_json(400, { "error": str(e) })
+            return
+        self._send_json(202, { "job_id": job.job_id })
+
+    def _send_json(self, status, obj):
+        data = json.dumps(obj).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        log.info("%s - %s" % (self.address_string(), format % args))
+
+
+'''
+Threading HTTP server that prepares the jobs in a worker pool and anchors
+them in batches from a batcher thread
+'''
+class IssuanceServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, conf):
+        super().__init__((conf.host, conf.port), IssuanceRequestHandler)
+        self.conf = conf
+        self.jobs_root = os.path.realpath(conf.jobs_root) if conf.jobs_root else None
+        self.spool_directory = tempfile.mkdtemp(prefix='cred-jobs-')
+        self.max_upload_size = conf.max_upload_size
+        self.batch_size = conf.batch_size
+        self.batch_interval = conf.batch_interval
+        self.job_ttl = conf.job_ttl
+        self.executor = ThreadPoolExecutor(max_workers=conf.workers)
+        self.jobs = {}
+        self._jobs_lock = threading.Lock()
+        self._pending = []
+        self._condition = threading.Condition()
+        self._stopping = False
+        self._batcher = threading.Thread(target=self._run_batcher, daemon=True)
+        self._batcher.start()
+
+    '''
+    Creates a job from the request and starts preparing it; raises ValueError
+    for invalid requests
+    '''
+    def submit(self, request):
+        if not isinstance(request, dict):
+            raise ValueError("a job must be a JSON object")
+        job_id = uuid.uuid4().hex
+        job_conf = argparse.Namespace(**vars(self.conf))
+        for option in JOB_OPTIONS:
+            if option in request:
+                if not isinstance(request[option], str):
+                    raise ValueError("{} must be a string".format(option))
+                setattr(job_conf, option, request[option])
+
+        if 'certificates' in request:
+            job_conf.working_directory = os.path.join(self.spool_directory, job_id)
+            try:
+                self._write_in_memory_job(job_conf, request['certificates'])
+            except ValueError:
+                shutil.rmtree(job_conf.working_directory, ignore_errors=True)
+                raise
+            job = IssuanceJob(job_id, job_conf, in_memory=True)
+        else:
+            job_conf.working_directory = self._job_directory(
+                request.get('working_directory', ''))
+            for option in JOB_PATH_OPTIONS:
+                self._job_path(job_conf.working_directory, getattr(job_conf, option))
+            job = IssuanceJob(job_id, job_conf)
+
+        self._expire_jobs()
+        with self._jobs_lock:
+            self.jobs[job_id] = job
+        self.executor.submit(self._prepare, job)
+        return job
+
+    '''
+    Forgets the jobs that finished more than job_ttl seconds ago and deletes
+    the files of the expired in-memory jobs from the spool directory
+    '''
+    def _expire_jobs(self):
+        expiry = time.time() - self.job_ttl
+        with self._jobs_lock:
+            expired = [ job for job in self.jobs.values()
+                        if job.finished is not None and job.finished < expiry ]
+            for job in expired:
+                del self.jobs[job.job_id]
+        for job in expired:
+            if job.in_memory:
+                shutil.rmtree(job.conf.working_directory, ignore_errors=True)
+
+    '''
+    Resolves a job's working directory making sure it is under jobs_root
+    '''
+    def _job_directory(self, path):
+        if not self.jobs_root:
+            raise ValueError("directory jobs are not enabled")
+        if not isinstance(path, str):
+            raise ValueError("working_directory must be a string")
+        full_path = os.path.realpath(os.path.join(self.jobs_root, path))
+        if os.path.commonpath([self.jobs_root, full_path]) != self.jobs_root:
+            raise ValueError("path {} is outside jobs_root".format(path))
+        return full_path
+
+    '''
+    Resolves a path of a directory job making sure it is under the job's
+    working directory
+    '''
+    def _job_path(self, working_directory, path):
+        full_path = os.path.realpath(os.path.join(working_directory, path))
+        if os.path.commonpath([working_directory, full_path]) != working_directory:
+            raise ValueError("path {} is outside the job's working directory".format(path))
+        return full_path
+
+    '''
+    Writes the pdfs of an in-memory job and a CSV file with their data to the
+    job's working directory in the spool directory
+    '''
+    def _write_in_memory_job(self, job_conf, certificates):
+        if not certificates:
+            raise ValueError("no certificates provided")
+        certificates_directory = os.path.join(job_conf.working_directory, 'certificates')
+        os.makedirs(certificates_directory)
+        columns = []
+        for cert in certificates:
+            filename = os.path.basename(cert.get('filename', ''))
+            if not filename.lower().endswith('.pdf'):
+                raise ValueError("invalid pdf filename {}".format(filename))
+            try:
+                pdf = base64.b64decode(cert['pdf'], validate=True)
+            except (KeyError, TypeError, ValueError):
+                raise ValueError("invalid pdf data for {}".format(filename))
+            with open(os.path.join(certificates_directory, filename), 'wb') as f:
+                f.write(pdf)
+            for column in cert.get('data', {}):
+                if column not in columns:
+                    columns.append(column)
+
+        with open(os.path.join(job_conf.working_directory, 'certificates.csv'),
+                  'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow([ IN_MEMORY_ID_COLUMN ] + columns)
+            for cert in certificates:
+                data = cert.get('data', {})
+                writer.writerow([ os.path.basename(cert['filename']) ] +
+                                [ data.get(c, '') for c in columns ])
+        job_conf.csv_file = 'certificates.csv'
+        job_conf.certificates_directory = 'certificates'
+        job_conf.cert_names_csv_column = IN_MEMORY_ID_COLUMN
+
+    '''
+    Adds the metadata, hashes the certificates and builds the job's tree
+    '''
+    def _prepare(self, job):
+        try:
+            conf = job.conf
+            pdf_utils.add_metadata_only_to_pdf_certificates(conf)
+            certificates_directory = os.path.join(conf.working_directory,
+                                                  conf.certificates_directory)
+            job.cert_files = sorted(glob.glob(certificates_directory + os.path.sep +
+                                              "*.[pP][dD][fF]"))
+            job.tree = BinaryMerkleTree()
+            job.tree.add_leaf(pdf_utils.hash_certificates(job.cert_files))
+            job.tree.make_tree()
+        except Exception as e:
+            log.error("Job {} failed: {}".format(job.job_id, e))
+            self._finish(job, 'failed', error=str(e))
+            return
+
+        with self._condition:
+            job.status = 'pending'
+            self._pending.append(job)
+            self._condition.notify()
+
+    def _pending_certificates(self):
+        return sum(job.tree.get_leaf_count() for job in self._pending)
+
+    def _run_batcher(self):
+        while True:
+            with self._condition:
+                while not self._stopping:
+                    if self._pending:
+                        if self._pending_certificates() >= self.batch_size:
+                            break
+                        wait = self._pending[0].submitted + self.batch_interval - time.time()
+                        if wait <= 0:
+                            break
+                    else:
+                        wait = None
+                    self._condition.wait(wait)
+                if self._stopping and not self._pending:
+                    return
+                batch = self._pending
+                self._pending = []
+            self.issue_batch(batch)
+
+    '''
+    Anchors the merkle root of the jobs' roots and inserts the receipts to
+    the certificates of every job
+    '''
+    def issue_batch(self, batch):
+        try:
+            cp = issue_certificates.prepare_chainpoint_tree(
+                [ job.tree.get_merkle_root() for job in batch ], BinaryMerkleTree())
+            txid = issue_certificates.issue_merkle_root(self.conf, cp)
+        except Exception as e:
+            log.error("Batch of {} jobs failed: {}".format(len(batch), e))
+            for job in batch:
+                self._finish(job, 'failed', error=str(e))
+            return
+
+        log.info("Issued {} jobs in tx {}".format(len(batch), txid))
+        for index, job in enumerate(batch):
+            try:
+                job_cp = ChainPointV2(tree=ShardTree(job.tree, cp.get_proof(index),
+                                                     cp.get_merkle_root()))
+                issue_certificates.insert_proof_to_certificates(job.conf, job_cp, txid,
+                                                                job.cert_files)
+                self._finish(job, 'issued', txid=txid)
+            except Exception as e:
+                log.error("Job {} failed: {}".format(job.job_id, e))
+                self._finish(job, 'failed', txid=txid, error=str(e))
+
+    def _finish(self, job, status, txid=None, error=None):
+        job.txid = txid
+        job.error = error
+        job.status = status
+        job.finished = time.time()
+
+    def server_close(self):
+        super().server_close()
+        self.executor.shutdown(wait=True)
+        with self._condition:
+            self._stopping = True
+            self._condition.notify()
+        # issue whatever is pending before exiting
+        self._batcher.join()
+
+
+'''
+Loads and returns the configuration options (either from --config or from
+specifying the specific options.
+'''
+def load_config():
+    import configargparse
+    base_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
+    default_config = os.path.join(base_dir, 'config.ini')
+    p = configargparse.getArgumentParser(default_config_files=[default_config])
+    p.add_argument('-c', '--config', required=False, is_config_file=True, help='config file path')
+    p.add_argument('-o', '--host', type=str, default='127.0.0.1', help='the interface to listen on')
+    p.add_argument('--port', type=int, default=8081, help='the port to listen on')
+    p.add_argument('--workers', type=int, default=4, help='the maximum number of jobs prepared concurrently')
+    p.add_argument('-i', '--batch_interval', type=float, default=60, help='the maximum number of seconds a job waits to be anchored')
+    p.add_argument('-z', '--batch_size', type=int, default=10000, help='anchor as soon as that many certificates are pending')
+    p.add_argument('--jobs_root', type=str, help='if set, directory jobs under this directory are accepted')
+    p.add_argument('--job_ttl', type=int, default=24*3600, help='the number of seconds finished jobs can be queried before they are removed')
+    p.add_argument('--max_upload_size', type=int, default=100*1024*1024, help='the maximum request body size in bytes')
+    p.add_argument('-s', '--issuer', type=str, help='the name of the institution to (added in certificate metadata)')
+    p.add_argument('-a', '--issuing_address', type=str, help='the issuing address with enough funds for the transaction; assumed to be imported in local node wallet')
+    p.add_argument('-x', '--expiry_date', type=str, help='absolute expiry date up until the certificates will be valid')
+    p.add_argument('-v', '--csv_file', type=str, default='graduates.csv', help='the default csv file of directory jobs')
+    p.add_argument('-e', '--certificates_directory', type=str, default='certificates', help='the default certificates directory of directory jobs')
+    p.add_argument('-g', '--certificates_global_fields', type=str, default='', help='default certificates global fields expressed as JSON string')
+    p.add_argument('-f', '--cert_names_csv_column', type=str, default='name', help='the default csv column identifying the certificates of directory jobs')
+    p.add_argument('-m', '--cert_metadata_columns', type=str, default='', help='the default csv columns or global fields included as json metadata')
+    p.add_argument('-n', '--full_node_url', type=str, default='127.0.0.1:18332', help='the url of the full node to use')
+    p.add_argument('-u', '--full_node_rpc_user', type=str, help='the rpc user as specified in the node\'s configuration')
+    p.add_argument('-w', '--full_node_rpc_password', type=str, help='the rpc password as specified in the node\'s configuration')
+    p.add_argument('-l', '--blockchain', type=str, default='bitcoin', help='choose blockchain; currently bitcoin or litecoin')
+    p.add_argument('-t', '--testnet', action='store_true', help='specify if testnet or mainnet will be used')
+    p.add_argument('--tx_fee_per_byte', type=int, default=100, help='the fee per transaction byte in satoshis')
+    p.add_argument('--utxo_pool_size', type=int, default=0, help='fan out the issuing address\' funds into this many UTXOs and lease them to transactions so that they do not wait for confirmations; 0 disables the pool')
+    p.add_argument('-p', '--issuer_identifier', type=str, default='        ', help='optional 8 bytes identifier that represents the issuer intented to go on the blockchain')
+    p.add_argument('--verify_issuer', type=str, default='{ "methods": [] }',
+                   help='Which verification methods to use to validate the issuer')
+    p.add_argument('--compact_receipts', action='store_true', help='store the chainpoint receipts in the compact binary (base64) form instead of JSON')
+    p.add_argument('--metrics', action='store_true', help='collect per-stage timings and counters and expose them at /metrics')
+    args, _ = p.parse_known_args()
+    return args
+
+
+def main():
+    if sys.version_info.major < 3:
+        sys.stderr.write('Python 3 is required!')
+        sys.exit(1)
+
+    configure_logging()
+    conf = load_config()
+    if not conf.full_node_rpc_password:
+        sys.exit('full_node_rpc_password is required to run the issuance daemon')
+    if conf.metrics:
+        instrumentation.enable()
+    server = IssuanceServer(conf)
+    print('Accepting issuance jobs on {}:{}'.format(conf.host, conf.port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        shutil.rmtree(server.spool_directory, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
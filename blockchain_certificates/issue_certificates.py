@@ -5,29 +5,45 @@ import os
 import sys
 import glob
 import json
-import configargparse
-from pdfrw import PdfReader, PdfWriter, PdfDict
+import hashlib
+import tempfile
+from blockchain_certificates import configure_logging
+from blockchain_certificates import instrumentation
 from blockchain_certificates.chainpoint import ChainPointV2
+from blockchain_certificates.merkle_tree import BinaryMerkleTree
 from blockchain_certificates import pdf_utils
 from blockchain_certificates import publish_hash
 from blockchain_certificates import cred_protocol
+from blockchain_certificates import tree_store
 
 
 '''
 Inserts the ChainPointV2 proof as pdf metadata for each certificate. Metadata
-key is "chainpoint_proof"
+key is "chainpoint_proof". cert_files can be any iterable, in the same order
+as the leaves of the tree; every certificate is checked against its leaf.
 TODO: duplicate with create_certificates
 '''
 def insert_proof_to_certificates(conf, cp, txid, cert_files, interactive=False):
+    from pdfrw import PdfReader, PdfWriter, PdfDict
     if interactive:
         print('')
     for ind, val in enumerate(cert_files):
-        proof = json.dumps( cp.get_receipt(ind, txid, conf.blockchain,
-                                           conf.testnet) )
-        metadata = PdfDict(chainpoint_proof=proof)
-        pdf = PdfReader(val)
-        pdf.Info.update(metadata)
-        PdfWriter().write(val, pdf)
+        with instrumentation.span('proof_insertion'):
+            with open(val, 'rb') as cert:
+                data = cert.read()
+            if ind >= cp.get_leaf_count() or \
+                    hashlib.sha256(data).hexdigest() != cp.get_leaf(ind):
+                raise RuntimeError('Certificate {} changed since it was hashed'.format(val))
+            if getattr(conf, 'compact_receipts', False):
+                proof = cp.get_compact_receipt(ind, txid, conf.blockchain,
+                                               conf.testnet)
+            else:
+                proof = json.dumps( cp.get_receipt(ind, txid, conf.blockchain,
+                                                   conf.testnet) )
+            metadata = PdfDict(chainpoint_proof=proof)
+            pdf = PdfReader(fdata=data)
+            pdf.Info.update(metadata)
+            PdfWriter().write(val, pdf)
 
         if interactive:
             # print progress
@@ -36,13 +52,28 @@ def insert_proof_to_certificates(conf, cp, txid, cert_files, interactive=False):
 
 '''
 Creates a new ChainPointV2 object initializes with the certificates passed and
-creates the corresponding merkle tree
+creates the corresponding merkle tree; tree can be a BinaryMerkleTree instead
+of the default merkletools one
 TODO: duplicate with create_certificates
 '''
-def prepare_chainpoint_tree(hashes):
-    cp = ChainPointV2()
-    cp.add_leaf(hashes)
-    cp.make_tree()
+def prepare_chainpoint_tree(hashes, tree=None):
+    with instrumentation.span('tree_build'):
+        cp = ChainPointV2(tree=tree)
+        cp.add_leaf(hashes)
+        cp.make_tree()
+    return cp
+
+
+'''
+Creates a new ChainPointV2 object with tree, a BinaryMerkleTree, and hashes
+the certificates into it one at a time, so that memory does not grow with the
+number of certificates
+'''
+def prepare_streaming_chainpoint_tree(cert_files, tree):
+    cp = ChainPointV2(tree=tree)
+    pdf_utils.hash_certificates_into_tree(cert_files, tree)
+    with instrumentation.span('tree_build'):
+        cp.make_tree()
     return cp
 
 
@@ -51,9 +82,20 @@ Loads and returns the configuration options (either from --config or from
 specifying the specific options.
 '''
 def load_config():
+    import configargparse
     base_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
     default_config = os.path.join(base_dir, 'config.ini')
     p = configargparse.getArgumentParser(default_config_files=[default_config])
+    add_arguments(p)
+    args, _ = p.parse_known_args()
+    return args
+
+
+'''
+Adds the issue-certificates options to the argument parser p; also used by
+the tools that extend them (e.g. sharded_issuance)
+'''
+def add_arguments(p):
     p.add('-c', '--config', required=False, is_config_file=True, help='config file path')
     p.add_argument('-d', '--working_directory', type=str, default='.', help='the main working directory - all paths/files are relative to this')
     p.add_argument('-s', '--issuer', type=str, help='the name of the institution to (added in certificate metadata)')
@@ -67,14 +109,19 @@ def load_config():
     p.add_argument('-n', '--full_node_url', type=str, default='127.0.0.1:18332', help='the url of the full node to use')
     p.add_argument('-u', '--full_node_rpc_user', type=str, help='the rpc user as specified in the node\'s configuration')
     p.add_argument('-w', '--full_node_rpc_password', type=str, help='the rpc password as specified in the node\'s configuration')
+    p.add_argument('-k', '--owner_keys_file', type=str, help='a file with the owners\' private keys (WIF, one per line) to sign owner proofs locally instead of with the node')
     p.add_argument('-l', '--blockchain', type=str, default='bitcoin', help='choose blockchain; currently bitcoin or litecoin')
     p.add_argument('-t', '--testnet', action='store_true', help='specify if testnet or mainnet will be used')
     p.add_argument('-f', '--tx_fee_per_byte', type=int, default=100, help='the fee per transaction byte in satoshis')
     p.add_argument('-p', '--issuer_identifier', type=str, default='        ', help='optional 8 bytes identifier that represents the issuer intented to go on the blockchain')
     p.add_argument('-r', '--verify_issuer', type=str, default='{ "methods": [] }',
                    help='Which verification methods to use to validate the issuer')
-    args, _ = p.parse_known_args()
-    return args
+    p.add_argument('--utxo_pool_size', type=int, default=0, help='fan out the issuing address\' funds into this many UTXOs and lease them to transactions so that they do not wait for confirmations; 0 disables the pool')
+    p.add_argument('--streaming', action='store_true', help='hash certificates and insert proofs one at a time keeping the merkle tree in a memory-mapped file; for very large batches')
+    p.add_argument('--tree_file', type=str, help='persist the merkle tree of the batch to this file (relative to the working directory) to regenerate receipts later')
+    p.add_argument('--compact_receipts', action='store_true', help='store the chainpoint receipts in the compact binary (base64) form instead of JSON')
+    p.add_argument('--metrics_file', type=str, help='write per-stage timings and counters to this file (Prometheus text format if it ends in .prom, JSON otherwise)')
+    p.add_argument('--profile', action='store_true', help='profile the run with cProfile and tracemalloc and write the stats and a per-stage peak memory summary to the working directory')
 
 
 def issue_certificates(conf, interactive=False):
@@ -83,13 +130,59 @@ def issue_certificates(conf, interactive=False):
 
     pdf_utils.add_metadata_only_to_pdf_certificates(conf, interactive)
 
+    certificates_directory = os.path.join(conf.working_directory, conf.certificates_directory)
+    if getattr(conf, 'streaming', False):
+        # the files are listed, hashed and then proofs are inserted one at a
+        # time; the tree is kept in a memory-mapped temporary file
+        tree_fd, tree_path = tempfile.mkstemp(prefix='.', suffix='.tree',
+                                              dir=conf.working_directory)
+        os.close(tree_fd)
+        tree = BinaryMerkleTree(tree_path)
+        try:
+            cp = prepare_streaming_chainpoint_tree(
+                pdf_utils.iter_certificate_files(certificates_directory), tree)
+            txid = issue_merkle_root(conf, cp, interactive)
+            _write_tree_store(conf, tree, txid)
+            insert_proof_to_certificates(
+                conf, cp, txid, pdf_utils.iter_certificate_files(certificates_directory),
+                interactive)
+        finally:
+            tree.close()
+            os.remove(tree_path)
+        return txid
+
     # get certificate file list here (to ensure it is identical to both
     # 'hash_certificates' and 'insert_proof_to_certificates')
-    certificates_directory = os.path.join(conf.working_directory, conf.certificates_directory)
     cert_files = glob.glob(certificates_directory + os.path.sep + "*.[pP][dD][fF]")
 
     cert_hashes = pdf_utils.hash_certificates(cert_files)
-    cp = prepare_chainpoint_tree(cert_hashes)
+    tree = BinaryMerkleTree() if getattr(conf, 'tree_file', None) else None
+    cp = prepare_chainpoint_tree(cert_hashes, tree)
+
+    txid = issue_merkle_root(conf, cp, interactive)
+    _write_tree_store(conf, tree, txid)
+
+    insert_proof_to_certificates(conf, cp, txid, cert_files, interactive)
+
+    return txid
+
+
+'''
+Persists the tree, if a tree_file is configured, so that receipts can be
+regenerated later (see tree_store); it is written before the proofs are
+inserted so that an interrupted insertion can be completed from it
+'''
+def _write_tree_store(conf, tree, txid):
+    if getattr(conf, 'tree_file', None):
+        tree_store.write_tree_store(os.path.join(conf.working_directory, conf.tree_file),
+                                    tree, txid, conf.blockchain, conf.testnet)
+
+
+'''
+Issues the merkle root of the tree (and expiry date if any) to the blockchain
+and returns the txid
+'''
+def issue_merkle_root(conf, cp, interactive=False):
 
     # create OP_RETURN in bytes
     if conf.expiry_date:
@@ -100,15 +193,7 @@ def issue_certificates(conf, interactive=False):
         op_return_bstring = cred_protocol.issue_cmd(conf.issuer_identifier,
                                                     cp.get_merkle_root())
 
-    txid = publish_hash.issue_op_return(conf, op_return_bstring, interactive)
-
-    #import time
-    #start = time.time()
-    insert_proof_to_certificates(conf, cp, txid, cert_files, interactive)
-    #end = time.time()
-    #print("insert_proof_to_certificates()", end-start, " seconds")
-
-    return txid
+    return publish_hash.issue_op_return(conf, op_return_bstring, interactive)
 
 
 def main():
@@ -116,8 +201,14 @@ def main():
         sys.stderr.write('Python 3 is required!')
         sys.exit(1)
 
+    configure_logging()
     conf = load_config()
-    txid = issue_certificates(conf, True)
+    with instrumentation.reporting(conf.metrics_file), \
+         instrumentation.profiling(conf.working_directory if conf.profile else None,
+                                   'issue-certificates') as profile_files:
+        txid = issue_certificates(conf, True)
+    for f in profile_files:
+        print('Profile written to {}'.format(f))
     print('\nTx hash: {}'.format(txid))
 
 
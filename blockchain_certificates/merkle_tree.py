@@ -0,0 +1,208 @@
+'''
+A compact binary Merkle tree that is a drop-in replacement for merkletools'
+MerkleTools (sha256 only) with identical roots and proofs. Every node is
+stored as its 32 byte hash and all levels are kept consecutively in a single
+buffer, leaves first, so memory is 2 x leaves x 32 bytes instead of millions
+of Python objects. If a path is given the buffer is a file that is
+memory-mapped once the tree is made, so that it does not need to fit in
+memory at all.
+
+    tree = BinaryMerkleTree(path='batch.tree')
+    for digest in digests:
+        tree.add_leaf(digest)
+    tree.make_tree()
+    cp = ChainPointV2(tree=tree)
+'''
+import os
+import mmap
+import hashlib
+
+HASH_SIZE = 32
+
+
+'''
+Returns the number of nodes of every level of a tree with leaf_count leaves,
+leaves first
+'''
+def level_sizes(leaf_count):
+    sizes = [ leaf_count ]
+    while sizes[-1] > 1:
+        sizes.append((sizes[-1] + 1) // 2)
+    return sizes
+
+
+'''
+Returns the proof, in the merkletools format, of the leaf at index. nodes is
+a buffer with all the levels of the tree (see level_sizes) starting at
+offset 0.
+'''
+def get_proof_from_nodes(nodes, leaf_count, index):
+    proof = []
+    offset = 0
+    for size in level_sizes(leaf_count)[:-1]:
+        # the odd end node is promoted as is to the next level
+        if not (index == size - 1 and size % 2 == 1):
+            is_right_node = index % 2
+            sibling_index = index - 1 if is_right_node else index + 1
+            start = offset + sibling_index * HASH_SIZE
+            proof.append({ "left" if is_right_node else "right":
+                           bytes(nodes[start:start + HASH_SIZE]).hex() })
+        offset += size * HASH_SIZE
+        index //= 2
+    return proof
+
+
+'''
+Validates a proof in the merkletools format; as MerkleTools.validate_proof
+'''
+def validate_proof(proof, target_hash, merkle_root):
+    proof_hash = bytes.fromhex(target_hash)
+    for p in proof:
+        if 'left' in p:
+            proof_hash = hashlib.sha256(bytes.fromhex(p['left']) + proof_hash).digest()
+        else:
+            proof_hash = hashlib.sha256(proof_hash + bytes.fromhex(p['right'])).digest()
+    return proof_hash == bytes.fromhex(merkle_root)
+
+
+class BinaryMerkleTree(object):
+    def __init__(self, path=None):
+        self.path = path
+        self._file = None
+        self._nodes = None
+        self.reset_tree()
+
+    def reset_tree(self):
+        self.close()
+        self._leaf_count = 0
+        self.is_ready = False
+        if self.path:
+            self._file = open(self.path, 'w+b')
+            self._leaves = self._file
+        else:
+            self._leaves = bytearray()
+
+    '''
+    Closes the memory map and file, if any; the file itself is not removed
+    '''
+    def close(self):
+        if isinstance(self._nodes, memoryview):
+            self._nodes.release()
+        if isinstance(self._nodes, mmap.mmap):
+            self._nodes.close()
+        self._nodes = None
+        if self._file:
+            self._file.close()
+            self._file = None
+
+    '''
+    Adds one or more leaves as in MerkleTools; leaves can also be given as
+    32 byte digests which is the cheapest way to add them
+    '''
+    def add_leaf(self, values, do_hash=False):
+        if self._nodes is not None:
+            self._unmake_tree()
+        self.is_ready = False
+        if not isinstance(values, (tuple, list)):
+            values = [ values ]
+        for v in values:
+            if do_hash:
+                v = hashlib.sha256(v.encode('utf-8')).digest()
+            elif not isinstance(v, (bytes, bytearray)):
+                v = bytes.fromhex(v)
+            if len(v) != HASH_SIZE:
+                raise ValueError('leaves must be {} byte hashes'.format(HASH_SIZE))
+            if self._file:
+                self._file.write(v)
+            else:
+                self._leaves += v
+            self._leaf_count += 1
+
+    def get_leaf(self, index):
+        return self._node(0, index).hex()
+
+    def get_leaf_count(self):
+        return self._leaf_count
+
+    def get_tree_ready_state(self):
+        return self.is_ready
+
+    def make_tree(self):
+        self.is_ready = False
+        if self._leaf_count == 0:
+            self.is_ready = True
+            return
+        sizes = level_sizes(self._leaf_count)
+        total = sum(sizes) * HASH_SIZE
+        if self._nodes is not None:
+            self._unmake_tree()
+        if self._file:
+            self._file.truncate(total)
+            self._file.flush()
+            nodes = mmap.mmap(self._file.fileno(), total)
+        else:
+            self._leaves.extend(bytes(total - len(self._leaves)))
+            nodes = memoryview(self._leaves)
+
+        sha256 = hashlib.sha256
+        offset = 0
+        for size in sizes[:-1]:
+            next_offset = offset + size * HASH_SIZE
+            out = next_offset
+            end = offset + (size - size % 2) * HASH_SIZE
+            for pair in range(offset, end, 2 * HASH_SIZE):
+                nodes[out:out + HASH_SIZE] = sha256(nodes[pair:pair + 2 * HASH_SIZE]).digest()
+                out += HASH_SIZE
+            if size % 2 == 1:
+                nodes[out:out + HASH_SIZE] = nodes[end:end + HASH_SIZE]
+            offset = next_offset
+
+        self._nodes = nodes
+        self.is_ready = True
+
+    '''
+    Returns the buffer with all the levels of the tree, leaves first
+    '''
+    def get_nodes(self):
+        return self._nodes
+
+    def get_merkle_root(self):
+        if not self.is_ready or self._leaf_count == 0:
+            return None
+        sizes = level_sizes(self._leaf_count)
+        return self._node(len(sizes) - 1, 0).hex()
+
+    def get_proof(self, index):
+        if not self.is_ready or self._leaf_count == 0:
+            return None
+        if index < 0 or index > self._leaf_count - 1:
+            return None
+        return get_proof_from_nodes(self._nodes, self._leaf_count, index)
+
+    def validate_proof(self, proof, target_hash, merkle_root):
+        return validate_proof(proof, target_hash, merkle_root)
+
+    # drops the inner levels so that more leaves can be appended
+    def _unmake_tree(self):
+        if isinstance(self._nodes, memoryview):
+            self._nodes.release()
+            del self._leaves[self._leaf_count * HASH_SIZE:]
+        else:
+            self._nodes.close()
+            self._file.truncate(self._leaf_count * HASH_SIZE)
+            self._file.seek(0, os.SEEK_END)
+        self._nodes = None
+
+    def _node(self, level, index):
+        offset = sum(level_sizes(self._leaf_count)[:level])
+        start = (offset + index) * HASH_SIZE
+        if self._nodes is not None:
+            return bytes(self._nodes[start:start + HASH_SIZE])
+        # leaves of a tree that is not made yet
+        if self._file:
+            self._file.flush()
+            self._file.seek(start)
+            value = self._file.read(HASH_SIZE)
+            self._file.seek(0, os.SEEK_END)
+            return value
+        return bytes(self._leaves[start:start + HASH_SIZE])
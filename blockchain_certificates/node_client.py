@@ -0,0 +1,93 @@
+'''
+A client for the full node's JSON-RPC interface that is shared for the whole
+run: it keeps one authenticated keep-alive connection to the node and
+supports JSON-RPC batch requests.
+
+    node = node_client.get_node_client(conf)
+    unspent = node.listunspent(1, 9999999, [address])
+    sigs = node.batch([ ['signmessage', address, msg] for msg in messages ])
+'''
+import threading
+import http.client
+
+from blockchain_certificates import instrumentation
+
+# the maximum number of calls sent in a single batch request
+BATCH_SIZE = 100
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+class NodeClient(object):
+    def __init__(self, rpc_user, rpc_password, host, port, timeout=30):
+        if not rpc_user or not rpc_password:
+            raise ValueError('rpcuser or rpcpassword is missing')
+        self.url = 'http://{}:{}@{}:{}'.format(rpc_user, rpc_password, host, port)
+        self.timeout = timeout
+        self._proxy = None
+        # AuthServiceProxy (and its connection) is not thread-safe
+        self._lock = threading.Lock()
+
+    def _get_proxy(self):
+        if self._proxy is None:
+            from bitcoinrpc.authproxy import AuthServiceProxy
+            self._proxy = AuthServiceProxy(self.url, timeout=self.timeout)
+        return self._proxy
+
+    # the node (or a proxy in front of it) may have closed the idle
+    # connection; reconnect once since no request was processed in that case
+    def _request(self, func):
+        with self._lock:
+            try:
+                return func(self._get_proxy())
+            except (http.client.RemoteDisconnected, http.client.CannotSendRequest,
+                    BrokenPipeError, ConnectionResetError):
+                self._proxy = None
+                return func(self._get_proxy())
+
+    '''
+    Calls the JSON-RPC method with params and returns its result
+    '''
+    def call(self, method, *params):
+        instrumentation.count('rpc_calls')
+        instrumentation.count('rpc_requests')
+        return self._request(lambda proxy: getattr(proxy, method)(*params))
+
+    def __getattr__(self, method):
+        if method.startswith('_'):
+            raise AttributeError(method)
+        return lambda *params: self.call(method, *params)
+
+    '''
+    Sends calls, a list of [method, param1, param2, ...], in batch requests of
+    up to batch_size calls and returns their results in the same order. A
+    JSONRPCException is raised if any of the calls fails.
+    '''
+    def batch(self, calls, batch_size=BATCH_SIZE):
+        results = []
+        for i in range(0, len(calls), batch_size):
+            chunk = calls[i:i + batch_size]
+            instrumentation.count('rpc_calls', len(chunk))
+            instrumentation.count('rpc_requests')
+            # batch_ consumes the lists it is given
+            results += self._request(
+                lambda proxy: proxy.batch_([ list(c) for c in chunk ]))
+        return results
+
+
+'''
+Returns the node client for the node configured in conf (full_node_url,
+full_node_rpc_user and full_node_rpc_password); clients are created once and
+shared by the issuance, owner signing and revocation code
+'''
+def get_node_client(conf):
+    host, port = conf.full_node_url.split(':')
+    key = (host, port, conf.full_node_rpc_user, conf.full_node_rpc_password)
+    with _clients_lock:
+        client = _clients.get(key)
+        if client is None:
+            client = _clients[key] = NodeClient(conf.full_node_rpc_user,
+                                                conf.full_node_rpc_password,
+                                                host, port)
+    return client
@@ -1,13 +1,16 @@
 '''
 PDF related functions to create certificates and index.
 '''
+import io
 import os
 import sys
 import csv
 import json
-import glob
 import hashlib
-from pdfrw import PdfReader, PdfWriter, PdfDict
+
+from blockchain_certificates import instrumentation
+from blockchain_certificates import node_client
+from blockchain_certificates import utils
 
 
 '''
@@ -47,47 +50,52 @@ def add_metadata_only_to_pdf_certificates(conf, interactive=False):
             error_str = "directory {} does not exist".format(certificates_directory)
             raise ValueError(error_str)
 
-    # get a list of all PDF files and exit if none
-    cert_files = glob.glob(certificates_directory + os.path.sep + "*.[pP][dD][fF]")
-    if not cert_files:
-        if interactive:
-            print('Directory {} is empty. Exiting.'.format(certificates_directory))
-            sys.exit()
-        else:
-            error_str = "directory {} is empty".format(certificates_directory)
-            raise ValueError(error_str)
-
-    data = _process_csv(csv_file) # TODO CLEAN, conf.certificates_global_fields)
-    for cert_data in data:
-        certificate_file = None
-        # get file_id to use to get the appropriate certificate
-        file_id = cert_data[conf.cert_names_csv_column]
-        # find PDF file that starts with file_id
-        for fp in cert_files:
-            filename = os.path.basename(fp)
-            if os.path.isfile(fp) and filename.startswith(file_id):
-                certificate_file = fp
+    # the CSV rows by file id; the certificates are matched to them while the
+    # directory is scanned instead of listing (and sorting) all the files
+    rows = {}
+    for cert_data in _iter_csv(csv_file): # TODO CLEAN, conf.certificates_global_fields)
+        rows[cert_data[conf.cert_names_csv_column]] = cert_data
+    max_id_length = max((len(file_id) for file_id in rows), default=0)
+
+    owner_signer = OwnerProofSigner(conf)
+    cert_files_found = False
+    for certificate_file in iter_certificate_files(certificates_directory):
+        cert_files_found = True
+        # the row of the longest file_id that the file name starts with
+        filename = os.path.basename(certificate_file)
+        cert_data = None
+        for length in range(min(len(filename), max_id_length), 0, -1):
+            cert_data = rows.pop(filename[:length], None)
+            if cert_data is not None:
                 break
 
-        if certificate_file:
-            #import time
-            #start = time.time()
+        if cert_data is not None:
             # TODO cleanup - passes full conf anyway to get user/pw for proxy node
             _fill_pdf_metadata(certificate_file, conf.issuer, conf.issuing_address,
                                conf.cert_metadata_columns, cert_data,
                                conf.certificates_global_fields,
                                conf.verify_issuer,
-                               conf, interactive)
-            #end = time.time()
-            #print("_fill_pdf_metadata()", end-start, " seconds")
+                               conf, interactive, owner_signer)
+
+    # exit if there are no PDF files
+    if not cert_files_found:
+        if interactive:
+            print('Directory {} is empty. Exiting.'.format(certificates_directory))
+            sys.exit()
         else:
-            if interactive:
-                print('\nSkipping {}\n'.format(certificate_file))
-            else:
-                # note that in non-interactive if a file is not found we fail
-                # completely the issuance
-                error_str = "skipping {}".format(certificates_directory)
-                raise ValueError(error_str)
+            error_str = "directory {} is empty".format(certificates_directory)
+            raise ValueError(error_str)
+
+    # the rows left did not match any file
+    for file_id in rows:
+        if interactive:
+            print('\nSkipping {}\n'.format(file_id))
+        else:
+            # note that in non-interactive if a file is not found we fail
+            # completely the issuance
+            error_str = "skipping {}".format(file_id)
+            raise ValueError(error_str)
+    owner_signer.flush()
 
 
 
@@ -124,7 +132,8 @@ def populate_pdf_certificates(conf, interactive=False):
     # create certs_dir if it does not exist
     os.makedirs(certificates_directory, exist_ok=True)
 
-    data = _process_csv(csv_file)
+    owner_signer = OwnerProofSigner(conf)
+    data = _iter_csv(csv_file)
     for cert_data in data:
         # get name to use for cert name
         fullname = cert_data[conf.cert_names_csv_column].replace(' ', '_')
@@ -136,24 +145,28 @@ def populate_pdf_certificates(conf, interactive=False):
         _fill_pdf_metadata(out_file, conf.issuer, conf.issuing_address,
                            conf.cert_metadata_columns, cert_data,
                            conf.certificates_global_fields, conf.verify_issuer,
-                           conf, interactive)
+                           conf, interactive, owner_signer)
+    owner_signer.flush()
 
 
 def _process_csv(csv_file):
-    headers = []
-    data =  []
-    csv_data = csv.reader(open(csv_file))
-    for i, row in enumerate(csv_data):
-        if i == 0:
-            headers = row
-            continue;
-        field = {}
-        # add all csv columns/fields
-        for i in range(len(headers)):
-            field[headers[i]] = row[i]
-        data.append(field)
-
-    return data
+    return list(_iter_csv(csv_file))
+
+
+'''
+Yields the rows of the CSV file one at a time as dictionaries keyed by the
+headers of the first row
+'''
+def _iter_csv(csv_file):
+    with open(csv_file) as f:
+        csv_data = csv.reader(f)
+        headers = next(csv_data, [])
+        for row in csv_data:
+            field = {}
+            # add all csv columns/fields
+            for i in range(len(headers)):
+                field[headers[i]] = row[i]
+            yield field
 
 
 '''
@@ -170,8 +183,10 @@ def _fill_pdf_form(fields, pdf_cert_template_file, out_file, interactive=False):
 
     # TODO: it is inefficient to start the JVM for every certificate
     # TODO: cmd too long, cleanup
+    fill_span = instrumentation.span('fill').start()
     cmd = 'java -cp {java_path}{pathsep}{java_path}{sep}itextpdf-5.5.10.jar{pathsep}{java_path}{sep}json-simple-1.1.1.jar FillPdf "{pdf_cert_template_file}" "{out_file}" "{fields_json_string}"'.format(java_path=java_path, pathsep=os.path.pathsep, sep=os.path.sep, pdf_cert_template_file=pdf_cert_template_file, out_file=out_file, fields_json_string=fields_json_string)
     os.system(cmd)
+    fill_span.stop()
 
     if interactive:
         # print progress
@@ -179,14 +194,54 @@ def _fill_pdf_form(fields, pdf_cert_template_file, out_file, interactive=False):
 
 
 
+'''
+Loads the owners' private keys from owner_keys_file (relative to the working
+directory), one WIF key per line; empty lines and lines starting with # are
+ignored. Returns a dictionary from public key hex (both compressed and
+uncompressed) to PrivateKey or None if no owner_keys_file is configured.
+'''
+def load_owner_keys(conf):
+    owner_keys_file = getattr(conf, 'owner_keys_file', None)
+    if not owner_keys_file:
+        return None
+
+    if(conf.blockchain == 'litecoin'):
+        from litecoinutils.keys import PrivateKey
+    else:
+        from bitcoinutils.keys import PrivateKey
+
+    owner_keys = {}
+    with open(os.path.join(conf.working_directory, owner_keys_file)) as f:
+        for line in f:
+            wif = line.strip()
+            if not wif or wif.startswith('#'):
+                continue
+            # decoded with the configured network, not the global setup()
+            secret_exponent, _ = utils.wif_to_secret_exponent(wif, conf.blockchain,
+                                                              conf.testnet)
+            key = PrivateKey(secret_exponent=secret_exponent)
+            pub = key.get_public_key()
+            owner_keys[pub.to_hex(compressed=True)] = key
+            owner_keys[pub.to_hex(compressed=False)] = key
+    return owner_keys
+
+
+
 '''
 Inserts standard metadata to a pdf certfificate. All CSV fields in 'data'
 and 'global_fields' are added as metadata to the JSON metadata pdf field.
 It then adds the required 'version', 'issuer' (name, identity) as well as an empty
 chainpoint_proof key.
+The owner_proof, if any, is added by owner_signer (see OwnerProofSigner);
+when more certificates are processed the caller passes a shared signer and
+flushes it at the end.
 '''
 def _fill_pdf_metadata(out_file, issuer, issuer_address, column_fields, data,
-                       global_columns, verify_issuer, conf, interactive=False):
+                       global_columns, verify_issuer, conf, interactive=False,
+                       owner_signer=None):
+    from pdfrw import PdfReader, PdfWriter, PdfDict
+
+    metadata_span = instrumentation.span('metadata').start()
 
     # create version
     version = 2
@@ -253,34 +308,118 @@ def _fill_pdf_metadata(out_file, issuer, issuer_address, column_fields, data,
         pdf.Info.update(pdf_metadata)
     else:
         pdf.Info = pdf_metadata
-    PdfWriter().write(out_file, pdf)
+    if not owner:
+        PdfWriter().write(out_file, pdf)
+    else:
+        # keep the pdf in memory; it is signed and written only once below
+        pdf_bytes = io.BytesIO()
+        PdfWriter().write(pdf_bytes, pdf)
+        pdf_bytes = pdf_bytes.getvalue()
+    metadata_span.stop()
+    instrumentation.count('files')
 
     # if owner exists then need to add owner_proof
-    # hash pdf, sign hash message using node and add in owner_proof
     if owner:
-        ##import time
-        ##start = time.time()
-        sha256_hash = None
-        with open(out_file, 'rb' ) as pdf:
-            sha256_hash = hashlib.sha256(pdf.read()).hexdigest()
-
-        if(conf.blockchain == 'litecoin'):
-            from litecoinutils.setup import setup
-            from litecoinutils.proxy import NodeProxy
-            from litecoinutils.keys import PublicKey
+        if owner_signer is None:
+            single_signer = OwnerProofSigner(conf)
+            single_signer.add(out_file, pdf_bytes, owner_address, owner_pk)
+            single_signer.flush()
         else:
-            from bitcoinutils.setup import setup
-            from bitcoinutils.proxy import NodeProxy
-            from bitcoinutils.keys import PublicKey
-        if(conf.testnet):
-            setup('testnet')
-        else:
-            setup('mainnet')
+            owner_signer.add(out_file, pdf_bytes, owner_address, owner_pk)
+
+    if interactive:
+        # print progress
+        print('.', end="", flush=True)
+
+
+
+'''
+Signs message with private_key and returns the compact signature in base64;
+identical to PrivateKey.sign_message of bitcoinutils/litecoinutils. The
+latter tries every recovery id by recovering and comparing public keys which
+is two orders of magnitude slower than the signature itself; instead the
+recovery id is derived from the RFC6979 nonce point. The node's signmessage
+normalizes s to the lower half of the order, so its signatures can differ,
+but both verify against the owner's address.
+'''
+def _sign_message(conf, private_key, message, compressed=True):
+    from base64 import b64encode
+    from ecdsa import rfc6979
+    from ecdsa.util import sigencode_string
+    if(conf.blockchain == 'litecoin'):
+        from litecoinutils.keys import add_magic_prefix
+    else:
+        from bitcoinutils.keys import add_magic_prefix
+
+    digest = hashlib.sha256(
+        hashlib.sha256(add_magic_prefix(message)).digest()).digest()
+    key = private_key.key
+    generator = key.curve.generator
+    order = generator.order()
+    k = rfc6979.generate_k(order, key.privkey.secret_multiplier,
+                           hashlib.sha256, digest)
+    signature = key.sign_digest(digest, sigencode=sigencode_string, k=k)
+    point = generator * k
+    # r == 0 or s == 0 would need another nonce; let the library handle it
+    if point.x() % order != int.from_bytes(signature[:32], 'big'):
+        return private_key.sign_message(message, compressed)
+
+    recid = 27 + (point.y() & 1) + (2 if point.x() >= order else 0)
+    if compressed:
+        recid += 4
+    return b64encode(bytes([recid]) + signature).decode('utf-8')
+
 
-        host, port = conf.full_node_url.split(':') #TODO: update when NodeProxy accepts full url!
-        proxy = NodeProxy(conf.full_node_rpc_user, conf.full_node_rpc_password,
-                          host, port).get_proxy()
 
+'''
+Adds the owner_proof, i.e. the owner's signature of the hash of the pdf, to
+certificates. If the owner's private key is in owner_keys_file (see
+load_owner_keys) the hash is signed locally right away. Otherwise it is
+queued and signed by the node's wallet; the signmessage calls are sent in
+batches of node_client.BATCH_SIZE over the shared node connection. Call
+flush() after the last certificate.
+'''
+class OwnerProofSigner(object):
+    def __init__(self, conf):
+        self.conf = conf
+        self.owner_keys = load_owner_keys(conf)
+        self._pending = []
+
+    '''
+    Signs, or queues for signing, the certificate out_file whose contents
+    (with an empty owner_proof) are pdf_bytes
+    '''
+    def add(self, out_file, pdf_bytes, owner_address, owner_pk):
+        owner_span = instrumentation.span('owner_signing').start()
+        sha256_hash = hashlib.sha256(pdf_bytes).hexdigest()
+        owner_key = self.owner_keys.get(owner_pk.lower()) if self.owner_keys else None
+        if owner_key:
+            sig = _sign_message(self.conf, owner_key, sha256_hash,
+                                compressed=(len(owner_pk) == 66))
+            _write_owner_proof(out_file, pdf_bytes, sig)
+        else:
+            self._pending.append((out_file, pdf_bytes,
+                                  self._signing_address(owner_address, owner_pk),
+                                  sha256_hash))
+        owner_span.stop()
+        if len(self._pending) >= node_client.BATCH_SIZE:
+            self.flush()
+
+    '''
+    Signs the queued certificates with the node and writes them
+    '''
+    def flush(self):
+        if not self._pending:
+            return
+        with instrumentation.span('owner_signing'):
+            node = node_client.get_node_client(self.conf)
+            sigs = node.batch([ ['signmessage', address, sha256_hash]
+                                for _, _, address, sha256_hash in self._pending ])
+            for (out_file, pdf_bytes, _, _), sig in zip(self._pending, sigs):
+                _write_owner_proof(out_file, pdf_bytes, sig)
+        self._pending = []
+
+    def _signing_address(self, owner_address, owner_pk):
         # Due to an old unresolved issue still pending in Bitcoin v0.20.0
         # signmessage does not support signing with bech32 key.
         # To resolve we use the public key to get the base58check encoding that
@@ -291,25 +430,20 @@ def _fill_pdf_metadata(out_file, issuer, issuer_address, column_fields, data,
             owner_address.startswith('ltc') or
             owner_address.startswith('tltc')
         ):
-            owner_address = PublicKey(owner_pk).get_address().to_string()
+            owner_address = utils.public_key_to_address(owner_pk, self.conf.blockchain,
+                                                         self.conf.testnet)
+        return owner_address
 
-        # NOTE that address (the encoding) might have changed here from bech32
-        # to legacy... take care if you use it again in this function!
 
-        sig = proxy.signmessage(owner_address, sha256_hash)
 
-        # add owner_proof to metadata
-        pdf_metadata = PdfDict(owner_proof=sig)
-        pdf = PdfReader(out_file)
-        pdf.Info.update(pdf_metadata)
-        PdfWriter().write(out_file, pdf)
-        ##end = time.time()
-        ##print(end-start, " seconds")
-        ##exit()
-
-    if interactive:
-        # print progress
-        print('.', end="", flush=True)
+'''
+Writes pdf_bytes to out_file with the owner_proof set to sig
+'''
+def _write_owner_proof(out_file, pdf_bytes, sig):
+    from pdfrw import PdfReader, PdfWriter, PdfDict
+    pdf = PdfReader(fdata=pdf_bytes)
+    pdf.Info.update(PdfDict(owner_proof=sig))
+    PdfWriter().write(out_file, pdf)
 
 
 
@@ -318,9 +452,41 @@ Hashes (sha256) all files passed as an array and returns them as an array.
 '''
 def hash_certificates(cert_files):
     hashes = []
-    for f in cert_files:
-        with open(f, 'rb') as cert:
-            hashes.append(hashlib.sha256(cert.read()).hexdigest())
+    with instrumentation.span('hashing'):
+        for f in cert_files:
+            with open(f, 'rb') as cert:
+                data = cert.read()
+                hashes.append(hashlib.sha256(data).hexdigest())
+            instrumentation.count('bytes', len(data))
 
     return hashes
 
+
+
+
+'''
+Yields the paths of the pdf files in certificates_directory one at a time
+instead of listing them all in memory. The order is the directory order,
+which is the same for successive calls as long as the directory is not
+modified.
+'''
+def iter_certificate_files(certificates_directory):
+    with os.scandir(certificates_directory) as entries:
+        for entry in entries:
+            # same files as glob('*.[pP][dD][fF]')
+            if entry.name.startswith('.') or not entry.name.lower().endswith('.pdf'):
+                continue
+            yield entry.path
+
+
+'''
+Hashes (sha256) the files one at a time and adds the digests as leaves to
+tree, e.g. a merkle_tree.BinaryMerkleTree
+'''
+def hash_certificates_into_tree(cert_files, tree):
+    with instrumentation.span('hashing'):
+        for f in cert_files:
+            with open(f, 'rb') as cert:
+                data = cert.read()
+            tree.add_leaf(hashlib.sha256(data).digest())
+            instrumentation.count('bytes', len(data))
@@ -9,30 +9,32 @@ import sys
 import hashlib
 import getpass
 import binascii
-import configargparse
+
+from blockchain_certificates import configure_logging
+from blockchain_certificates import instrumentation
+from blockchain_certificates import node_client
+from blockchain_certificates import utils
+from blockchain_certificates import utxo_pool as utxo_pools
 
 
 
 '''
-Issues bytes to the Bitcoin's blockchain using OP_RETURN.
+Issues bytes to the Bitcoin's blockchain using OP_RETURN. With a utxo_pool
+(or conf.utxo_pool_size) the transaction spends a UTXO leased from the pool
+instead of the address' confirmed UTXOs so that transactions can be sent
+concurrently (see utxo_pool).
 '''
-def issue_op_return(conf, op_return_bstring, interactive=False):
+def issue_op_return(conf, op_return_bstring, interactive=False, utxo_pool=None):
 
     # load apropriate blockchain libraries
     if(conf.blockchain == 'litecoin'):
-        from litecoinutils.setup import setup
-        from litecoinutils.proxy import NodeProxy
         from litecoinutils.transactions import Transaction, TxInput, TxOutput
-        from litecoinutils.keys import P2pkhAddress, P2wpkhAddress
         from litecoinutils.script import Script
-        from litecoinutils.utils import to_satoshis, is_address_bech32
+        from litecoinutils.utils import to_satoshis
     else:
-        from bitcoinutils.setup import setup
-        from bitcoinutils.proxy import NodeProxy
         from bitcoinutils.transactions import Transaction, TxInput, TxOutput
-        from bitcoinutils.keys import P2pkhAddress, P2wpkhAddress
         from bitcoinutils.script import Script
-        from bitcoinutils.utils import to_satoshis, is_address_bech32
+        from bitcoinutils.utils import to_satoshis
 
 
     op_return_hex = binascii.hexlify(op_return_bstring).decode()
@@ -56,118 +58,134 @@ def issue_op_return(conf, op_return_bstring, interactive=False):
         if not consent:
             sys.exit()
 
-    #import time
-    #start = time.time()
-
     # test explicitly when non interactive
     if not conf.full_node_rpc_password and interactive:
         conf.full_node_rpc_password = getpass.getpass('\nPlease enter the password for the node\'s RPC user: ')
 
-    # initialize full node connection
-    if(conf.testnet):
-        setup('testnet')
-    else:
-        setup('mainnet')
+    proxy = node_client.get_node_client(conf)
 
-    host, port = conf.full_node_url.split(':')   # TODO: update when NodeProxy accepts full url!
-    proxy = NodeProxy(conf.full_node_rpc_user, conf.full_node_rpc_password,
-                      host, port).get_proxy()
+    # checks if address is native segwit or not; the network is passed
+    # explicitly (no global setup()) so that chains can be used concurrently
+    is_addr_bech32 = utils.is_address_bech32(conf.issuing_address,
+                                             conf.blockchain, conf.testnet)
+    change_script_out = Script.from_raw(utils.address_to_script_pub_key(
+        conf.issuing_address, conf.blockchain, conf.testnet))
 
-    # checks if address is native segwit or not.
-    is_addr_bech32 = is_address_bech32(conf.issuing_address)
+    if utxo_pool is None and getattr(conf, 'utxo_pool_size', 0):
+        utxo_pool = utxo_pools.get_utxo_pool(conf)
 
     # create transaction
     tx_outputs = []
-    unspent = sorted(proxy.listunspent(1, 9999999, [conf.issuing_address]),
-                     key=lambda x: x['amount'], reverse=False)
-
-    if not unspent:
-        raise ValueError("No UTXOs found")
-
-    issuing_pubkey = proxy.getaddressinfo(conf.issuing_address)['pubkey']
-
-    tx = None
-    tx_inputs = []
-    inputs_amount = 0
-
-    # coin selection: use smallest UTXO and if not enough satoshis add next
-    # smallest, etc. until sufficient tx fees are accumulated
-    # TODO wrt dust instead of adding another UTXO we should just remove the
-    # change_output and allocate the remaining (<546sats) to fees
-    for utxo in unspent:
-        txin = TxInput(utxo['txid'], utxo['vout'])
-        tx_inputs.append(txin)
-        inputs_amount += utxo['amount']
-
-        # currently bitcoin lib requires explicit instantiation; made method to
-        # check this; update if/when the library fixes/automates this
-        change_script_out = None
-        if is_addr_bech32:
-            change_script_out = P2wpkhAddress(conf.issuing_address).to_script_pub_key()
-        else:
-            change_script_out = P2pkhAddress(conf.issuing_address).to_script_pub_key()
-
-        change_output = TxOutput(to_satoshis(inputs_amount), change_script_out)
-
-        op_return_output = TxOutput(to_satoshis(0), Script(['OP_RETURN', op_return_cert_protocol]))
-        tx_outputs = [ change_output, op_return_output ]
-
-        tx = Transaction(tx_inputs, tx_outputs, has_segwit=is_addr_bech32)
-
-        # sign transaction to get its size
-        r = proxy.signrawtransactionwithwallet(tx.serialize())
-        if r['complete'] == None:
-            if interactive:
-                sys.exit("Transaction couldn't be signed by node")
+    leased_utxo = None
+    try:
+        # time creating and signing the tx; user confirmation is not included
+        with instrumentation.span('sign'):
+            if utxo_pool:
+                leased_utxo = utxo_pool.lease()
+                unspent = [ leased_utxo ]
+                # no other UTXO can be added to a transaction of the pool
+                if not utxo_pool.covers(leased_utxo):
+                    raise RuntimeError("leased UTXO of {} cannot cover the fee and change".format(
+                        leased_utxo['amount']))
             else:
-                raise RuntimeError("Transaction couldn't be signed by node")
-
-        signed_tx = r['hex']
-        signed_tx_size = proxy.decoderawtransaction(signed_tx)['vsize']
-
-        # calculate fees and change in satoshis
-        tx_fee = signed_tx_size * conf.tx_fee_per_byte
-
-        change_amount = to_satoshis(inputs_amount) - tx_fee
-
-        # the default Bitcoin (and litecoin) Core node doesn't allow the creation of dust 
-        # UTXOs https://bitcoin.stackexchange.com/questions/10986/what-is-meant-by-bitcoin-dust
-        # if change is less than 546 (2940 for litecoin) satoshis that is considered dust 
-        # (with the default node parameters) then include another UTXO
-        if conf.blockchain == 'litecoin':
-            if change_amount >= 3000:
-                break
-        else:
-            if change_amount >= 550:
-                break
-
-    if(change_amount < 0):
-        if interactive:
-            sys.exit("Specified address cannot cover the transaction fee of: {} satoshis".format(tx_fee))
-        else:
-            raise RuntimeError("insufficient satoshis, cannot create transaction")
-
-    # update tx out for change and re-sign
-    tx.outputs[0].amount = change_amount
-    r = proxy.signrawtransactionwithwallet(tx.serialize())
-    if r['complete'] == None:
+                unspent, address_info = proxy.batch([
+                    ['listunspent', 1, 9999999, [conf.issuing_address]],
+                    ['getaddressinfo', conf.issuing_address] ])
+                unspent = sorted(unspent, key=lambda x: x['amount'], reverse=False)
+
+                if not unspent:
+                    raise ValueError("No UTXOs found")
+
+                # the node's wallet has to be able to sign for the issuing address
+                if 'pubkey' not in address_info:
+                    raise ValueError("Issuing address is not in the node's wallet")
+
+            tx = None
+            tx_inputs = []
+            inputs_amount = 0
+
+            # coin selection: use smallest UTXO and if not enough satoshis add next
+            # smallest, etc. until sufficient tx fees are accumulated
+            # TODO wrt dust instead of adding another UTXO we should just remove the
+            # change_output and allocate the remaining (<546sats) to fees
+            for utxo in unspent:
+                txin = TxInput(utxo['txid'], utxo['vout'])
+                tx_inputs.append(txin)
+                inputs_amount += utxo['amount']
+
+                change_output = TxOutput(to_satoshis(inputs_amount), change_script_out)
+
+                op_return_output = TxOutput(to_satoshis(0), Script(['OP_RETURN', op_return_cert_protocol]))
+                tx_outputs = [ change_output, op_return_output ]
+
+                tx = Transaction(tx_inputs, tx_outputs, has_segwit=is_addr_bech32)
+
+                # sign transaction to get its size
+                r = proxy.signrawtransactionwithwallet(tx.serialize())
+                if r['complete'] == None:
+                    if interactive:
+                        sys.exit("Transaction couldn't be signed by node")
+                    else:
+                        raise RuntimeError("Transaction couldn't be signed by node")
+
+                signed_tx = r['hex']
+                signed_tx_size = proxy.decoderawtransaction(signed_tx)['vsize']
+
+                # calculate fees and change in satoshis
+                tx_fee = signed_tx_size * conf.tx_fee_per_byte
+
+                change_amount = to_satoshis(inputs_amount) - tx_fee
+
+                # the default Bitcoin (and litecoin) Core node doesn't allow the creation of dust 
+                # UTXOs https://bitcoin.stackexchange.com/questions/10986/what-is-meant-by-bitcoin-dust
+                # if change is less than 546 (2940 for litecoin) satoshis that is considered dust 
+                # (with the default node parameters) then include another UTXO
+                if conf.blockchain == 'litecoin':
+                    if change_amount >= 3000:
+                        break
+                else:
+                    if change_amount >= 550:
+                        break
+
+            # the leased UTXO alone has to leave change that is not dust
+            if leased_utxo and change_amount < utxo_pools.DUST_LIMIT.get(conf.blockchain, 550):
+                raise RuntimeError("leased UTXO of {} cannot cover the fee of {} satoshis and change".format(
+                    leased_utxo['amount'], tx_fee))
+
+            if(change_amount < 0):
+                if interactive:
+                    sys.exit("Specified address cannot cover the transaction fee of: {} satoshis".format(tx_fee))
+                else:
+                    raise RuntimeError("insufficient satoshis, cannot create transaction")
+
+            # update tx out for change and re-sign
+            tx.outputs[0].amount = change_amount
+            r = proxy.signrawtransactionwithwallet(tx.serialize())
+            if r['complete'] == None:
+                if interactive:
+                    sys.exit("Transaction couldn't be signed by node")
+                else:
+                    raise RuntimeError("Transaction couldn't be signed by node")
+            signed_tx = r['hex']
+
+        # send transaction
         if interactive:
-            sys.exit("Transaction couldn't be signed by node")
-        else:
-            raise RuntimeError("Transaction couldn't be signed by node")
-    signed_tx = r['hex']
+            print('The fee will be {} satoshis.\n'.format(tx_fee))
+            consent = input('Do you want to issue on the blockchain? [y/N]: ').lower() in ('y', 'yes')
+            if not consent:
+                sys.exit()
 
-    # send transaction
-    if interactive:
-        print('The fee will be {} satoshis.\n'.format(tx_fee))
-        consent = input('Do you want to issue on the blockchain? [y/N]: ').lower() in ('y', 'yes')
-        if not consent:
-            sys.exit()
+        with instrumentation.span('broadcast'):
+            tx_id = proxy.sendrawtransaction(signed_tx)
 
-    tx_id = proxy.sendrawtransaction(signed_tx)
+    except BaseException:
+        # the leased UTXO was not spent
+        if leased_utxo:
+            utxo_pool.release(leased_utxo)
+        raise
 
-    #end = time.time()
-    #print("publish_hash.issue_op_return()", end-start, " seconds")
+    if leased_utxo:
+        utxo_pool.spend(leased_utxo, tx_id, change_amount)
 
     return tx_id
 
@@ -177,6 +195,7 @@ Loads and returns the configuration options (either from --config or from
 specifying the specific options).
 '''
 def load_config():
+    import configargparse
     base_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
     default_config = os.path.join(base_dir, 'config.ini')
     p = configargparse.getArgumentParser(default_config_files=[default_config])
@@ -197,6 +216,7 @@ def main():
         sys.stderr.write('Python 3 is required!')
         sys.exit(1)
 
+    configure_logging()
     conf = load_config()
 
     # test with metadata and fake root
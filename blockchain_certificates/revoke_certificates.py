@@ -5,15 +5,18 @@ import os
 import sys
 import json
 import shutil
+import getpass
 import hashlib
 import binascii
-import configargparse
-
-from pdfrw import PdfReader, PdfWriter, PdfDict
+from concurrent.futures import ThreadPoolExecutor
 
+from blockchain_certificates import configure_logging
+from blockchain_certificates import instrumentation
 from blockchain_certificates import pdf_utils
 from blockchain_certificates import publish_hash
 from blockchain_certificates import cred_protocol
+from blockchain_certificates import utils
+from blockchain_certificates.chainpoint import decode_receipt
 
 
 '''
@@ -21,6 +24,7 @@ Creates a tmp file and the certificate without the chainpoint_proof. It gets
 the original hash to return and cleans up.
 '''
 def remove_chainpoint_proof_and_hash(pdf_file):
+    from pdfrw import PdfReader, PdfWriter, PdfDict
     filename = os.path.basename(pdf_file)
     tmp_filename =  '__' + filename
     shutil.copy(pdf_file, tmp_filename)
@@ -28,11 +32,11 @@ def remove_chainpoint_proof_and_hash(pdf_file):
     # get txid and target hash from proof
     pdf = PdfReader(tmp_filename)
     try:
-        proof = json.loads( pdf.Info.chainpoint_proof.decode() )
+        proof = decode_receipt( pdf.Info.chainpoint_proof.decode() )
     except AttributeError:
         # TODO: log error
         return None, None
-    except json.decoder.JSONDecodeError:
+    except ValueError:
         # TODO: log error
         return None, None
 
@@ -61,6 +65,7 @@ Revoke certificates given a list of valid certificates.
 '''
 def revoke_certificates(conf, interactive=False):
     certificates = conf.p
+    instrumentation.count('files', len(certificates))
     # for all certificates remove chainpoint receipt and get original hash
     txid_to_revoke = None
     hashes_to_revoke = []
@@ -90,6 +95,43 @@ def revoke_certificates(conf, interactive=False):
     if len(hashes_to_revoke) % 2 != 0:
         final_odd_hash_to_revoke = hashes_to_revoke[-1]
 
+    # with a UTXO pool the revocations do not depend on each other and are
+    # sent concurrently, without stopping for every txid
+    if getattr(conf, 'utxo_pool_size', 0):
+        revocations = [ (hash1, hash2) for hash1, hash2 in
+                        zip(hashes_to_revoke[0::2], hashes_to_revoke[1::2]) ]
+        if final_odd_hash_to_revoke:
+            revocations.append((final_odd_hash_to_revoke,))
+        if interactive:
+            consent = input('Do you want to send {} revocation transactions? [y/N]: '.format(
+                len(revocations))).lower() in ('y', 'yes')
+            if not consent:
+                sys.exit()
+            if not conf.full_node_rpc_password:
+                conf.full_node_rpc_password = getpass.getpass('\nPlease enter the password for the node\'s RPC user: ')
+        with ThreadPoolExecutor(max_workers=conf.utxo_pool_size) as executor:
+            futures = [ executor.submit(publish_hash.issue_op_return, conf,
+                                        cred_protocol.revoke_creds_cmd(txid, *hashes))
+                        for hashes in revocations ]
+        # a failed revocation does not affect the ones already sent; report
+        # every transaction with the hashes it revokes
+        results = []
+        errors = []
+        for hashes, future in zip(revocations, futures):
+            hexes = [ binascii.hexlify(h).decode('utf-8') for h in hashes ]
+            try:
+                results.append({ "txid": future.result(), "hashes": hexes })
+            except Exception as e:
+                errors.append({ "hashes": hexes, "error": str(e) })
+        if interactive:
+            for result in results:
+                print('\nTx hash: {}'.format(result['txid']))
+            for error in errors:
+                print('\nRevocation of {} failed: {}'.format(
+                    ', '.join(error['hashes']), error['error']))
+            return
+        return { "results": results, "errors": errors }
+
     # iterate every two certificates
     revoke_tx_hashes = []
     for hash1, hash2 in zip(hashes_to_revoke[0::2], hashes_to_revoke[1::2]):
@@ -135,25 +177,9 @@ Revoke an issuing address
 '''
 def revoke_address(conf, interactive=False):
 
-    if(conf.blockchain == 'litecoin'):
-        from litecoinutils.setup import setup
-        from litecoinutils.keys import P2pkhAddress, P2wpkhAddress
-        from litecoinutils.utils import is_address_bech32
-    else:
-        from bitcoinutils.setup import setup
-        from bitcoinutils.keys import P2pkhAddress, P2wpkhAddress
-        from bitcoinutils.utils import is_address_bech32
-
-    # initialize full node connection
-    if(conf.testnet):
-        setup('testnet')
-    else:
-        setup('mainnet')
-
-    if(is_address_bech32(conf.issuing_address)):
-        address = P2wpkhAddress(conf.issuing_address).to_hash160()
-    else:
-        address = P2pkhAddress(conf.issuing_address).to_hash160()
+    # the network is passed explicitly; works for P2PKH and P2WPKH addresses
+    address = utils.address_to_hash160(conf.issuing_address, conf.blockchain,
+                                       conf.testnet)
     op_return_bstring = cred_protocol.revoke_address_cmd(address)
     revoked_txid = publish_hash.issue_op_return(conf, op_return_bstring)
     if interactive:
@@ -168,6 +194,7 @@ Loads and returns the configuration options (either from --config or from
 specifying the specific options.
 '''
 def load_config():
+    import configargparse
     base_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
     default_config = os.path.join(base_dir, 'config.ini')
     p = configargparse.getArgumentParser(
@@ -192,6 +219,9 @@ def load_config():
 
     p.add_argument('-t', '--testnet', action='store_true', help='specify if testnet or mainnet will be used')
     p.add_argument('-f', '--tx_fee_per_byte', type=int, default=100, help='the fee per transaction byte in satoshis')
+    p.add_argument('--utxo_pool_size', type=int, default=0, help='fan out the issuing address\' funds into this many UTXOs and lease them to transactions so that they do not wait for confirmations; 0 disables the pool')
+    p.add_argument('--metrics_file', type=str, help='write per-stage timings and counters to this file (Prometheus text format if it ends in .prom, JSON otherwise)')
+    p.add_argument('--profile', action='store_true', help='profile the run with cProfile and tracemalloc and write the stats and a per-stage peak memory summary to the working directory')
     args, _ = p.parse_known_args()
     return args
 
@@ -218,8 +248,14 @@ def main():
         sys.stderr.write('Python 3 is required!')
         sys.exit(1)
 
+    configure_logging()
     conf = load_config()
-    revoke(conf, True)
+    with instrumentation.reporting(conf.metrics_file), \
+         instrumentation.profiling(conf.working_directory if conf.profile else None,
+                                   'revoke-certificates') as profile_files:
+        revoke(conf, True)
+    for f in profile_files:
+        print('Profile written to {}'.format(f))
 
 
 if __name__ == "__main__":
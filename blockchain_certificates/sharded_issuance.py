@@ -0,0 +1,197 @@
+'''
+Issues a batch that is split in shards processed by different machines. Each
+shard is described by a small JSON shard file that is passed between the
+workers and the coordinator (e.g. over shared storage):
+
+  1. every worker adds the metadata to and hashes the certificates of its
+     shard, builds the shard's merkle tree and writes its root to the shard
+     file (--hash_shard shard-01.json); the tree is kept in a tree store next
+     to the shard file
+  2. the coordinator builds a merkle tree of the shard roots, in the order the
+     shard files are given, anchors its root with a single transaction and
+     writes the txid and the shard root's proof, the proof suffix, to every
+     shard file (--combine shard-01.json shard-02.json ...)
+  3. every worker inserts the receipts in its certificates, each being the
+     certificate's proof in the shard tree followed by the proof suffix
+     (--insert_proofs shard-01.json)
+
+The receipts are ordinary chainpoint receipts of the anchored root and
+validate with ChainPointV2.validate_receipt.
+'''
+import os
+import sys
+import json
+
+from blockchain_certificates import configure_logging
+from blockchain_certificates import instrumentation
+from blockchain_certificates import issue_certificates
+from blockchain_certificates import pdf_utils
+from blockchain_certificates import tree_store
+from blockchain_certificates.chainpoint import ChainPointV2
+from blockchain_certificates.merkle_tree import BinaryMerkleTree
+
+
+'''
+The tree of a shard, as stored in its tree store, extended with the proof
+suffix from the shard root to the anchored merkle root
+'''
+class ShardTree(object):
+    def __init__(self, store, proof_suffix, merkle_root):
+        self.store = store
+        self.proof_suffix = proof_suffix
+        self.merkle_root = merkle_root
+
+    def get_leaf(self, index):
+        return self.store.get_leaf(index)
+
+    def get_leaf_count(self):
+        return self.store.get_leaf_count()
+
+    def get_tree_ready_state(self):
+        return True
+
+    def get_merkle_root(self):
+        return self.merkle_root
+
+    def get_proof(self, index):
+        proof = self.store.get_proof(index)
+        if proof is None:
+            return None
+        return proof + self.proof_suffix
+
+    def validate_proof(self, proof, target_hash, merkle_root):
+        return self.store.validate_proof(proof, target_hash, merkle_root)
+
+
+def _read_shard_file(shard_file):
+    with open(shard_file) as f:
+        return json.load(f)
+
+
+def _write_shard_file(shard_file, shard):
+    tmp_file = shard_file + '.tmp'
+    with open(tmp_file, 'w') as f:
+        json.dump(shard, f, indent=2)
+    os.replace(tmp_file, shard_file)
+
+
+'''
+Worker, step 1: adds the metadata to the certificates of the shard, hashes
+them into the shard's merkle tree and writes the shard root to shard_file.
+The tree is stored in shard_file + '.tree'. Returns the shard root.
+'''
+def hash_shard(conf, shard_file, interactive=False):
+    pdf_utils.add_metadata_only_to_pdf_certificates(conf, interactive)
+
+    certificates_directory = os.path.join(conf.working_directory,
+                                          conf.certificates_directory)
+    tree_file = shard_file + '.tree'
+    nodes_file = tree_file + '.nodes'
+    tree = BinaryMerkleTree(nodes_file)
+    try:
+        cp = issue_certificates.prepare_streaming_chainpoint_tree(
+            pdf_utils.iter_certificate_files(certificates_directory), tree)
+        if not cp.get_leaf_count():
+            raise ValueError("directory {} is empty".format(certificates_directory))
+        # not anchored yet; the txid is in the shard file after combine
+        tree_store.write_tree_store(tree_file, tree, '00' * 32, conf.blockchain,
+                                    conf.testnet)
+        root = cp.get_merkle_root()
+    finally:
+        tree.close()
+        os.remove(nodes_file)
+
+    _write_shard_file(shard_file, { "root": root,
+                                    "leaf_count": cp.get_leaf_count(),
+                                    "tree_file": os.path.basename(tree_file) })
+    return root
+
+
+'''
+Coordinator, step 2: anchors the merkle root of the shard roots and adds the
+txid, merkle root and proof suffix to every shard file. Returns the txid.
+'''
+def combine_shards(conf, shard_files, interactive=False):
+    shards = [ _read_shard_file(f) for f in shard_files ]
+    for shard_file, shard in zip(shard_files, shards):
+        if 'root' not in shard:
+            raise ValueError("shard {} has not been hashed".format(shard_file))
+
+    cp = issue_certificates.prepare_chainpoint_tree(
+        [ shard['root'] for shard in shards ], BinaryMerkleTree())
+    txid = issue_certificates.issue_merkle_root(conf, cp, interactive)
+
+    for index, (shard_file, shard) in enumerate(zip(shard_files, shards)):
+        shard.update({ "txid": txid,
+                       "chain": conf.blockchain,
+                       "testnet": conf.testnet,
+                       "merkle_root": cp.get_merkle_root(),
+                       "proof_suffix": cp.get_proof(index) })
+        _write_shard_file(shard_file, shard)
+    return txid
+
+
+'''
+Worker, step 3: inserts the receipts in the certificates of the shard
+'''
+def insert_shard_proofs(conf, shard_file, interactive=False):
+    shard = _read_shard_file(shard_file)
+    if 'txid' not in shard:
+        raise ValueError("shard {} has not been combined".format(shard_file))
+
+    certificates_directory = os.path.join(conf.working_directory,
+                                          conf.certificates_directory)
+    tree_file = os.path.join(os.path.dirname(shard_file), shard['tree_file'])
+    with tree_store.TreeStore(tree_file) as store:
+        if store.get_merkle_root() != shard['root']:
+            raise ValueError("tree {} is not the tree of shard {}".format(
+                tree_file, shard_file))
+        cp = ChainPointV2(tree=ShardTree(store, shard['proof_suffix'],
+                                         shard['merkle_root']))
+        # receipts use the chain of the anchoring transaction
+        conf.blockchain = shard['chain']
+        conf.testnet = shard['testnet']
+        issue_certificates.insert_proof_to_certificates(
+            conf, cp, shard['txid'],
+            pdf_utils.iter_certificate_files(certificates_directory), interactive)
+    return shard['txid']
+
+
+'''
+Loads and returns the configuration options; these are the issue-certificates
+options plus one of the sharding steps
+'''
+def load_config():
+    import configargparse
+    base_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
+    default_config = os.path.join(base_dir, 'config.ini')
+    p = configargparse.getArgumentParser(default_config_files=[default_config])
+    group = p.add_mutually_exclusive_group(required=True)
+    group.add_argument('--hash_shard', type=str, help='worker: hash the certificates of the shard and write its root to this shard file')
+    group.add_argument('--combine', nargs='+', help='coordinator: anchor the root of these shard files and write back their proof suffixes')
+    group.add_argument('--insert_proofs', type=str, help='worker: insert the receipts to the certificates of the shard using this shard file')
+    issue_certificates.add_arguments(p)
+    args, _ = p.parse_known_args()
+    return args
+
+
+def main():
+    if sys.version_info.major < 3:
+        sys.stderr.write('Python 3 is required!')
+        sys.exit(1)
+
+    configure_logging()
+    conf = load_config()
+    with instrumentation.reporting(conf.metrics_file):
+        if conf.hash_shard:
+            root = hash_shard(conf, conf.hash_shard, True)
+            print('\nShard root: {}'.format(root))
+        elif conf.combine:
+            txid = combine_shards(conf, conf.combine, True)
+            print('\nTx hash: {}'.format(txid))
+        else:
+            insert_shard_proofs(conf, conf.insert_proofs, True)
+
+
+if __name__ == "__main__":
+    main()
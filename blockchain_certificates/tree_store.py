@@ -0,0 +1,182 @@
+'''
+Persists the merkle tree of an issuance so that the chainpoint receipt of
+any certificate can be regenerated, by index or by certificate hash, without
+the pdf files and without re-hashing the batch.
+
+The file has a fixed size header (txid, merkle root, chain, number of
+leaves), all the nodes of the tree (see merkle_tree.BinaryMerkleTree) and the
+leaf indexes sorted by leaf hash for lookups. It is memory-mapped when read so
+that a lookup or a receipt costs O(log n) regardless of the batch size.
+
+    tree_store.write_tree_store('batch.tree', tree, txid, 'bitcoin', True)
+
+    store = tree_store.TreeStore('batch.tree')
+    index = store.find(certificate_hash)
+    receipt = store.get_receipt(index)
+'''
+import mmap
+import array
+import struct
+import binascii
+
+from blockchain_certificates.chainpoint import ChainPointV2
+from blockchain_certificates.merkle_tree import HASH_SIZE, level_sizes, \
+                                                get_proof_from_nodes, validate_proof
+
+MAGIC = b'CREDTREE'
+VERSION = 1
+# magic, version, testnet, leaf count, txid, merkle root, chain
+HEADER = struct.Struct('<8sBB6xQ32s32s16s')
+HEADER_SIZE = 128
+INDEX_ITEM = 'Q'
+
+
+'''
+Returns an array of the leaf indexes sorted by leaf hash. The indexes are
+first placed in buckets by the first two bytes of their hash and then every
+(small) bucket is sorted, so memory is 8 bytes per leaf.
+'''
+def _sorted_leaf_indexes(nodes, leaf_count):
+    def leaf(i):
+        return bytes(nodes[i * HASH_SIZE:(i + 1) * HASH_SIZE])
+
+    def bucket(i):
+        return nodes[i * HASH_SIZE] << 8 | nodes[i * HASH_SIZE + 1]
+
+    counts = [ 0 ] * 65536
+    for i in range(leaf_count):
+        counts[bucket(i)] += 1
+    starts = []
+    total = 0
+    for c in counts:
+        starts.append(total)
+        total += c
+    ends = list(starts)
+
+    indexes = array.array(INDEX_ITEM, bytes(8 * leaf_count))
+    for i in range(leaf_count):
+        b = bucket(i)
+        indexes[ends[b]] = i
+        ends[b] += 1
+    for start, end in zip(starts, ends):
+        if end - start > 1:
+            indexes[start:end] = array.array(INDEX_ITEM,
+                                             sorted(indexes[start:end], key=leaf))
+    return indexes
+
+
+'''
+Writes tree, a BinaryMerkleTree that is made, together with the issuance's
+txid, chain and testnet to path
+'''
+def write_tree_store(path, tree, txid, chain, testnet):
+    if not tree.get_tree_ready_state() or tree.get_leaf_count() == 0:
+        raise ValueError('the merkle tree is empty or not made')
+    nodes = tree.get_nodes()
+    leaf_count = tree.get_leaf_count()
+    header = HEADER.pack(MAGIC, VERSION, 1 if testnet else 0, leaf_count,
+                         binascii.unhexlify(txid),
+                         binascii.unhexlify(tree.get_merkle_root()),
+                         chain.encode('utf-8'))
+    with open(path, 'wb') as f:
+        f.write(header.ljust(HEADER_SIZE, b'\0'))
+        # write in chunks to avoid copying large memory-mapped trees
+        chunk = 1 << 20
+        for start in range(0, len(nodes), chunk):
+            f.write(nodes[start:start + chunk])
+        _sorted_leaf_indexes(nodes, leaf_count).tofile(f)
+
+
+'''
+A tree store written by write_tree_store. It implements the merkle tree
+interface used by ChainPointV2 so that receipts are identical to the ones
+created during the issuance.
+'''
+class TreeStore(object):
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, version, testnet, leaf_count, txid, root,
+         chain) = HEADER.unpack_from(self._map)
+        if magic != MAGIC or version != VERSION:
+            self.close()
+            raise ValueError('{} is not a tree store'.format(path))
+        self.leaf_count = leaf_count
+        self.txid = binascii.hexlify(txid).decode('utf-8')
+        self.merkle_root = binascii.hexlify(root).decode('utf-8')
+        self.chain = chain.rstrip(b'\0').decode('utf-8')
+        self.testnet = bool(testnet)
+        nodes_size = sum(level_sizes(leaf_count)) * HASH_SIZE
+        self._nodes = memoryview(self._map)[HEADER_SIZE:HEADER_SIZE + nodes_size]
+        self._index = memoryview(self._map)[HEADER_SIZE + nodes_size:].cast(INDEX_ITEM)
+        self._cp = ChainPointV2(tree=self)
+
+    def close(self):
+        for view in ('_index', '_nodes'):
+            if getattr(self, view, None) is not None:
+                getattr(self, view).release()
+                setattr(self, view, None)
+        self._map.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+    def get_leaf(self, index):
+        return self._leaf_bytes(index).hex()
+
+    def get_leaf_count(self):
+        return self.leaf_count
+
+    def get_tree_ready_state(self):
+        return True
+
+    def get_merkle_root(self):
+        return self.merkle_root
+
+    def get_proof(self, index):
+        if index < 0 or index > self.leaf_count - 1:
+            return None
+        return get_proof_from_nodes(self._nodes, self.leaf_count, index)
+
+    def validate_proof(self, proof, target_hash, merkle_root):
+        return validate_proof(proof, target_hash, merkle_root)
+
+    '''
+    Returns the index of the leaf with the given hash (hex) or None if it was
+    not issued in this batch
+    '''
+    def find(self, leaf_hash):
+        target = binascii.unhexlify(leaf_hash)
+        low, high = 0, self.leaf_count
+        while low < high:
+            middle = (low + high) // 2
+            if self._leaf_bytes(self._index[middle]) < target:
+                low = middle + 1
+            else:
+                high = middle
+        if low < self.leaf_count and self._leaf_bytes(self._index[low]) == target:
+            return self._index[low]
+        return None
+
+    def _leaf_bytes(self, index):
+        return bytes(self._nodes[index * HASH_SIZE:(index + 1) * HASH_SIZE])
+
+    '''
+    Returns the chainpoint receipt of the leaf at index, identical to the
+    chainpoint_proof inserted in the certificate
+    '''
+    def get_receipt(self, index):
+        if index is None or index < 0 or index > self.leaf_count - 1:
+            return None
+        return self._cp.get_receipt(index, self.txid, self.chain, self.testnet)
+
+    '''
+    Returns the chainpoint receipt of the certificate with the given hash or
+    None if it was not issued in this batch
+    '''
+    def get_receipt_by_hash(self, leaf_hash):
+        return self.get_receipt(self.find(leaf_hash))
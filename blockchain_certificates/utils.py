@@ -74,3 +74,143 @@ def get_chain_and_testnet(chain_type):
 
 
 
+
+BASE58_ALPHABET = '123456789ABCDEFGHJKLMNPQRSTUVWXYZabcdefghijkmnopqrstuvwxyz'
+
+'''
+Decode a base58check string to bytes (version byte plus payload)
+'''
+def base58check_to_bytes(string):
+    number = 0
+    for char in string:
+        number = number * 58 + BASE58_ALPHABET.index(char)
+    # leading '1's are leading zero bytes
+    zeros = len(string) - len(string.lstrip('1'))
+    data = b'\x00' * zeros + number.to_bytes((number.bit_length() + 7) // 8, 'big')
+    payload, checksum = data[:-4], data[-4:]
+    if hashlib.sha256(hashlib.sha256(payload).digest()).digest()[:4] != checksum:
+        raise ValueError("Invalid checksum for address {}".format(string))
+    return payload
+
+'''
+Encode bytes (version byte plus payload) to a base58check string
+'''
+def bytes_to_base58check(payload):
+    data = payload + hashlib.sha256(hashlib.sha256(payload).digest()).digest()[:4]
+    number = int.from_bytes(data, 'big')
+    string = ''
+    while number:
+        number, remainder = divmod(number, 58)
+        string = BASE58_ALPHABET[remainder] + string
+    zeros = len(data) - len(data.lstrip(b'\x00'))
+    return '1' * zeros + string
+
+'''
+The base58 version bytes and bech32 prefix of addresses and WIF keys of each
+chain type. These are passed explicitly (by chain and testnet) instead of
+relying on the global network of bitcoinutils/litecoinutils setup() so that
+different chains can be handled concurrently. Litecoin P2SH addresses may
+still use bitcoin's version byte.
+'''
+NETWORK_PREFIXES = {
+    'bitcoin': { 'p2pkh': (0x00,), 'p2sh': (0x05,), 'wif': 0x80, 'hrp': 'bc' },
+    'bitcoin_testnet': { 'p2pkh': (0x6f,), 'p2sh': (0xc4,), 'wif': 0xef, 'hrp': 'tb' },
+    'litecoin': { 'p2pkh': (0x30,), 'p2sh': (0x32, 0x05), 'wif': 0xb0, 'hrp': 'ltc' },
+    'litecoin_testnet': { 'p2pkh': (0x6f,), 'p2sh': (0x3a, 0xc4), 'wif': 0xef, 'hrp': 'tltc' },
+}
+
+'''
+Get the prefixes of the network of chain and testnet (see NETWORK_PREFIXES)
+'''
+def get_network_prefixes(chain, testnet):
+    chain_type = get_chain_type(chain, testnet)
+    if chain_type is None:
+        raise ValueError("Unsupported blockchain {} - {}".format(chain, testnet))
+    return NETWORK_PREFIXES[chain_type]
+
+'''
+Decode an address to its type ('p2pkh', 'p2sh' or 'witness_v<n>') and hash
+(the witness program for segwit addresses). If chain is given the address has
+to belong to that network.
+'''
+def decode_address(address, chain=None, testnet=False):
+    prefixes = [ get_network_prefixes(chain, testnet) ] if chain else \
+        NETWORK_PREFIXES.values()
+    hrp = address[:address.rfind('1')].lower()
+    if any(hrp == p['hrp'] for p in prefixes):
+        from bitcoinutils import bech32
+        version, program = bech32.decode(hrp, address)
+        if version is None:
+            raise ValueError("Invalid address {}".format(address))
+        return 'witness_v{}'.format(version), bytes_to_hex(bytes(program))
+
+    payload = base58check_to_bytes(address)
+    if len(payload) != 21:
+        raise ValueError("Invalid address {}".format(address))
+    if any(payload[0] in p['p2pkh'] for p in prefixes):
+        return 'p2pkh', bytes_to_hex(payload[1:])
+    if any(payload[0] in p['p2sh'] for p in prefixes):
+        return 'p2sh', bytes_to_hex(payload[1:])
+    raise ValueError("Address {} is not a {} address".format(
+        address, get_chain_type(chain, testnet) if chain else 'supported'))
+
+'''
+Get the hash160 (hex) of a P2PKH or P2WPKH address of chain and testnet
+'''
+def address_to_hash160(address, chain, testnet):
+    address_type, address_hash = decode_address(address, chain, testnet)
+    if address_type not in ('p2pkh', 'witness_v0') or len(address_hash) != 40:
+        raise ValueError("Address {} is not a P2PKH or P2WPKH address".format(address))
+    return address_hash
+
+'''
+Check if an address is a segwit (bech32) address of chain and testnet
+'''
+def is_address_bech32(address, chain, testnet):
+    return decode_address(address, chain, testnet)[0].startswith('witness')
+
+'''
+Get the scriptPubKey (hex) that pays to an address; P2PKH, P2SH and segwit
+addresses of bitcoin and litecoin are supported. If chain is given the
+address has to belong to that network.
+'''
+def address_to_script_pub_key(address, chain=None, testnet=False):
+    address_type, address_hash = decode_address(address, chain, testnet)
+    if address_type == 'p2pkh':
+        return '76a914' + address_hash + '88ac'
+    if address_type == 'p2sh':
+        return 'a914' + address_hash + '87'
+    version = int(address_type[len('witness_v'):])
+    op_version = 0 if version == 0 else 0x50 + version
+    return bytes_to_hex(bytes([op_version, len(address_hash) // 2])) + address_hash
+
+'''
+Get the electrum protocol script hash of an address: the sha256 of its
+scriptPubKey in reverse byte order
+'''
+def address_to_scripthash(address):
+    digest = hashlib.sha256(hex_to_bytes(address_to_script_pub_key(address))).digest()
+    return bytes_to_hex(digest[::-1])
+
+'''
+Get the (compressed) P2PKH address of chain and testnet of a public key (hex,
+compressed or uncompressed)
+'''
+def public_key_to_address(public_key, chain, testnet):
+    key = hex_to_bytes(public_key)
+    if len(key) == 65:
+        key = bytes([2 + (key[64] & 1)]) + key[1:33]
+    version = get_network_prefixes(chain, testnet)['p2pkh'][0]
+    return bytes_to_base58check(bytes([version]) +
+                                ripemd160(hashlib.sha256(key).digest()))
+
+'''
+Decode a WIF private key of chain and testnet; returns the secret exponent
+and whether the public key is compressed
+'''
+def wif_to_secret_exponent(wif, chain, testnet):
+    payload = base58check_to_bytes(wif)
+    if payload[0] != get_network_prefixes(chain, testnet)['wif']:
+        raise ValueError("WIF key is not a {} key".format(get_chain_type(chain, testnet)))
+    compressed = len(payload) == 34 and payload[-1] == 1
+    return int.from_bytes(payload[1:33], 'big'), compressed
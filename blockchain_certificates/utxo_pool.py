@@ -0,0 +1,369 @@
+'''
+Manages the UTXOs of the issuing address so that several issuances and
+revocations can be sent concurrently, without waiting for the previous
+transaction to be confirmed.
+
+The issuing address' funds are fanned out into a pool of equally sized UTXOs.
+Every transaction leases one UTXO of the pool, which cannot be leased again,
+and once broadcast its change output is added to the pool (unconfirmed) to be
+leased by a later transaction. Leased UTXOs are locked in the node's wallet
+(lockunspent) and spent ones are tracked locally so the same coins are never
+used by two transactions, even by different processes using the same address
+and node.
+
+    pool = utxo_pool.get_utxo_pool(conf)
+    txid = publish_hash.issue_op_return(conf, op_return_bstring, utxo_pool=pool)
+
+The pool object is per process; it is shared by the threads of a process
+(e.g. the parallel revocations of revoke-certificates). Other processes see
+the locks and the unconfirmed change outputs through the node, so consecutive
+runs reuse the change of the previous one without waiting for it to be
+confirmed. Locks are kept in the node's memory; a process that dies while
+holding leases leaves them locked until the node restarts or they are
+unlocked with lockunspent.
+'''
+import time
+import decimal
+import threading
+
+from blockchain_certificates import instrumentation
+from blockchain_certificates import node_client
+from blockchain_certificates import utils
+
+import logging
+log = logging.getLogger( 'CRED Corelib' )
+
+# (over-)estimated vsize of an issuance/revocation transaction with one input
+TX_VSIZE = 300
+# the number of transactions a pool UTXO is sized to pay for
+TXS_PER_UTXO = 20
+# nodes reject transactions with more than 25 unconfirmed ancestors
+MAX_UNCONFIRMED_CHAIN = 24
+# minimum change amount in satoshis that is not considered dust
+DUST_LIMIT = { 'bitcoin': 550, 'litecoin': 3000 }
+# seconds between refreshes while other processes hold all the UTXOs
+CONTENTION_INTERVAL = 0.5
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def _to_coins(satoshis):
+    return decimal.Decimal(satoshis) / 100000000
+
+
+def _key(utxo):
+    return (utxo['txid'], utxo['vout'])
+
+
+def _outpoint(utxo):
+    return { "txid": utxo['txid'], "vout": utxo['vout'] }
+
+
+class UtxoPool(object):
+    def __init__(self, conf, size):
+        self.conf = conf
+        self.size = size
+        self.address = conf.issuing_address
+        self.utxo_amount = TX_VSIZE * TXS_PER_UTXO * conf.tx_fee_per_byte
+        # the smallest UTXO (in satoshis) that pays for a transaction and
+        # leaves a change output that is not dust
+        self.min_amount = TX_VSIZE * conf.tx_fee_per_byte + \
+                          DUST_LIMIT.get(conf.blockchain, 550)
+        self.proxy = node_client.get_node_client(conf)
+        self.address_info = None
+        # available UTXOs; key -> { txid, vout, amount, depth } where depth is
+        # the number of unconfirmed ancestors created by the pool
+        self._available = {}
+        self._leased = set()
+        self._spent = set()
+        self._filling = False
+        # whether UTXOs of the wallet are locked by other processes
+        self._contended = False
+        self._condition = threading.Condition()
+
+    '''
+    Reloads the UTXOs of the address from the node, including the unconfirmed
+    ones that the node considers safe (e.g. the change of earlier
+    transactions, also of other processes); their depth is their number of
+    unconfirmed ancestors. UTXOs that are leased or that were spent by the
+    pool (but may not be known to the node yet) are skipped and UTXOs locked
+    by other processes are not listed by the node.
+    '''
+    def refresh(self):
+        unspent, locked, address_info = self.proxy.batch([
+            ['listunspent', 0, 9999999, [self.address]],
+            ['listlockunspent'],
+            ['getaddressinfo', self.address] ])
+        # the node's wallet has to be able to sign for the issuing address
+        if 'pubkey' not in address_info:
+            raise ValueError("Issuing address is not in the node's wallet")
+        with self._condition:
+            self.address_info = address_info
+            self._contended = any(_key(o) not in self._leased and _key(o) not in self._spent
+                                  for o in locked)
+            for utxo in unspent:
+                key = _key(utxo)
+                if key in self._leased or key in self._spent:
+                    continue
+                if utxo.get('confirmations', 0) > 0:
+                    depth = 0
+                elif not utxo.get('safe', True):
+                    # unconfirmed coins from others could be double-spent
+                    continue
+                else:
+                    # ancestorcount includes the transaction itself
+                    depth = utxo.get('ancestorcount', 1)
+                    known = self._available.get(key)
+                    if known:
+                        depth = max(depth, known['depth'])
+                self._available[key] = { "txid": utxo['txid'], "vout": utxo['vout'],
+                                         "amount": utxo['amount'], "depth": depth }
+            self._condition.notify_all()
+
+    '''
+    Leases a UTXO that covers a transaction to a single transaction, fanning
+    out the address' funds when the pool has no such UTXOs. If all of them
+    are leased it waits up to timeout seconds for one to be returned. The
+    UTXO is locked in the node's wallet; UTXOs that another process locked or
+    spent first are dropped and another one is leased. While other processes
+    hold all the UTXOs it also waits up to timeout seconds, refreshing every
+    CONTENTION_INTERVAL seconds, for their change.
+    '''
+    def lease(self, timeout=60):
+        from bitcoinrpc.authproxy import JSONRPCException
+        while True:
+            utxo = self._lease(timeout)
+            try:
+                self.proxy.lockunspent(False, [ _outpoint(utxo) ])
+            except JSONRPCException as e:
+                log.info("UTXO {}:{} is not available: {}".format(
+                    utxo['txid'], utxo['vout'], e))
+                with self._condition:
+                    self._leased.discard(_key(utxo))
+                    self._contended = True
+                    self._condition.notify_all()
+                continue
+            except BaseException:
+                self._return(utxo)
+                raise
+            instrumentation.count('utxo_leases')
+            return utxo
+
+    # leases a UTXO of the pool without locking it in the node
+    def _lease(self, timeout):
+        deadline = time.time() + timeout
+        with self._condition:
+            utxo = self._take()
+            while utxo is None:
+                remaining = deadline - time.time()
+                if not self._leased and not self._filling:
+                    self._fill()
+                    utxo = self._take()
+                    if utxo is None:
+                        if not self._contended or remaining <= 0:
+                            raise ValueError("No UTXOs of at least {} satoshis available for {}".format(
+                                self.min_amount, self.address))
+                        self._condition.wait(min(remaining, CONTENTION_INTERVAL))
+                        utxo = self._take()
+                elif remaining <= 0 or not self._condition.wait(remaining):
+                    raise ValueError("No UTXOs available for {}".format(self.address))
+                else:
+                    utxo = self._take()
+            return utxo
+
+    # refreshes and fans out the pool, if needed, without holding the lock
+    def _fill(self):
+        self._filling = True
+        self._condition.release()
+        try:
+            self.refresh()
+            usable = [ u for u in self._usable() if self.covers(u) ]
+            if len(usable) < self.size:
+                try:
+                    self.fan_out()
+                except (ValueError, RuntimeError) as e:
+                    # e.g. only unconfirmed change is left; use what there is
+                    # or wait for the change of other processes
+                    if not usable and not self._contended:
+                        raise
+                    log.info("Pool of {} was not fanned out: {}".format(self.address, e))
+        finally:
+            self._condition.acquire()
+            self._filling = False
+            self._condition.notify_all()
+
+    def _usable(self):
+        return [ u for u in self._available.values()
+                 if u['depth'] < MAX_UNCONFIRMED_CHAIN ]
+
+    # takes the smallest usable UTXO that covers a transaction, if any
+    def _take(self):
+        usable = sorted(( u for u in self._usable() if self.covers(u) ),
+                        key=lambda u: u['amount'])
+        if not usable:
+            return None
+        utxo = usable[0]
+        del self._available[_key(utxo)]
+        self._leased.add(_key(utxo))
+        return utxo
+
+    '''
+    Returns whether the utxo pays for a transaction and a change output that
+    is not dust
+    '''
+    def covers(self, utxo):
+        return utxo['amount'] >= _to_coins(self.min_amount)
+
+    '''
+    Returns a leased UTXO that was not spent to the pool and unlocks it
+    '''
+    def release(self, utxo):
+        from bitcoinrpc.authproxy import JSONRPCException
+        try:
+            self.proxy.lockunspent(True, [ _outpoint(utxo) ])
+        except JSONRPCException as e:
+            # e.g. the node restarted and forgot the lock
+            log.info("UTXO {}:{} could not be unlocked: {}".format(
+                utxo['txid'], utxo['vout'], e))
+        self._return(utxo)
+
+    def _return(self, utxo):
+        with self._condition:
+            self._leased.discard(_key(utxo))
+            self._available[_key(utxo)] = utxo
+            self._condition.notify()
+
+    '''
+    Records that the leased UTXO was spent by txid and adds its change output,
+    if any, to the pool
+    '''
+    def spend(self, utxo, txid, change_satoshis, change_vout=0):
+        with self._condition:
+            self._leased.discard(_key(utxo))
+            self._spent.add(_key(utxo))
+            if change_satoshis > 0:
+                change = { "txid": txid, "vout": change_vout,
+                           "amount": _to_coins(change_satoshis),
+                           "depth": utxo['depth'] + 1 }
+                self._available[_key(change)] = change
+            self._condition.notify()
+
+    '''
+    Spends all the available confirmed UTXOs into a transaction with size
+    outputs of utxo_amount satoshis (or as many as the funds allow) plus
+    change, all to the issuing address, and adds them to the pool. The inputs
+    are locked in the node first; the ones that another process locked or
+    spent are skipped. Returns the txid.
+    '''
+    def fan_out(self):
+        from bitcoinrpc.authproxy import JSONRPCException
+        if(self.conf.blockchain == 'litecoin'):
+            from litecoinutils.transactions import Transaction, TxInput, TxOutput
+            from litecoinutils.script import Script
+            from litecoinutils.utils import to_satoshis
+        else:
+            from bitcoinutils.transactions import Transaction, TxInput, TxOutput
+            from bitcoinutils.script import Script
+            from bitcoinutils.utils import to_satoshis
+
+        with self._condition:
+            inputs = [ u for u in self._available.values() if u['depth'] == 0 ]
+            for u in inputs:
+                del self._available[_key(u)]
+                self._leased.add(_key(u))
+
+        # lock the inputs one at a time; a single lockunspent call fails as a
+        # whole if any of them is already locked
+        locked = []
+        try:
+            for u in inputs:
+                try:
+                    self.proxy.lockunspent(False, [ _outpoint(u) ])
+                    locked.append(u)
+                except JSONRPCException as e:
+                    log.info("UTXO {}:{} is not available: {}".format(
+                        u['txid'], u['vout'], e))
+                    self._contended = True
+        except BaseException:
+            for u in locked:
+                self.release(u)
+            raise
+        finally:
+            with self._condition:
+                for u in inputs:
+                    if u not in locked:
+                        self._leased.discard(_key(u))
+        inputs = locked
+        if not inputs:
+            raise ValueError("No UTXOs found")
+
+        try:
+            is_addr_bech32 = utils.is_address_bech32(self.address, self.conf.blockchain,
+                                                     self.conf.testnet)
+            script = Script.from_raw(utils.address_to_script_pub_key(
+                self.address, self.conf.blockchain, self.conf.testnet))
+
+            inputs_amount = to_satoshis(sum(u['amount'] for u in inputs))
+            # each output adds ~34 bytes and each input ~110 bytes
+            fee = (len(inputs) * 110 + (self.size + 1) * 34 + 20) * self.conf.tx_fee_per_byte
+            count = min(self.size, (inputs_amount - fee) // self.utxo_amount)
+            if count < 1:
+                raise RuntimeError("insufficient satoshis to fan out {} UTXOs of {} satoshis".format(
+                    self.size, self.utxo_amount))
+
+            tx_inputs = [ TxInput(u['txid'], u['vout']) for u in inputs ]
+            tx_outputs = [ TxOutput(self.utxo_amount, script) for i in range(count) ]
+            change_output = TxOutput(0, script)
+            tx = Transaction(tx_inputs, tx_outputs + [ change_output ],
+                             has_segwit=is_addr_bech32)
+
+            r = self.proxy.signrawtransactionwithwallet(tx.serialize())
+            signed_tx_size = self.proxy.decoderawtransaction(r['hex'])['vsize']
+            change_amount = inputs_amount - count * self.utxo_amount - \
+                            signed_tx_size * self.conf.tx_fee_per_byte
+            if change_amount < DUST_LIMIT.get(self.conf.blockchain, 550):
+                # leave the dust to the fee
+                tx.outputs.pop()
+                change_amount = 0
+            else:
+                change_output.amount = change_amount
+            r = self.proxy.signrawtransactionwithwallet(tx.serialize())
+            if not r.get('complete'):
+                raise RuntimeError("Transaction couldn't be signed by node")
+            txid = self.proxy.sendrawtransaction(r['hex'])
+        except BaseException:
+            for u in inputs:
+                self.release(u)
+            raise
+
+        log.info("Fanned out {} UTXOs of {} satoshis in tx {}".format(
+            count, self.utxo_amount, txid))
+        with self._condition:
+            for u in inputs:
+                self._leased.discard(_key(u))
+                self._spent.add(_key(u))
+            for vout in range(count):
+                self._available[(txid, vout)] = { "txid": txid, "vout": vout,
+                                                  "amount": _to_coins(self.utxo_amount),
+                                                  "depth": 1 }
+            if change_amount:
+                self._available[(txid, count)] = { "txid": txid, "vout": count,
+                                                   "amount": _to_coins(change_amount),
+                                                   "depth": 1 }
+            self._condition.notify_all()
+        return txid
+
+
+'''
+Returns the UTXO pool of the issuing address in conf, creating it with
+conf.utxo_pool_size UTXOs the first time; pools are shared by all the
+threads of the process
+'''
+def get_utxo_pool(conf):
+    key = (conf.blockchain, conf.testnet, conf.issuing_address, conf.full_node_url)
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            pool = _pools[key] = UtxoPool(conf, conf.utxo_pool_size)
+    return pool
@@ -1,28 +1,56 @@
 '''
 Validates a chain point v2 pdf certificate. It acquires the chainpoint_proof from the pdf's metadata, copies the certificate and removes chainpoint_proof to get the original certificate's hash
 '''
+import io
 import os
 import sys
 import json
-import shutil
+import glob
 import hashlib
-import configargparse
-from pdfrw import PdfReader, PdfWriter, PdfDict
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
 
+from blockchain_certificates import configure_logging
+from blockchain_certificates import instrumentation
 from blockchain_certificates import cred_protocol
 from blockchain_certificates import network_utils
 from blockchain_certificates import utils
-from blockchain_certificates.chainpoint import ChainPointV2
+from blockchain_certificates.chainpoint import ChainPointV2, decode_receipt
+
+# the reason of certificates validated with anchor_only
+ANCHORED_REASON = 'anchored, revocation not checked'
+
+'''
+Returns a PdfReader given either the path of a pdf file or its bytes
+'''
+def _read_pdf(pdf_file):
+    from pdfrw import PdfReader
+    if isinstance(pdf_file, (bytes, bytearray)):
+        return PdfReader(fdata=bytes(pdf_file))
+    return PdfReader(pdf_file)
+
+
+'''
+Blanks the given metadata fields of an already read pdf and returns the
+resulting pdf bytes (identical to what would be written to a file)
+'''
+def _blank_metadata(pdf, *fields):
+    from pdfrw import PdfWriter, PdfDict
+    pdf.Info.update(PdfDict(**{ f: '' for f in fields }))
+    out = io.BytesIO()
+    PdfWriter().write(out, pdf)
+    return out.getvalue()
+
 
 '''
 Gets issuer address from pdf metadata; requires backward compatibility using
 vpdf metadata version
 '''
 def get_issuer_address_and_proof(pdf_file):
-    pdf = PdfReader(pdf_file)
+    pdf = _read_pdf(pdf_file)
     try:
         version = pdf.Info.version
-        proof = json.loads( pdf.Info.chainpoint_proof.decode() )
+        proof = decode_receipt( pdf.Info.chainpoint_proof.decode() )
         if(version == '1' or version == '2'):
             issuer = json.loads( pdf.Info.issuer.decode() )
             return issuer['identity']['address'], proof
@@ -43,7 +71,7 @@ Gets issuer verification methods from pdf metadata; only available from pdf
 vpdf version 1 onwards
 '''
 def get_issuer_verification(pdf_file):
-    pdf = PdfReader(pdf_file)
+    pdf = _read_pdf(pdf_file)
     try:
         version = pdf.Info.version
         if(version == '1' or version == '2'):
@@ -70,39 +98,51 @@ def get_issuer_verification(pdf_file):
 Reads the chainpoint_proof metadata from the pdf file and then removes it
 '''
 def get_and_remove_chainpoint_proof(pdf_file):
-    pdf = PdfReader(pdf_file)
-    try:
-        proof = json.loads( pdf.Info.chainpoint_proof.decode() )
-    except AttributeError:
+    proof, pdf_data = _get_and_blank_chainpoint_proof(pdf_file)
+    if proof is None:
         return None
-    metadata = PdfDict(chainpoint_proof='')
-    pdf.Info.update(metadata)
-    PdfWriter().write(pdf_file, pdf)
+    with open(pdf_file, 'wb') as f:
+        f.write(pdf_data)
     return proof
 
 
+def _get_and_blank_chainpoint_proof(pdf_file):
+    pdf = _read_pdf(pdf_file)
+    try:
+        proof = decode_receipt( pdf.Info.chainpoint_proof.decode() )
+    except AttributeError:
+        return None, None
+    return proof, _blank_metadata(pdf, 'chainpoint_proof')
+
+
 '''
 Returns owner and owner_proof metadata from the pdf file and then removes it
 vpdf version 2 onwards
 '''
 def get_owner_and_remove_owner_proof(pdf_file):
-    pdf = PdfReader(pdf_file)
+    owner, proof, pdf_data = _get_owner_and_blank_owner_proof(pdf_file)
+    if pdf_data is not None:
+        with open(pdf_file, 'wb') as f:
+            f.write(pdf_data)
+    return owner, proof
+
+
+def _get_owner_and_blank_owner_proof(pdf_file):
+    pdf = _read_pdf(pdf_file)
     try:
         version = pdf.Info.version
         if(version == '2'):
             owner = pdf.Info.owner.decode()
             proof = pdf.Info.owner_proof.decode()
         else:
-            return None, None
+            return None, None, None
     except AttributeError:
-        return None, None
-    metadata = PdfDict(owner_proof='')
-    pdf.Info.update(metadata)
-    PdfWriter().write(pdf_file, pdf)
+        return None, None, None
+    pdf_data = _blank_metadata(pdf, 'owner_proof')
     if proof:
         owner = json.loads(owner)
 
-    return owner, proof
+    return owner, proof, pdf_data
 
 
 '''
@@ -139,23 +179,30 @@ Validate the certificate
 Version 2.1.0 has BtcOpReturn, LtcOpReturn, BtcTestnetOpReturn and LtcTestnetOpReturn
 Versions <2.1.0 depend on testnet parameter to be set (it only supported
 BtcOpReturn)!
+The certificate can be either a file path or the pdf bytes; no temporary files
+are created. The optional cache is shared with network_utils.
+With anchor_only only the issuance transaction is fetched and the receipt is
+validated against it; revocations are not checked (see ANCHORED_REASON).
 '''
-def validate_certificate(cert, issuer_identifier, blockchain_services):
-    filename = os.path.basename(cert)
-    tmp_filename =  '__' + filename
-    shutil.copy(cert, tmp_filename)
+def validate_certificate(cert, issuer_identifier, blockchain_services, cache=None,
+                         anchor_only=False):
+    if isinstance(cert, (bytes, bytearray)):
+        pdf_data = bytes(cert)
+    else:
+        with open(cert, 'rb') as pdf_file:
+            pdf_data = pdf_file.read()
+    instrumentation.count('files')
+    instrumentation.count('bytes', len(pdf_data))
 
     # returned proof can be ignored here but could compare with proof later on
-    issuer_address, _ = get_issuer_address_and_proof(tmp_filename)
+    issuer_address, _ = get_issuer_address_and_proof(pdf_data)
 
-    proof = get_and_remove_chainpoint_proof(tmp_filename)
+    proof, pdf_data = _get_and_blank_chainpoint_proof(pdf_data)
     if proof == None:
         return False, "no chainpoint_proof in metadata"
 
     # get the hash after removing the metadata
-    filehash = ''
-    with open(tmp_filename, 'rb') as pdf_file:
-        filehash = hashlib.sha256(pdf_file.read()).hexdigest()
+    filehash = hashlib.sha256(pdf_data).hexdigest()
 
     # instantiate chainpoint object
     cp = ChainPointV2()
@@ -168,7 +215,7 @@ def validate_certificate(cert, issuer_identifier, blockchain_services):
     data_before_issuance, data_after_issuance = \
         network_utils.get_all_op_return_hexes(issuer_address, txid,
                                               blockchain_services, chain,
-                                              testnet)
+                                              testnet, cache, anchor_only)
 
     # validate receipt
     valid, reason = cp.validate_receipt(proof, data_before_issuance[0], filehash, issuer_identifier)
@@ -179,68 +226,69 @@ def validate_certificate(cert, issuer_identifier, blockchain_services):
     if not valid and not reason.startswith("certificate expired"):
         return False, reason
 
-    # load apropriate blockchain libraries
+    # load apropriate blockchain libraries; signature verification does not
+    # depend on the network and addr->pkh (in revoke address) gets it
+    # explicitly, so no global setup() is needed and certificates of different
+    # chains can be validated concurrently
     if(chain == 'litecoin'):
-        from litecoinutils.setup import setup
-        from litecoinutils.keys import P2pkhAddress, P2wpkhAddress, PublicKey
-        from litecoinutils.utils import is_address_bech32
+        from litecoinutils.keys import PublicKey
     else:
-        from bitcoinutils.setup import setup
-        from bitcoinutils.keys import P2pkhAddress, P2wpkhAddress, PublicKey
-        from litecoinutils.utils import is_address_bech32
+        from bitcoinutils.keys import PublicKey
 
-    # set appropriate network (required for addr->pkh in revoke address)
-    if testnet:
-        setup('testnet')
-    else:
-        setup('mainnet')
-
-
-    # check if cert's issuance is after a revoke address cmd on that address
-    # and if yes then the issuance is invalid (address was revoked)
-    # we check before checking for cert revocations since if the issuance was
-    # after an address revocation it should show that as an invalid reason
-    # 0 index is the actual issuance -- ignore it
-    for i in range( len(data_before_issuance) )[1:] :
-        cred_dict = cred_protocol.parse_op_return_hex(data_before_issuance[i])
-        if cred_dict:
-            if cred_dict['cmd'] == cred_protocol.hex_op('op_revoke_address'):
-                if(is_address_bech32(issuer_address)):
-                    issuer_pkh = P2wpkhAddress(issuer_address).to_hash160()
-                else:
-                    issuer_pkh = P2pkhAddress(issuer_address).to_hash160()
-                if issuer_pkh == cred_dict['data']['pkh']:
-                    return False, "address was revoked"
-
-
-    # check if cert or batch was revoked from oldest to newest
-    for op_return in reversed(data_after_issuance):
-        cred_dict = cred_protocol.parse_op_return_hex(op_return)
-        if cred_dict:
-            if cred_dict['cmd'] == cred_protocol.hex_op('op_revoke_batch'):
-                if txid == cred_dict['data']['txid']:
-                    return False, "batch was revoked"
-            elif cred_dict['cmd'] == cred_protocol.hex_op('op_revoke_creds'):
-                if txid == cred_dict['data']['txid']:
-                    # compare the certificate hash bytes
-                    filehash_bytes = utils.hex_to_bytes(filehash)
-                    ripemd_filehash = utils.ripemd160(filehash_bytes)
-                    ripemd_hex = utils.bytes_to_hex(ripemd_filehash)
-                    if ripemd_hex == cred_dict['data']['hashes'][0]:
-                        return False, "cert hash was revoked"
-
-                    if len(cred_dict['data']['hashes']) > 1:
-                        if ripemd_hex == cred_dict['data']['hashes'][1]:
+
+    # address revocations are by pubkey hash; an issuer address that has none
+    # on this network (e.g. P2SH) makes them invalid instead of failing
+    try:
+        issuer_pkh = utils.address_to_hash160(issuer_address, chain, testnet)
+        issuer_address_error = None
+    except ValueError as e:
+        issuer_pkh = None
+        issuer_address_error = "invalid issuer address: {}".format(e)
+
+    # with anchor_only there is nothing to scan: before only contains the
+    # issuance and after is empty
+    with instrumentation.span('revocation_scan'):
+        # check if cert's issuance is after a revoke address cmd on that address
+        # and if yes then the issuance is invalid (address was revoked)
+        # we check before checking for cert revocations since if the issuance was
+        # after an address revocation it should show that as an invalid reason
+        # 0 index is the actual issuance -- ignore it
+        for i in range( len(data_before_issuance) )[1:] :
+            cred_dict = cred_protocol.parse_op_return_hex(data_before_issuance[i])
+            if cred_dict:
+                if cred_dict['cmd'] == cred_protocol.hex_op('op_revoke_address'):
+                    if issuer_pkh is None:
+                        return False, issuer_address_error
+                    if issuer_pkh == cred_dict['data']['pkh']:
+                        return False, "address was revoked"
+
+
+        # check if cert or batch was revoked from oldest to newest
+        for op_return in reversed(data_after_issuance):
+            cred_dict = cred_protocol.parse_op_return_hex(op_return)
+            if cred_dict:
+                if cred_dict['cmd'] == cred_protocol.hex_op('op_revoke_batch'):
+                    if txid == cred_dict['data']['txid']:
+                        return False, "batch was revoked"
+                elif cred_dict['cmd'] == cred_protocol.hex_op('op_revoke_creds'):
+                    if txid == cred_dict['data']['txid']:
+                        # compare the certificate hash bytes
+                        filehash_bytes = utils.hex_to_bytes(filehash)
+                        ripemd_filehash = utils.ripemd160(filehash_bytes)
+                        ripemd_hex = utils.bytes_to_hex(ripemd_filehash)
+                        if ripemd_hex == cred_dict['data']['hashes'][0]:
                             return False, "cert hash was revoked"
-            elif cred_dict['cmd'] == cred_protocol.hex_op('op_revoke_address'):
-                # if address revocation is found stop looking since all other
-                # revocations will be invalid
-                if(is_address_bech32(issuer_address)):
-                    issuer_pkh = P2wpkhAddress(issuer_address).to_hash160()
-                else:
-                    issuer_pkh = P2pkhAddress(issuer_address).to_hash160()
-                if issuer_pkh == cred_dict['data']['pkh']:
-                    break
+
+                        if len(cred_dict['data']['hashes']) > 1:
+                            if ripemd_hex == cred_dict['data']['hashes'][1]:
+                                return False, "cert hash was revoked"
+                elif cred_dict['cmd'] == cred_protocol.hex_op('op_revoke_address'):
+                    # if address revocation is found stop looking since all other
+                    # revocations will be invalid
+                    if issuer_pkh is None:
+                        return False, issuer_address_error
+                    if issuer_pkh == cred_dict['data']['pkh']:
+                        break
 
     # if not revoked but not valid this means that it was expired; now that we
     # checked for revocations we can show the expiry error
@@ -251,14 +299,12 @@ def validate_certificate(cert, issuer_identifier, blockchain_services):
     # with the owner's public key (vpdf v2)
 
     # get owner and owner_proof removing the latter
-    owner, owner_proof = get_owner_and_remove_owner_proof(tmp_filename)
+    owner, owner_proof, pdf_data = _get_owner_and_blank_owner_proof(pdf_data)
     if owner:
         # get public key
         pk = PublicKey.from_hex(owner['pk'])
         # get file hash
-        sha256_hash = None
-        with open(tmp_filename, 'rb' ) as pdf:
-            sha256_hash = hashlib.sha256(pdf.read()).hexdigest()
+        sha256_hash = hashlib.sha256(pdf_data).hexdigest()
 
         # finally check if owner signature is valid
         #print(pk.get_address().to_string(), pk.to_hex(), sha256_hash, owner_proof)
@@ -267,12 +313,9 @@ def validate_certificate(cert, issuer_identifier, blockchain_services):
                 pass
         except Exception:   #BadSignatureError:
             return False, 'owner signature could not be validated'
-        finally:
-            # cleanup
-            os.remove(tmp_filename)
-    else:
-        # cleanup now that we know it validated
-        os.remove(tmp_filename)
+
+    if anchor_only:
+        return True, ANCHORED_REASON + (' - ' + reason if reason else '')
 
     # in a valid credential the reason could contain an expiry date
     return True, reason
@@ -284,6 +327,7 @@ Loads and returns the configuration options (either from --config or from
 specifying the specific options.
 '''
 def load_config():
+    import configargparse
     base_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
     default_config = os.path.join(base_dir, 'config.ini')
     p = configargparse.getArgumentParser(default_config_files=[default_config])
@@ -297,79 +341,235 @@ def load_config():
     p.add_argument('-b', '--blockchain_services', type=str,
                    default='{ "services": [ {"blockcypher":{} } ], "required_successes": 1}',
                    help='Which blockchain services to use and the minimum required successes')
-    p.add_argument('-f', nargs='+', help='a list of certificate pdf files to validate')
+    p.add_argument('-f', nargs='+', help='the certificates to validate: pdf files, directories (recursively), glob patterns, zip/tar archives or - to read them from stdin')
+    p.add_argument('-k', '--workers', type=int, default=1, help='the number of certificates validated concurrently')
+    p.add_argument('--anchor_only', action='store_true', help='only check that the certificates are anchored by their issuance transaction, without fetching the address history; revocations are not checked')
+    p.add_argument('--jsonl', action='store_true', help='write the result of every certificate as a JSON line as soon as it is validated')
+    p.add_argument('--metrics_file', type=str, help='write per-stage timings and counters to this file (Prometheus text format if it ends in .prom, JSON otherwise)')
+    p.add_argument('--profile', action='store_true', help='profile the run with cProfile and tracemalloc and write the stats and a per-stage peak memory summary to the current directory')
     args, _ = p.parse_known_args()
     return args
 
 
-def validate_certificates(conf, interactive=False):
-    if len( conf.f ) >= 1:
-        certificates = conf.f
-        results_array = []
-        for cert in certificates:
-            if os.path.isfile(cert):
-                filename = os.path.basename(cert)
-                if(filename.lower().endswith('.pdf')):
-                    valid, reason = validate_certificate(cert,
-                                                         conf.issuer_identifier,
-                                                         json.loads(conf.blockchain_services))
-                    # get issuer and chainpoint proof
-                    issuer_address, proof = get_issuer_address_and_proof(cert)
-                    # get blockchain and testnet from proof
-                    chain, testnet, _ = get_chain_testnet_txid_from_chainpoint_proof(proof,
-                                                                                    issuer_address)
-                    if valid:
-                       
-                        # get verification information for issuer
-                        verify_issuer = get_issuer_verification(cert)
-
-                        # if valid then check issuer verification methods
-                        issuer_verification = None
-                        if verify_issuer:
-                            issuer_verification = \
-                                network_utils.check_issuer_verification_methods(issuer_address,
-                                                                                verify_issuer, testnet)
-                        if interactive:
-                            print('Certificate {} is valid!'.format(cert))
-                            if reason:
-                                print("(" + reason + ")")
-                            if issuer_verification:
-                                for k, v in issuer_verification.items():
-                                    if k == "domain" or k == "github":
-                                        print("Issuer verification method:", k,
-                                              "(", v['url'], ")", "->", v['success'])
-                                    else:
-                                        print("Issuer verification method:", k, "->", v['success'])
-                        else:
-                            results_array.append({ "cert": cert, "status":
-                                                  "valid", "reason": reason, "chain": chain,
-                                                  "testnet": testnet, "verification": issuer_verification })
-                    else:
-                        if interactive:
-                            print('Certificate {} is _not_ valid!'.format(cert))
-                            if reason:
-                                print("(" + reason + ")")
-                        else:
-                            results_array.append({ "cert": cert, "status":
-                                                  "invalid", "chain": chain,
-                                                  "testnet": testnet, "reason": reason })
+'''
+Validates a single certificate and returns its result dictionary, i.e. an
+element of the "results" returned by validate_certificates. The certificate
+can be a file path or the pdf bytes, in which case name is used as "cert".
+With anchor_only a certificate that would otherwise be "valid" is "anchored"
+since its revocations were not checked; validate it again without
+anchor_only for the full check.
+'''
+def get_certificate_result(cert, issuer_identifier, blockchain_services,
+                           name=None, cache=None, anchor_only=False):
+    if name is None:
+        name = cert
+
+    if not isinstance(cert, (bytes, bytearray)):
+        if not os.path.isfile(cert):
+            return { "cert": name, "status": "N/A", "chain": None,
+                     "testnet": None, "reason": "file not found" }
+        if not os.path.basename(cert).lower().endswith('.pdf'):
+            return { "cert": name, "status": "N/A", "chain": None,
+                     "testnet": None, "reason": "not a pdf file" }
+        with open(cert, 'rb') as pdf_file:
+            cert = pdf_file.read()
+
+    valid, reason = validate_certificate(cert, issuer_identifier,
+                                         blockchain_services, cache, anchor_only)
+    # get issuer and chainpoint proof
+    issuer_address, proof = get_issuer_address_and_proof(cert)
+    # get blockchain and testnet from proof
+    chain, testnet, _ = get_chain_testnet_txid_from_chainpoint_proof(proof,
+                                                                    issuer_address)
+    if not valid:
+        return { "cert": name, "status": "invalid", "chain": chain,
+                 "testnet": testnet, "reason": reason }
+
+    # get verification information for issuer
+    verify_issuer = get_issuer_verification(cert)
+
+    # if valid then check issuer verification methods
+    issuer_verification = None
+    if verify_issuer:
+        issuer_verification = \
+            network_utils.check_issuer_verification_methods(issuer_address,
+                                                            verify_issuer,
+                                                            testnet, cache)
+    return { "cert": name, "status": "anchored" if anchor_only else "valid",
+             "reason": reason, "chain": chain, "testnet": testnet,
+             "verification": issuer_verification }
+
+
+'''
+Prints a certificate result dictionary for the command-line user
+'''
+def _print_certificate_result(result):
+    cert = result['cert']
+    reason = result['reason']
+    if result['status'] in ('valid', 'anchored'):
+        if result['status'] == 'valid':
+            print('Certificate {} is valid!'.format(cert))
+        else:
+            print('Certificate {} is anchored (revocations not checked)'.format(cert))
+        if reason:
+            print("(" + reason + ")")
+        if result['verification']:
+            for k, v in result['verification'].items():
+                if k == "domain" or k == "github":
+                    print("Issuer verification method:", k,
+                          "(", v['url'], ")", "->", v['success'])
                 else:
-                    if interactive:
-                        print('Skipping non-pdf file: {}'.format(cert))
-                    else:
-                        results_array.append({ "cert": cert, "status": "N/A",
-                                              "chain": chain, "testnet": testnet,
-                                              "reason": "not a pdf file" })
+                    print("Issuer verification method:", k, "->", v['success'])
+    elif result['status'] == 'invalid':
+        print('Certificate {} is _not_ valid!'.format(cert))
+        if reason:
+            print("(" + reason + ")")
+    elif reason == 'not a pdf file':
+        print('Skipping non-pdf file: {}'.format(cert))
+    else:
+        print('Skipping non-existent file {}'.format(cert))
+
+
+ARCHIVE_EXTENSIONS = ('.zip', '.tar', '.tar.gz', '.tgz', '.tar.bz2', '.tbz2',
+                      '.tar.xz', '.txz')
+
+
+'''
+Expands the certificate arguments and yields file paths or, for certificates
+in archives, (name, pdf bytes) tuples that can be passed to
+iter_certificate_results. An argument can be a pdf file, a directory (scanned
+recursively for pdf files), a glob pattern, a zip or tar archive (pdf members
+are read into memory one at a time; nothing is extracted) or '-' to read the
+arguments from stdin, one per line (read as they come). Other paths, and
+glob patterns that match nothing, are yielded as is so that their result is
+"file not found".
+'''
+def iter_certificate_inputs(paths, stdin=None):
+    for path in paths:
+        if path == '-':
+            for line in (stdin or sys.stdin):
+                line = line.strip()
+                if line and line != '-':
+                    yield from iter_certificate_inputs([ line ])
+        elif os.path.isdir(path):
+            yield from _iter_directory(path)
+        elif os.path.isfile(path) and path.lower().endswith(ARCHIVE_EXTENSIONS):
+            yield from _iter_archive(path)
+        elif not os.path.exists(path) and any(c in path for c in '*?['):
+            matches = sorted(glob.iglob(path, recursive=True))
+            if matches:
+                yield from iter_certificate_inputs(matches)
             else:
-                if interactive:
-                    print('Skipping non-existent file {}'.format(cert))
-                else:
-                    results_array.append({ "cert": cert, "status": "N/A",
-                                          "chain": chain, "testnet": testnet, 
-                                          "reason": "file not found" })
+                yield path
+        else:
+            yield path
+
+
+def _iter_directory(directory):
+    for root, dirs, files in os.walk(directory):
+        dirs[:] = sorted(d for d in dirs if not d.startswith('.'))
+        for f in sorted(files):
+            if not f.startswith('.') and f.lower().endswith('.pdf'):
+                yield os.path.join(root, f)
 
 
-        return { "results": results_array }
+def _iter_archive(path):
+    import tarfile
+    import zipfile
+    if path.lower().endswith('.zip'):
+        with zipfile.ZipFile(path) as archive:
+            for member in archive.infolist():
+                if not member.is_dir() and member.filename.lower().endswith('.pdf'):
+                    yield '{}:{}'.format(path, member.filename), archive.read(member)
+    else:
+        # stream mode: members are read sequentially without seeking
+        with tarfile.open(path, 'r|*') as archive:
+            for member in archive:
+                if member.isfile() and member.name.lower().endswith('.pdf'):
+                    yield '{}:{}'.format(path, member.name), \
+                          archive.extractfile(member).read()
+
+
+'''
+Validates certificates and yields each result dictionary as soon as it is
+available, so that results can be acted upon immediately and memory stays
+flat. certificates is an iterable of file paths or (name, pdf bytes) tuples
+and is consumed lazily. With workers > 1 up to 2 x workers certificates are
+validated concurrently; results are yielded in order unless ordered is False,
+in which case they are yielded as they complete with an "index" key (the
+position of the certificate in certificates). A certificate that cannot be
+validated (e.g. a corrupt pdf) gets an "N/A" result with the error as reason. The cache of address histories
+and issuer verifications is shared by all the certificates. See
+get_certificate_result for anchor_only.
+'''
+def iter_certificate_results(certificates, issuer_identifier, blockchain_services,
+                             workers=1, ordered=True, cache=None, anchor_only=False):
+    if cache is None:
+        cache = network_utils.TTLCache()
+
+    def result(cert):
+        if isinstance(cert, tuple):
+            name, cert = cert
+        else:
+            name = cert
+        try:
+            return get_certificate_result(cert, issuer_identifier,
+                                          blockchain_services, name, cache,
+                                          anchor_only)
+        except Exception as e:
+            # e.g. a corrupt pdf; the other certificates are still validated
+            return { "cert": name, "status": "N/A", "chain": None,
+                     "testnet": None, "reason": "{}: {}".format(type(e).__name__, e) }
+
+    if workers <= 1:
+        for index, cert in enumerate(certificates):
+            r = result(cert)
+            if not ordered:
+                r['index'] = index
+            yield r
+        return
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        in_flight = deque()
+        for index, cert in enumerate(certificates):
+            in_flight.append((index, executor.submit(result, cert)))
+            if len(in_flight) >= 2 * workers:
+                yield from _completed_results(in_flight, ordered)
+        while in_flight:
+            yield from _completed_results(in_flight, ordered)
+
+
+# yields the next result in order or all the completed ones
+def _completed_results(in_flight, ordered):
+    if ordered:
+        index, future = in_flight.popleft()
+        yield future.result()
+        return
+    wait([ f for _, f in in_flight ], return_when=FIRST_COMPLETED)
+    for item in [ item for item in in_flight if item[1].done() ]:
+        in_flight.remove(item)
+        r = item[1].result()
+        r['index'] = item[0]
+        yield r
+
+
+def validate_certificates(conf, interactive=False):
+    if conf.f and len( conf.f ) >= 1:
+        certificates = iter_certificate_inputs(conf.f)
+        blockchain_services = json.loads(conf.blockchain_services)
+        results = iter_certificate_results(certificates, conf.issuer_identifier,
+                                           blockchain_services,
+                                           getattr(conf, 'workers', 1),
+                                           anchor_only=getattr(conf, 'anchor_only', False))
+        if getattr(conf, 'jsonl', False):
+            # one JSON line per certificate, as soon as it is validated
+            for result in results:
+                print(json.dumps(result), flush=True)
+        elif interactive:
+            for result in results:
+                _print_certificate_result(result)
+        else:
+            return { "results": list(results) }
 
     else:
         if interactive:
@@ -384,8 +584,14 @@ def main():
         sys.stderr.write('Python 3 is required!')
         sys.exit(1)
 
+    configure_logging()
     conf = load_config()
-    validate_certificates(conf, interactive=True)
+    with instrumentation.reporting(conf.metrics_file), \
+         instrumentation.profiling('.' if conf.profile else None,
+                                   'validate-certificates') as profile_files:
+        validate_certificates(conf, interactive=True)
+    for f in profile_files:
+        print('Profile written to {}'.format(f))
 
 
 if __name__ == "__main__":
@@ -0,0 +1,200 @@
+'''
+Long-running HTTP service that validates certificates. It keeps HTTP
+connections, address histories and issuer verification results warm across
+requests and bounds the number of concurrent validations with a worker pool.
+
+Endpoints:
+  POST /validate   with a pdf body (Content-Type: application/pdf); the
+                   certificate name can be passed with ?filename=
+  POST /validate   with a JSON body { "files": [ "path1.pdf", ... ] }; only
+                   available if paths_root is configured and only for files
+                   under that directory
+  GET  /health
+  GET  /metrics    Prometheus text format; only if started with --metrics
+
+With ?anchor_only=1 (or "anchor_only": true in the JSON body) only the
+issuance transactions are fetched and valid certificates are "anchored";
+revocations are not checked.
+
+Results are returned as { "results": [ ... ] } exactly as in
+validate_certificates.
+'''
+import os
+import sys
+import json
+from urllib.parse import urlparse, parse_qs
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from blockchain_certificates import configure_logging
+from blockchain_certificates import instrumentation
+from blockchain_certificates import network_utils
+from blockchain_certificates import validate_certificates
+
+import logging
+log = logging.getLogger( 'CRED Corelib' )
+
+
+'''
+Handles the validation requests; the server object holds the configuration,
+the worker pool and the shared cache
+'''
+class ValidationRequestHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        path = urlparse(self.path).path
+        if path == '/health':
+            self._send_json(200, { "status": "ok" })
+        elif path == '/metrics' and instrumentation.is_enabled():
+            data = instrumentation.to_prometheus().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+        else:
+            self._send_json(404, { "error": "not found" })
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        if url.path != '/validate':
+            self._send_json(404, { "error": "not found" })
+            return
+
+        length = int(self.headers.get('Content-Length', 0))
+        if length > self.server.max_upload_size:
+            self._send_json(413, { "error": "request body too large" })
+            return
+        body = self.rfile.read(length)
+
+        content_type = self.headers.get('Content-Type', '').split(';')[0].strip()
+        query = parse_qs(url.query)
+        anchor_only = query.get('anchor_only', ['0'])[0] in ('1', 'true')
+        try:
+            if content_type == 'application/json':
+                request = json.loads(body.decode('utf-8'))
+                files = request.get('files', [])
+                anchor_only = anchor_only or bool(request.get('anchor_only'))
+                certs = [ (self._local_path(f), f) for f in files ]
+            else:
+                name = query.get('filename', ['certificate.pdf'])[0]
+                certs = [ (body, name) ]
+        except ValueError as e:
+            self._send_json(400, { "error": str(e) })
+            return
+
+        futures = [ self.server.executor.submit(self.server.validate, cert, name,
+                                                anchor_only)
+                    for cert, name in certs ]
+        results = []
+        for f in futures:
+            try:
+                results.append(f.result())
+            except Exception as e:
+                log.error("Validation failed: " + str(e))
+                results.append({ "cert": None, "status": "error",
+                                 "reason": str(e) })
+        self._send_json(200, { "results": results })
+
+    '''
+    Resolves a requested path making sure it is under paths_root
+    '''
+    def _local_path(self, path):
+        root = self.server.paths_root
+        if not root:
+            raise ValueError("validating local paths is not enabled")
+        full_path = os.path.realpath(os.path.join(root, path))
+        if os.path.commonpath([root, full_path]) != root:
+            raise ValueError("path {} is outside paths_root".format(path))
+        return full_path
+
+    def _send_json(self, status, obj):
+        data = json.dumps(obj).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        log.info("%s - %s" % (self.address_string(), format % args))
+
+
+'''
+Threading HTTP server that owns the worker pool and the warm caches
+'''
+class ValidationServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, conf):
+        super().__init__((conf.host, conf.port), ValidationRequestHandler)
+        self.issuer_identifier = conf.issuer_identifier
+        self.blockchain_services = json.loads(conf.blockchain_services)
+        self.paths_root = os.path.realpath(conf.paths_root) if conf.paths_root else None
+        self.max_upload_size = conf.max_upload_size
+        self.executor = ThreadPoolExecutor(max_workers=conf.workers)
+        self.cache = network_utils.TTLCache(ttl=conf.cache_ttl,
+                                            maxsize=conf.cache_size)
+
+    '''
+    Validates a certificate (path or bytes) and returns its result dictionary
+    '''
+    def validate(self, cert, name, anchor_only=False):
+        return validate_certificates.get_certificate_result(cert,
+                                                            self.issuer_identifier,
+                                                            self.blockchain_services,
+                                                            name, self.cache,
+                                                            anchor_only)
+
+    def server_close(self):
+        super().server_close()
+        self.executor.shutdown(wait=True)
+
+
+'''
+Loads and returns the configuration options (either from --config or from
+specifying the specific options.
+'''
+def load_config():
+    import configargparse
+    base_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
+    default_config = os.path.join(base_dir, 'config.ini')
+    p = configargparse.getArgumentParser(default_config_files=[default_config])
+    p.add_argument('-c', '--config', required=False, is_config_file=True, help='config file path')
+    p.add_argument('-o', '--host', type=str, default='127.0.0.1', help='the interface to listen on')
+    p.add_argument('-r', '--port', type=int, default=8080, help='the port to listen on')
+    p.add_argument('-k', '--workers', type=int, default=8, help='the maximum number of concurrent validations')
+    p.add_argument('-y', '--cache_ttl', type=int, default=60, help='seconds to keep address histories and issuer verifications cached')
+    p.add_argument('-z', '--cache_size', type=int, default=1024, help='maximum number of cached entries')
+    p.add_argument('-m', '--max_upload_size', type=int, default=50*1024*1024, help='the maximum request body size in bytes')
+    p.add_argument('-e', '--paths_root', type=str, help='if set, local pdf files under this directory can be validated by path')
+    p.add_argument('-p', '--issuer_identifier', type=str, help='optional 8 bytes issuer code to be displayed in the blockchain')
+    p.add_argument('-b', '--blockchain_services', type=str,
+                   default='{ "services": [ {"blockcypher":{} } ], "required_successes": 1}',
+                   help='Which blockchain services to use and the minimum required successes')
+    p.add_argument('--metrics', action='store_true', help='collect per-stage timings and counters and expose them at /metrics')
+    args, _ = p.parse_known_args()
+    return args
+
+
+def main():
+    if sys.version_info.major < 3:
+        sys.stderr.write('Python 3 is required!')
+        sys.exit(1)
+
+    configure_logging()
+    conf = load_config()
+    if conf.metrics:
+        instrumentation.enable()
+    server = ValidationServer(conf)
+    print('Serving certificate validation on {}:{}'.format(conf.host, conf.port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -33,7 +33,10 @@ setup(name='blockchain-certificates',
               'create-certificates = blockchain_certificates.create_certificates:main',
               'validate-certificates = blockchain_certificates.validate_certificates:main',
               'issue-certificates = blockchain_certificates.issue_certificates:main',
-              'revoke-certificates = blockchain_certificates.revoke_certificates:main'
+              'issue-certificates-sharded = blockchain_certificates.sharded_issuance:main',
+              'issue-certificates-daemon = blockchain_certificates.issuance_daemon:main',
+              'revoke-certificates = blockchain_certificates.revoke_certificates:main',
+              'validate-certificates-server = blockchain_certificates.validation_server:main'
           ]
       },
       keywords='blockchain academic certificates'
@@ -0,0 +1,6 @@
+import os
+import sys
+
+# the local stand-ins for the node and the block explorers
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir,
+                                                'benchmarks')))
@@ -0,0 +1,121 @@
+import io
+import os
+import sys
+import json
+import time
+import base64
+import threading
+import urllib.error
+import urllib.request
+
+import pytest
+import configargparse
+
+from blockchain_certificates import issuance_daemon
+from blockchain_certificates import issue_certificates
+from blockchain_certificates.chainpoint import ChainPointV2
+
+
+def _pdf():
+    from pdfrw import PdfWriter, PdfDict, PdfName
+    out = io.BytesIO()
+    PdfWriter().addpage(PdfDict(Type=PdfName.Page, MediaBox=[ 0, 0, 100, 100 ])).write(out)
+    return base64.b64encode(out.getvalue()).decode('utf-8')
+
+
+def _certificates(*names):
+    return [ { "filename": name + '.pdf', "pdf": _pdf(), "data": { "name": name } }
+             for name in names ]
+
+
+@pytest.fixture
+def server(monkeypatch, tmp_path):
+    (tmp_path / 'dept').mkdir()
+    monkeypatch.setattr(configargparse, '_parsers', {})
+    monkeypatch.setattr(sys, 'argv', [ 'issue-certificates-daemon', '--port', '0',
+                                       '--jobs_root', str(tmp_path),
+                                       '--batch_size', '3',
+                                       '--batch_interval', '60',
+                                       '-a', 'mgs9DLttzvWFkZ46YLSNKSZbgSNiMNUsdJ',
+                                       '-t', '-w', 'password' ])
+    anchored = []
+    def issue_merkle_root(conf, cp, interactive=False):
+        anchored.append(cp.get_merkle_root())
+        return '{:064x}'.format(len(anchored))
+    monkeypatch.setattr(issue_certificates, 'issue_merkle_root', issue_merkle_root)
+
+    server = issuance_daemon.IssuanceServer(issuance_daemon.load_config())
+    server.anchored = anchored
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def _request(server, path, body=None):
+    url = 'http://127.0.0.1:{}{}'.format(server.server_address[1], path)
+    data = json.dumps(body).encode('utf-8') if body is not None else None
+    try:
+        with urllib.request.urlopen(url, data) as response:
+            return response.status, json.loads(response.read())
+    except urllib.error.HTTPError as e:
+        return e.code, json.loads(e.read())
+
+
+def _wait_for(server, job_id, status):
+    for i in range(200):
+        _, job = _request(server, '/jobs/' + job_id)
+        if job['status'] == status:
+            return job
+        time.sleep(0.05)
+    raise AssertionError("job {} is {}".format(job_id, job['status']))
+
+
+def test_jobs_are_anchored_in_one_batch(server):
+    _, first = _request(server, '/jobs', { "certificates": _certificates('a', 'b') })
+    _wait_for(server, first['job_id'], 'pending')
+    # batch_size is reached with the second job
+    _, second = _request(server, '/jobs', { "certificates": _certificates('c') })
+    jobs = [ _wait_for(server, j['job_id'], 'issued')
+             for j in (first, second) ]
+
+    assert len(server.anchored) == 1
+    assert jobs[0]['txid'] == jobs[1]['txid']
+    from pdfrw import PdfReader
+    cp = ChainPointV2()
+    for job in jobs:
+        for cert in job['certificates']:
+            pdf = PdfReader(fdata=base64.b64decode(cert['pdf']))
+            receipt = json.loads(pdf.Info.chainpoint_proof.decode())
+            assert receipt['merkleRoot'] == server.anchored[0]
+            assert receipt['anchors'][0]['sourceId'] == job['txid']
+            assert cp.validate_proof(receipt['proof'], receipt['targetHash'],
+                                     receipt['merkleRoot'])
+
+
+@pytest.mark.parametrize('job', [
+    { "working_directory": "../" },
+    { "working_directory": "/etc" },
+    { "working_directory": "dept", "csv_file": "/etc/passwd" },
+    { "working_directory": "dept", "csv_file": "../../graduates.csv" },
+    { "working_directory": "dept", "certificates_directory": "../.." },
+    { "working_directory": "dept", "csv_file": [ "graduates.csv" ] },
+    { "working_directory": 1 },
+])
+def test_job_paths_outside_their_directory_are_rejected(server, job):
+    status, response = _request(server, '/jobs', job)
+    assert status == 400
+    assert not server.jobs
+
+
+def test_finished_jobs_expire(server):
+    server.job_ttl = 0
+    _, job = _request(server, '/jobs', { "certificates": _certificates('a', 'b', 'c') })
+    _wait_for(server, job['job_id'], 'issued')
+    spooled = os.path.join(server.spool_directory, job['job_id'])
+    assert os.path.isdir(spooled)
+
+    _request(server, '/jobs', { "certificates": _certificates('d') })
+    status, _ = _request(server, '/jobs/' + job['job_id'])
+    assert status == 404
+    assert not os.path.exists(spooled)
@@ -0,0 +1,75 @@
+import json
+import random
+import argparse
+
+import pytest
+
+from blockchain_certificates import pdf_utils
+
+
+@pytest.mark.parametrize('chain', [ 'bitcoin', 'litecoin' ])
+def test_sign_message_matches_library(chain):
+    if chain == 'litecoin':
+        from litecoinutils.setup import setup
+        from litecoinutils.keys import PrivateKey, PublicKey
+    else:
+        from bitcoinutils.setup import setup
+        from bitcoinutils.keys import PrivateKey, PublicKey
+    # the library's sign_message derives the address with the global network
+    setup('mainnet')
+    conf = argparse.Namespace(blockchain=chain)
+    rng = random.Random(33)
+    for i in range(25):
+        key = PrivateKey(secret_exponent=rng.randrange(1, 2**256 - 2**32))
+        message = '{:064x}'.format(rng.getrandbits(256))
+        compressed = bool(i % 2)
+        sig = pdf_utils._sign_message(conf, key, message, compressed)
+        assert sig == key.sign_message(message, compressed)
+        address = key.get_public_key().get_address(compressed=compressed).to_string()
+        assert PublicKey.verify_message(address, sig, message)
+
+
+def _write_pdf(path):
+    from pdfrw import PdfWriter, PdfDict, PdfName
+    page = PdfDict(Type=PdfName.Page, MediaBox=[ 0, 0, 100, 100 ])
+    PdfWriter().addpage(page).write(path)
+
+
+def _metadata_conf(tmp_path, rows):
+    (tmp_path / 'certificates').mkdir()
+    with open(tmp_path / 'graduates.csv', 'w') as f:
+        f.write('name,degree\n')
+        for row in rows:
+            f.write(','.join(row) + '\n')
+    return argparse.Namespace(working_directory=str(tmp_path),
+                              csv_file='graduates.csv',
+                              certificates_directory='certificates',
+                              cert_names_csv_column='name', issuer='Issuer',
+                              issuing_address='mgs9DLttzvWFkZ46YLSNKSZbgSNiMNUsdJ',
+                              cert_metadata_columns='{ "columns": [ { "degree": { "label": "Degree" } } ] }',
+                              certificates_global_fields='',
+                              verify_issuer='{ "methods": [] }', blockchain='bitcoin',
+                              testnet=True)
+
+
+def test_metadata_matches_files_to_csv_ids(tmp_path):
+    from pdfrw import PdfReader
+    conf = _metadata_conf(tmp_path, [ ('1', 'BSc'), ('12', 'MSc') ])
+    for name in ('1_alice.pdf', '12_bob.pdf', 'other.pdf'):
+        _write_pdf(str(tmp_path / 'certificates' / name))
+
+    pdf_utils.add_metadata_only_to_pdf_certificates(conf)
+
+    degrees = {}
+    for name in ('1_alice.pdf', '12_bob.pdf'):
+        info = PdfReader(str(tmp_path / 'certificates' / name)).Info
+        degrees[name] = json.loads(info.metadata.decode())['degree']['value']
+    assert degrees == { '1_alice.pdf': 'BSc', '12_bob.pdf': 'MSc' }
+    assert PdfReader(str(tmp_path / 'certificates' / 'other.pdf')).Info is None
+
+
+def test_metadata_fails_for_csv_id_without_file(tmp_path):
+    conf = _metadata_conf(tmp_path, [ ('1', 'BSc'), ('2', 'MSc') ])
+    _write_pdf(str(tmp_path / 'certificates' / '1_alice.pdf'))
+    with pytest.raises(ValueError, match='skipping 2'):
+        pdf_utils.add_metadata_only_to_pdf_certificates(conf)
@@ -0,0 +1,21 @@
+import sys
+
+import configargparse
+
+from blockchain_certificates import sharded_issuance
+
+
+def test_load_config(monkeypatch, tmp_path):
+    # the parser is a process-wide singleton; start from a fresh one
+    monkeypatch.setattr(configargparse, '_parsers', {})
+    monkeypatch.setattr(sys, 'argv', [ 'issue-certificates-sharded',
+                                       '--hash_shard', 'shard-01.json',
+                                       '-d', str(tmp_path), '-t',
+                                       '--utxo_pool_size', '4' ])
+    conf = sharded_issuance.load_config()
+    assert conf.hash_shard == 'shard-01.json'
+    assert conf.combine is None
+    assert conf.working_directory == str(tmp_path)
+    assert conf.testnet
+    assert conf.utxo_pool_size == 4
+    assert conf.certificates_directory == 'certificates'
@@ -0,0 +1,110 @@
+import pytest
+
+from blockchain_certificates import utils
+
+# the keys and addresses of the secret exponent 1 on every network
+HASH160 = '751e76e8199196d454941c45d1b3a323f1433bd6'
+UNCOMPRESSED_HASH160 = '91b24bf9f5288532960ac687abb035127b1d28a5'
+# of the P2SH address that wraps the P2PKH script of HASH160
+SCRIPT_HASH160 = 'cd7b44d0b03f2d026d1e586d7ae18903b0d385f6'
+
+ADDRESSES = [
+    # chain, testnet, address, type, hash
+    ('bitcoin', False, '1BgGZ9tcN4rm9KBzDn7KprQz87SZ26SAMH', 'p2pkh', HASH160),
+    ('bitcoin', False, '1EHNa6Q4Jz2uvNExL497mE43ikXhwF6kZm', 'p2pkh', UNCOMPRESSED_HASH160),
+    ('bitcoin', False, '3LRW7jeCvQCRdPF8S3yUCfRAx4eqXFmdcr', 'p2sh', SCRIPT_HASH160),
+    ('bitcoin', False, 'bc1qw508d6qejxtdg4y5r3zarvary0c5xw7kv8f3t4', 'witness_v0', HASH160),
+    ('bitcoin', True, 'mrCDrCybB6J1vRfbwM5hemdJz73FwDBC8r', 'p2pkh', HASH160),
+    ('bitcoin', True, '2NByiBUaEXrhmqAsg7BbLpcQSAQs1EDwt5w', 'p2sh', SCRIPT_HASH160),
+    ('bitcoin', True, 'tb1qw508d6qejxtdg4y5r3zarvary0c5xw7kxpjzsx', 'witness_v0', HASH160),
+    ('litecoin', False, 'LVuDpNCSSj6pQ7t9Pv6d6sUkLKoqDEVUnJ', 'p2pkh', HASH160),
+    ('litecoin', False, 'MSdeRd4AsX3rRtX2Xvxp2JfaGmFHUYVk9A', 'p2sh', SCRIPT_HASH160),
+    # litecoin P2SH addresses with bitcoin's version byte
+    ('litecoin', False, '3LRW7jeCvQCRdPF8S3yUCfRAx4eqXFmdcr', 'p2sh', SCRIPT_HASH160),
+    ('litecoin', False, 'ltc1qw508d6qejxtdg4y5r3zarvary0c5xw7kgmn4n9', 'witness_v0', HASH160),
+    ('litecoin', True, 'mrCDrCybB6J1vRfbwM5hemdJz73FwDBC8r', 'p2pkh', HASH160),
+    ('litecoin', True, 'QfLUJVSUYxkryMdijHdMuJqsJoJqBxWhq2', 'p2sh', SCRIPT_HASH160),
+    ('litecoin', True, '2NByiBUaEXrhmqAsg7BbLpcQSAQs1EDwt5w', 'p2sh', SCRIPT_HASH160),
+    ('litecoin', True, 'tltc1qw508d6qejxtdg4y5r3zarvary0c5xw7klfsuq0', 'witness_v0', HASH160),
+]
+
+
+@pytest.mark.parametrize('chain,testnet,address,address_type,address_hash', ADDRESSES)
+def test_decode_address(chain, testnet, address, address_type, address_hash):
+    assert utils.decode_address(address, chain, testnet) == (address_type, address_hash)
+    assert utils.decode_address(address) == (address_type, address_hash)
+    assert utils.is_address_bech32(address, chain, testnet) == \
+           (address_type == 'witness_v0')
+
+
+@pytest.mark.parametrize('chain,testnet,address,address_type,address_hash', ADDRESSES)
+def test_address_to_script_pub_key(chain, testnet, address, address_type, address_hash):
+    script = utils.address_to_script_pub_key(address, chain, testnet)
+    assert script == {
+        'p2pkh': '76a914' + address_hash + '88ac',
+        'p2sh': 'a914' + address_hash + '87',
+        'witness_v0': '0014' + address_hash }[address_type]
+    assert utils.address_to_script_pub_key(address) == script
+
+
+@pytest.mark.parametrize('chain,testnet,address,address_type,address_hash', ADDRESSES)
+def test_address_to_hash160(chain, testnet, address, address_type, address_hash):
+    if address_type == 'p2sh':
+        with pytest.raises(ValueError):
+            utils.address_to_hash160(address, chain, testnet)
+    else:
+        assert utils.address_to_hash160(address, chain, testnet) == address_hash
+
+
+@pytest.mark.parametrize('address,chain,testnet', [
+    ('1BgGZ9tcN4rm9KBzDn7KprQz87SZ26SAMH', 'bitcoin', True),
+    ('1BgGZ9tcN4rm9KBzDn7KprQz87SZ26SAMH', 'litecoin', False),
+    ('mrCDrCybB6J1vRfbwM5hemdJz73FwDBC8r', 'bitcoin', False),
+    ('LVuDpNCSSj6pQ7t9Pv6d6sUkLKoqDEVUnJ', 'bitcoin', False),
+    ('bc1qw508d6qejxtdg4y5r3zarvary0c5xw7kv8f3t4', 'litecoin', False),
+    ('tb1qw508d6qejxtdg4y5r3zarvary0c5xw7kxpjzsx', 'bitcoin', False),
+    # bad checksum
+    ('1BgGZ9tcN4rm9KBzDn7KprQz87SZ26SAMJ', 'bitcoin', False),
+])
+def test_address_of_another_network_fails(address, chain, testnet):
+    with pytest.raises(ValueError):
+        utils.address_to_hash160(address, chain, testnet)
+
+
+def test_address_to_scripthash():
+    # the example of the electrum protocol documentation
+    assert utils.address_to_scripthash('1A1zP1eP5QGefi2DMPTfTL5SLmv7DivfNa') == \
+        '8b01df4e368ea28f8dc0423bcf7a4923e3a12d307c875e47a0cfbf90b5c39161'
+
+
+@pytest.mark.parametrize('chain,testnet,wif,compressed', [
+    ('bitcoin', False, 'KwDiBf89QgGbjEhKnhXJuH7LrciVrZi3qYjgd9M7rFU73sVHnoWn', True),
+    ('bitcoin', False, '5HpHagT65TZzG1PH3CSu63k8DbpvD8s5ip4nEB3kEsreAnchuDf', False),
+    ('bitcoin', True, 'cMahea7zqjxrtgAbB7LSGbcQUr1uX1ojuat9jZodMN87JcbXMTcA', True),
+    ('bitcoin', True, '91avARGdfge8E4tZfYLoxeJ5sGBdNJQH4kvjJoQFacbgwmaKkrx', False),
+    ('litecoin', False, 'T33ydQRKp4FCW5LCLLUB7deioUMoveiwekdwUwyfRDeGZm76aUjV', True),
+    ('litecoin', False, '6u823ozcyt2rjPH8Z2ErsSXJB5PPQwK7VVTwwN4mxLBFrao69XQ', False),
+    ('litecoin', True, 'cMahea7zqjxrtgAbB7LSGbcQUr1uX1ojuat9jZodMN87JcbXMTcA', True),
+    ('litecoin', True, '91avARGdfge8E4tZfYLoxeJ5sGBdNJQH4kvjJoQFacbgwmaKkrx', False),
+])
+def test_wif_to_secret_exponent(chain, testnet, wif, compressed):
+    assert utils.wif_to_secret_exponent(wif, chain, testnet) == (1, compressed)
+    other_chain = 'litecoin' if chain == 'bitcoin' else 'bitcoin'
+    if not testnet:
+        with pytest.raises(ValueError):
+            utils.wif_to_secret_exponent(wif, other_chain, testnet)
+    with pytest.raises(ValueError):
+        utils.wif_to_secret_exponent(wif, chain, not testnet)
+
+
+@pytest.mark.parametrize('chain,testnet,address', [
+    ('bitcoin', False, '1BgGZ9tcN4rm9KBzDn7KprQz87SZ26SAMH'),
+    ('bitcoin', True, 'mrCDrCybB6J1vRfbwM5hemdJz73FwDBC8r'),
+    ('litecoin', False, 'LVuDpNCSSj6pQ7t9Pv6d6sUkLKoqDEVUnJ'),
+])
+def test_public_key_to_address(chain, testnet, address):
+    x = '79be667ef9dcbbac55a06295ce870b07029bfcdb2dce28d959f2815b16f81798'
+    y = '483ada7726a3c4655da4fbfc0e1108a8fd17b448a68554199c47d08ffb10d4b8'
+    # uncompressed keys are compressed
+    for public_key in [ '02' + x, '04' + x + y ]:
+        assert utils.public_key_to_address(public_key, chain, testnet) == address
@@ -0,0 +1,162 @@
+import decimal
+import argparse
+import threading
+
+import pytest
+from fake_node import start_fake_node
+
+from blockchain_certificates import node_client
+from blockchain_certificates import publish_hash
+from blockchain_certificates import utxo_pool
+
+ADDRESS = 'mgs9DLttzvWFkZ46YLSNKSZbgSNiMNUsdJ'
+
+
+class FakeProxy(object):
+    def __init__(self, unspent=(), vsize=200):
+        self.unspent = list(unspent)
+        self.vsize = vsize
+        self.sent = []
+
+    def batch(self, calls):
+        return [ self.unspent, [], { "pubkey": "02" + "11" * 32 } ]
+
+    def signrawtransactionwithwallet(self, tx_hex):
+        return { "complete": True, "hex": tx_hex }
+
+    def decoderawtransaction(self, tx_hex):
+        return { "vsize": self.vsize }
+
+    def lockunspent(self, unlock, outputs):
+        return True
+
+    def sendrawtransaction(self, tx_hex):
+        self.sent.append(tx_hex)
+        return 'ff' * 32
+
+
+class FakePool(object):
+    def __init__(self, utxo, covers):
+        self.utxo = utxo
+        self._covers = covers
+        self.released = []
+        self.spent = []
+
+    def lease(self):
+        return self.utxo
+
+    def covers(self, utxo):
+        return self._covers
+
+    def release(self, utxo):
+        self.released.append(utxo)
+
+    def spend(self, utxo, txid, change_satoshis, change_vout=0):
+        self.spent.append(utxo)
+
+
+def _utxo(index, amount):
+    return { "txid": '{:064x}'.format(index), "vout": 0,
+             "amount": decimal.Decimal(amount), "depth": 0 }
+
+
+@pytest.fixture
+def conf():
+    return argparse.Namespace(blockchain='bitcoin', testnet=True,
+                              issuing_address=ADDRESS, tx_fee_per_byte=10,
+                              full_node_url='127.0.0.1:18332',
+                              full_node_rpc_user='user',
+                              full_node_rpc_password='password',
+                              utxo_pool_size=1)
+
+
+def test_lease_skips_utxos_that_do_not_cover_a_transaction(monkeypatch, conf):
+    proxy = FakeProxy([ _utxo(1, '0.00000600'), _utxo(2, '0.001') ])
+    monkeypatch.setattr(node_client, 'get_node_client', lambda conf: proxy)
+    pool = utxo_pool.UtxoPool(conf, 1)
+    assert pool.lease(timeout=0)['txid'] == '{:064x}'.format(2)
+    with pytest.raises(ValueError):
+        pool.lease(timeout=0)
+
+
+@pytest.mark.parametrize('covers, vsize', [ (False, 200), (True, 10000) ])
+def test_leased_utxo_that_cannot_pay_fee_and_change_is_released(monkeypatch, conf,
+                                                                covers, vsize):
+    proxy = FakeProxy(vsize=vsize)
+    monkeypatch.setattr(node_client, 'get_node_client', lambda conf: proxy)
+    pool = FakePool(_utxo(1, '0.00003'), covers)
+    with pytest.raises(RuntimeError):
+        publish_hash.issue_op_return(conf, b'test', utxo_pool=pool)
+    assert pool.released == [ pool.utxo ]
+    assert not pool.spent
+    assert not proxy.sent
+
+
+@pytest.fixture
+def node():
+    server, node = start_fake_node(utxo_count=2, utxo_amount=0.001)
+    node.url = '127.0.0.1:{}'.format(server.server_address[1])
+    yield node
+    server.shutdown()
+
+
+def _process_conf(conf, node, user):
+    # every "process" has its own node client and pool
+    return argparse.Namespace(**dict(vars(conf), full_node_url=node.url,
+                                     full_node_rpc_user=user))
+
+
+def test_pools_of_different_processes_do_not_share_utxos(node, conf):
+    pools = [ utxo_pool.UtxoPool(_process_conf(conf, node, 'process{}'.format(i)), 4)
+              for i in range(2) ]
+    txids = []
+    errors = []
+    def issue(pool):
+        try:
+            for i in range(5):
+                txids.append(publish_hash.issue_op_return(pool.conf, b'test',
+                                                          utxo_pool=pool))
+        except Exception as e:
+            errors.append(e)
+    threads = [ threading.Thread(target=issue, args=(pool,))
+                for pool in pools for i in range(3) ]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    # the fake node rejects double spends
+    assert not errors
+    assert len(set(txids)) == 30
+    spent = [ (tx.inputs[0].txid, tx.inputs[0].txout_index)
+              for tx in map(_decode, (h for _, h in node.broadcasts)) ]
+    assert len(spent) == len(set(spent))
+
+
+def _decode(tx_hex):
+    from bitcoinutils.transactions import Transaction
+    return Transaction.from_raw(tx_hex)
+
+
+def test_later_process_reuses_unconfirmed_change(node, conf):
+    first = utxo_pool.UtxoPool(_process_conf(conf, node, 'first'), 1)
+    txid = publish_hash.issue_op_return(first.conf, b'test', utxo_pool=first)
+
+    second = utxo_pool.UtxoPool(_process_conf(conf, node, 'second'), 1)
+    # the confirmed UTXOs are locked by the first process
+    node.lockunspent(False, [ { "txid": u['txid'], "vout": u['vout'] }
+                              for u in node.listunspent(1) ])
+    utxo = second.lease(timeout=0)
+    assert (utxo['txid'], utxo['vout'], utxo['depth']) == (txid, 0, 1)
+    second.release(utxo)
+    assert (txid, 0) not in node.locked
+
+
+def test_leases_are_locked_in_the_node(node, conf):
+    pool = utxo_pool.UtxoPool(_process_conf(conf, node, 'process'), 1)
+    utxo = pool.lease(timeout=0)
+    assert node.locked == { (utxo['txid'], utxo['vout']) }
+    assert (utxo['txid'], utxo['vout']) not in [ (u['txid'], u['vout'])
+                                                 for u in node.listunspent(0) ]
+    pool.release(utxo)
+    assert not node.locked
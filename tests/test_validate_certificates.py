@@ -0,0 +1,67 @@
+import zipfile
+
+import pytest
+
+from blockchain_certificates import utils
+from blockchain_certificates import validate_certificates
+
+
+@pytest.mark.parametrize('workers,ordered', [ (1, True), (2, True), (2, False) ])
+def test_corrupt_member_gets_result(tmp_path, workers, ordered):
+    archive = str(tmp_path / 'certs.zip')
+    with zipfile.ZipFile(archive, 'w') as z:
+        z.writestr('a.pdf', b'garbage')
+        z.writestr('b.pdf', b'%PDF-1.4 truncated')
+    inputs = list(validate_certificates.iter_certificate_inputs([ archive ])) + \
+             [ str(tmp_path / 'missing.pdf') ]
+
+    results = list(validate_certificates.iter_certificate_results(
+        inputs, None, {}, workers=workers, ordered=ordered))
+
+    if not ordered:
+        assert sorted(r.pop('index') for r in results) == [ 0, 1, 2 ]
+        results.sort(key=lambda r: r['cert'])
+    assert [ r['cert'] for r in results ] == \
+           [ archive + ':a.pdf', archive + ':b.pdf', str(tmp_path / 'missing.pdf') ]
+    assert all(r['status'] == 'N/A' for r in results)
+    assert results[0]['reason'].startswith('PdfParseError')
+    assert results[2]['reason'] == 'file not found'
+
+
+@pytest.fixture
+def issued_by(monkeypatch):
+    from blockchain_certificates import cred_protocol
+    from blockchain_certificates import network_utils
+    from blockchain_certificates.chainpoint import ChainPointV2
+
+    # a certificate of a batch whose issuer address was revoked before (or
+    # after) the issuance
+    def issued_by(address, chain_type, revoked_before):
+        proof = { "anchors": [ { "type": chain_type, "sourceId": 'aa' * 32 } ] }
+        revocation = utils.bytes_to_hex(cred_protocol.revoke_address_cmd('00' * 20))
+        history = ([ 'issuance', revocation ], []) if revoked_before else \
+                  ([ 'issuance' ], [ revocation ])
+        monkeypatch.setattr(validate_certificates, 'get_issuer_address_and_proof',
+                            lambda pdf: (address, proof))
+        monkeypatch.setattr(validate_certificates, '_get_and_blank_chainpoint_proof',
+                            lambda pdf: (proof, pdf))
+        monkeypatch.setattr(network_utils, 'get_all_op_return_hexes',
+                            lambda *args: history)
+        monkeypatch.setattr(ChainPointV2, 'validate_receipt',
+                            lambda *args: (True, None))
+    return issued_by
+
+
+@pytest.mark.parametrize('revoked_before', [ True, False ])
+@pytest.mark.parametrize('address,chain_type', [
+    # P2SH
+    ('2NByiBUaEXrhmqAsg7BbLpcQSAQs1EDwt5w', 'BTCTestnetOpReturn'),
+    # of another network
+    ('mrCDrCybB6J1vRfbwM5hemdJz73FwDBC8r', 'LTCOpReturn'),
+])
+def test_issuer_address_without_pubkey_hash_is_invalid(issued_by, address, chain_type,
+                                                       revoked_before):
+    issued_by(address, chain_type, revoked_before)
+    valid, reason = validate_certificates.validate_certificate(b'%PDF', 'UNicDC', {})
+    assert not valid
+    assert reason.startswith('invalid issuer address')